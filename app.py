@@ -1,27 +1,63 @@
 # app.py
-# Version: 2.5.3 (Fix IndentationError & Remove Duplication)
+# Version: 2.19.11 (Read-only Map State Cache)
 # Main Flask application file for the Dynamic Map Renderer
 
 import os
+import sys
+import runpy
+if __name__ == '__main__':
+    # `python app.py` starts the server through server.py, so this file always runs as the `app` module (see server.py)
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'), run_name='__main__'); sys.exit()
 import json
 # import uuid # No longer needed for session IDs
 from flask import Flask, request, jsonify, render_template # Removed session as flask_session
-# Import send_from_directory explicitly
-from flask import send_from_directory
-from flask_socketio import SocketIO, emit as socketio_emit, join_room, leave_room
+from flask import send_file, Response, g
+from flask_socketio import SocketIO, emit as socketio_emit, join_room
 from werkzeug.utils import secure_filename
 import copy
-import traceback
+import logging
 import re # For basic session ID validation
+import threading
+import atexit
+import gzip
+import hashlib
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import io
+try: import brotli # Optional: enables precompressed brotli shaders
+except ImportError: brotli = None
+try: import cpu_renderer # Optional: needs NumPy; enables /api/snapshot
+except ImportError: cpu_renderer = None
+from PIL import Image, UnidentifiedImageError
+import tiles
+import ingest
+from update_scheduler import UpdateScheduler
+from session_store import create_session_store, SessionLimitError
+from map_catalog import MapCatalog, MAX_PAGE_SIZE, read_image_size
+from observability import configure_logging, MetricsRegistry, SIZE_BUCKETS
+from config_writer import WriteBehindWriter, write_json_atomic
 
 # Configuration
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 MAPS_FOLDER = os.path.join(APP_ROOT, 'maps')
 CONFIGS_FOLDER = os.path.join(APP_ROOT, 'configs')
 FILTERS_FOLDER = os.path.join(APP_ROOT, 'filters')
+TILES_FOLDER = os.path.join(APP_ROOT, 'tiles')
+INCOMING_FOLDER = os.path.join(APP_ROOT, 'incoming') # Uploads waiting to be ingested
+VARIANTS_FOLDER = os.path.join(APP_ROOT, 'variants') # Content-addressed WebP/AVIF map variants
+THUMBNAILS_FOLDER = os.path.join(APP_ROOT, 'thumbnails')
 ALLOWED_MAP_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 # Basic validation for session IDs (alphanumeric, hyphen, underscore, 1-50 chars)
 SESSION_ID_REGEX = re.compile(r'^[a-zA-Z0-9_-]{1,50}$')
+SNAPSHOT_FORMATS = {'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+SNAPSHOT_HEIGHTS = (240, 360, 480, 720, 1080, 1440, 2160) # Snapshot heights actually rendered; requests are rounded up to one
+SNAPSHOT_ASPECT_STEP = 0.125 # Snapshot aspect ratios are rounded to multiples of this
+# Assets requested with a ?v= matching their content hash never change, so browsers may cache them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+logger = logging.getLogger('dynamic_map')
 
 # --- Filter Loading ---
 available_filters = {}
@@ -44,17 +80,17 @@ def load_single_filter(filter_id):
         if os.path.exists(vertex_path): config_data['vertex_shader_path'] = os.path.join('filters', filter_id, 'vertex.glsl').replace('\\','/')
         if os.path.exists(fragment_path): config_data['fragment_shader_path'] = os.path.join('filters', filter_id, 'fragment.glsl').replace('\\','/')
         return config_data
-    except Exception as e: print(f"Error loading filter '{filter_id}': {e}"); traceback.print_exc(); return None
+    except Exception as e: logger.exception("Error loading filter '%s': %s", filter_id, e); return None
 
 def load_available_filters():
-    global available_filters; print(f"Scanning for filters in: {FILTERS_FOLDER}"); loaded_filters = {}
-    if not os.path.isdir(FILTERS_FOLDER): print(f"Warning: Filters directory not found: {FILTERS_FOLDER}"); return
+    global available_filters; logger.info("Scanning for filters in: %s", FILTERS_FOLDER); loaded_filters = {}
+    if not os.path.isdir(FILTERS_FOLDER): logger.warning("Filters directory not found: %s", FILTERS_FOLDER); return
     for item in os.listdir(FILTERS_FOLDER):
         item_path = os.path.join(FILTERS_FOLDER, item)
         if os.path.isdir(item_path):
             filter_id = item; filter_data = load_single_filter(filter_id)
-            if filter_data: loaded_filters[filter_id] = filter_data; print(f"  - Loaded filter: {filter_data['name']} (ID: {filter_id})")
-    available_filters = loaded_filters; print(f"Total filters loaded: {len(available_filters)}")
+            if filter_data: loaded_filters[filter_id] = filter_data; logger.debug("Loaded filter: %s (ID: %s)", filter_data['name'], filter_id)
+    available_filters = loaded_filters; logger.info("Total filters loaded: %d", len(available_filters))
 
 # --- File Extension Checker ---
 def allowed_map_file(filename):
@@ -66,13 +102,112 @@ app.config['SECRET_KEY'] = os.urandom(24)
 app.config['MAPS_FOLDER'] = MAPS_FOLDER
 app.config['CONFIGS_FOLDER'] = CONFIGS_FOLDER
 app.config['FILTERS_FOLDER'] = FILTERS_FOLDER
-os.makedirs(MAPS_FOLDER, exist_ok=True); os.makedirs(CONFIGS_FOLDER, exist_ok=True); os.makedirs(FILTERS_FOLDER, exist_ok=True)
+app.config['TILES_FOLDER'] = TILES_FOLDER
+app.config['INCOMING_FOLDER'] = INCOMING_FOLDER
+app.config['VARIANTS_FOLDER'] = VARIANTS_FOLDER
+app.config['THUMBNAILS_FOLDER'] = THUMBNAILS_FOLDER
+app.config['SESSION_STORE'] = os.environ.get('SESSION_STORE', 'memory') # 'memory' or 'sqlite'
+app.config['SESSION_DB_PATH'] = os.environ.get('SESSION_DB_PATH', os.path.join(APP_ROOT, 'sessions.db'))
+app.config['SESSION_MAX_COUNT'] = int(os.environ.get('SESSION_MAX_COUNT', 1000))
+app.config['SESSION_DB_TTL'] = float(os.environ.get('SESSION_DB_TTL', 30 * 86400)) # Seconds an unused session is kept by the sqlite store
+app.config['SESSION_DB_MAX_ROWS'] = int(os.environ.get('SESSION_DB_MAX_ROWS', 10000)) # Sessions kept by the sqlite store; least recently active deleted first
+app.config['SESSION_IDLE_TTL'] = float(os.environ.get('SESSION_IDLE_TTL', 6 * 3600)) # Seconds before an empty session is evicted
+app.config['SESSION_SWEEP_INTERVAL'] = 60
+app.config['GM_UPDATE_MAX_HZ'] = float(os.environ.get('GM_UPDATE_MAX_HZ', 30)) # Max broadcasts per second per session; 0 disables coalescing
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 2)) # Processes used for image decoding, transcoding and tiling
+app.config['MAP_MAX_DIMENSION'] = int(os.environ.get('MAP_MAX_DIMENSION', ingest.MAX_DIMENSION)) # Larger uploads are downscaled to fit
+app.config['INGEST_JOB_TTL'] = 3600 # Seconds finished ingest jobs stay queryable
+app.config['MAP_CATALOG_PATH'] = os.environ.get('MAP_CATALOG_PATH', os.path.join(APP_ROOT, 'catalog.db'))
+app.config['MAP_CATALOG_SCAN_INTERVAL'] = float(os.environ.get('MAP_CATALOG_SCAN_INTERVAL', 10)) # Seconds between maps folder rescans
+app.config['MAP_CATALOG_SYNC_WAIT'] = 60 # Seconds an upload waits for the first catalog scan before its duplicate check
+app.config['THUMBNAIL_BACKFILL_MAX'] = 4 # Thumbnail builds for maps that skipped ingest queued in the pool at once
+app.config['SNAPSHOT_CACHE_SIZE'] = int(os.environ.get('SNAPSHOT_CACHE_SIZE', 64)) # Encoded snapshots kept in memory
+app.config['SNAPSHOT_MAX_DIMENSION'] = 4096
+app.config['SNAPSHOT_MAX_RENDERS'] = int(os.environ.get('SNAPSHOT_MAX_RENDERS', 2)) # Snapshot renders running at once; further requests wait
+app.config['SNAPSHOT_RENDER_WAIT'] = 10 # Seconds a request waits for a render slot before getting a 503
+app.config['FILTERS_CHECK_INTERVAL'] = 2 # Seconds between checks of the filters folder for added/edited filters
+app.config['PLAYER_BOOTSTRAP_EMBED'] = os.environ.get('PLAYER_BOOTSTRAP_EMBED', '1') != '0' # Inline filters, shaders and session state into player.html
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO') # DEBUG also logs connections, joins and state resets
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'text') # 'text' or 'json' (one object per line)
+app.config['SESSION_STATS_INTERVAL'] = float(os.environ.get('SESSION_STATS_INTERVAL', 0)) # Seconds between per-session stats pushed to GM pages; 0 disables
+app.config['PREFETCH_QUEUE_MAX'] = int(os.environ.get('PREFETCH_QUEUE_MAX', 8)) # Upcoming maps a GM can queue per session for players to download in the background
+app.config['PREFETCH_MAX_SESSIONS'] = int(os.environ.get('PREFETCH_MAX_SESSIONS', 100)) # Sessions that can have a prefetch queue at the same time
+app.config['CONFIG_AUTOSAVE_INTERVAL'] = float(os.environ.get('CONFIG_AUTOSAVE_INTERVAL', 0)) # Seconds between write-backs of live view/filter changes to map configs; 0 disables
+os.makedirs(MAPS_FOLDER, exist_ok=True); os.makedirs(CONFIGS_FOLDER, exist_ok=True); os.makedirs(FILTERS_FOLDER, exist_ok=True); os.makedirs(TILES_FOLDER, exist_ok=True)
+os.makedirs(INCOMING_FOLDER, exist_ok=True); os.makedirs(VARIANTS_FOLDER, exist_ok=True); os.makedirs(THUMBNAILS_FOLDER, exist_ok=True)
 
+configure_logging('dynamic_map', app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
 load_available_filters()
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
-# --- In-Memory State Storage ---
-session_states = {}
+# --- Session State Storage ---
+# Each entry holds the session state, its monotonically increasing version and the sockets in the room
+session_store = create_session_store(app.config['SESSION_STORE'], app.config['SESSION_DB_PATH'], app.config['SESSION_MAX_COUNT'], app.config['SESSION_IDLE_TTL'],
+                                     app.config['SESSION_DB_TTL'], app.config['SESSION_DB_MAX_ROWS'], on_evict=lambda session_id: forget_session(session_id))
+atexit.register(session_store.close)
+
+# --- Map Catalog Storage ---
+map_catalog = MapCatalog(app.config['MAP_CATALOG_PATH'])
+atexit.register(map_catalog.close)
+
+# --- Metrics ---
+# Served in Prometheus text format on /metrics. Per-session series are dropped when the session store evicts
+# the session (see forget_session), so their number is bounded by SESSION_MAX_COUNT. Histograms are not per session.
+metrics = MetricsRegistry()
+SOCKET_CONNECTIONS = metrics.gauge('dmr_socket_connections', 'Connected Socket.IO clients')
+SESSIONS_LOADED = metrics.gauge('dmr_sessions_loaded', 'Sessions held by the session store', collect=lambda: {(): session_store.session_count()})
+SESSION_MEMBERS = metrics.gauge('dmr_session_members', 'Clients joined to each session', ['session'], collect=lambda: {(session_id,): count for session_id, count in session_store.member_counts().items()})
+GM_UPDATES = metrics.counter('dmr_gm_updates_total', 'GM updates applied to each session, after coalescing', ['session'])
+GM_UPDATE_SECONDS = metrics.histogram('dmr_gm_update_seconds', 'Time spent applying a GM update')
+GM_UPDATE_SESSION_SECONDS = metrics.counter('dmr_session_gm_update_seconds_total', 'Total time spent applying GM updates to each session; divide by dmr_gm_updates_total for the average', ['session'])
+BROADCASTS = metrics.counter('dmr_broadcasts_total', 'State messages broadcast to each session room', ['session'])
+BROADCAST_BYTES = metrics.counter('dmr_broadcast_bytes_total', 'JSON bytes of state messages broadcast to each session room (before per-player fan-out)', ['session'])
+BROADCAST_PAYLOAD_BYTES = metrics.histogram('dmr_broadcast_payload_bytes', 'JSON size of broadcast state messages', ['event'], buckets=SIZE_BUCKETS)
+STATE_RESYNCS = metrics.counter('dmr_state_resyncs_total', 'Full state resyncs requested by players')
+CONFIG_LOAD_SECONDS = metrics.histogram('dmr_config_load_seconds', 'Map config file load and migration time')
+CONFIG_SAVE_SECONDS = metrics.histogram('dmr_config_save_seconds', 'Map config file write time (atomic write and fsync, off the request path)')
+CONFIG_WRITES = metrics.counter('dmr_config_writes_total', 'Map config file writes by outcome', ['result'])
+CONFIG_SAVES_COALESCED = metrics.counter('dmr_config_saves_coalesced_total', 'Map config saves that replaced a queued, unwritten save of the same map')
+CONFIG_WRITE_QUEUE = metrics.gauge('dmr_config_write_queue', 'Map config saves waiting to be written', collect=lambda: {(): config_writer.pending_count()})
+MAP_BYTES_SERVED = metrics.counter('dmr_map_bytes_served_total', 'Bytes of map images, tiles, thumbnails and snapshots sent', ['kind', 'format'])
+CACHE_LOOKUPS = metrics.counter('dmr_cache_lookups_total', 'In-memory cache lookups; hit rate = hit / (hit + miss)', ['cache', 'result'])
+HTTP_REQUESTS = metrics.counter('dmr_http_requests_total', 'HTTP responses by endpoint and status', ['endpoint', 'status'])
+HTTP_REQUEST_SECONDS = metrics.histogram('dmr_http_request_seconds', 'HTTP request handling time by endpoint', ['endpoint'])
+INGEST_JOBS = metrics.counter('dmr_ingest_jobs_total', 'Finished map ingest jobs by outcome', ['status'])
+SNAPSHOT_RENDER_SECONDS = metrics.histogram('dmr_snapshot_render_seconds', 'Filter snapshot render and encode time')
+PREFETCH_REPORTS = metrics.counter('dmr_prefetch_reports_total', 'Queued map prefetch results reported by players', ['result'])
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+
+def record_gm_update(session_id, seconds):
+    # session_id is None for updates rejected before the session existed
+    GM_UPDATE_SECONDS.observe(seconds)
+    if session_id: GM_UPDATE_SESSION_SECONDS.inc(seconds, session=session_id)
+
+def record_broadcast(session_id, event, payload):
+    # Compact JSON length approximates what Socket.IO puts on the wire for each player
+    size = len(json.dumps(payload, separators=(',', ':')))
+    BROADCASTS.inc(session=session_id); BROADCAST_BYTES.inc(size, session=session_id); BROADCAST_PAYLOAD_BYTES.observe(size, event=event)
+
+def record_bytes_served(kind, path, status, byte_count):
+    if status in (200, 206) and byte_count: MAP_BYTES_SERVED.inc(byte_count, kind=kind, format=os.path.splitext(path)[1].lstrip('.').lower())
+
+def record_http_request(endpoint, status, seconds):
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=status); HTTP_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+
+def forget_session_metrics(session_id):
+    for metric in (GM_UPDATES, GM_UPDATE_SESSION_SECONDS, BROADCASTS, BROADCAST_BYTES): metric.remove(session=session_id)
+
+# --- Config Write-Behind ---
+# Map config saves are queued and written atomically by a background thread, so saves return immediately;
+# load_map_config reads queued data first, so a save is visible before it reaches the disk
+@CONFIG_SAVE_SECONDS.time()
+def write_map_config_file(config_path, config_data):
+    write_json_atomic(config_path, config_data)
+
+config_writer = WriteBehindWriter(write_map_config_file, on_written=lambda path, ok: CONFIG_WRITES.inc(result='ok' if ok else 'error'))
+atexit.register(config_writer.close)
 
 # --- Helper Functions ---
 # ** Corrected Indentation and Removed Semicolons **
@@ -81,13 +216,17 @@ def get_map_config_path(map_filename):
     config_filename = f"{secured_base}_config.json"
     return os.path.join(app.config['CONFIGS_FOLDER'], config_filename)
 
+@CONFIG_LOAD_SECONDS.time()
 def load_map_config(map_filename):
     config_path = get_map_config_path(map_filename) # Removed semicolon
-    if not os.path.exists(config_path):
+    pending = config_writer.get_pending(config_path)
+    if pending is None and not os.path.exists(config_path):
         return None
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = json.load(f)
+        if pending is not None: config_data = copy.deepcopy(pending) # Saved but not written yet
+        else:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config_data = json.load(f)
         # Check and migrate old path key
         if 'map_content_path' not in config_data and 'map_image_path' in config_data:
             config_data['map_content_path'] = config_data['map_image_path']
@@ -110,19 +249,20 @@ def load_map_config(map_filename):
         if 'map_content_path' not in config_data:
             return None
         return config_data
-    except Exception as e:
-        print(f"Error loading/parsing config for {map_filename}: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error loading/parsing config for %s", map_filename)
         return None
 
 def save_map_config(map_filename, config_data):
     config_path = get_map_config_path(map_filename) # Removed semicolon
+    config_data = copy.deepcopy(config_data) # Callers may pass shared cached state
     try:
         # Clean up before saving
         if 'map_image_path' in config_data:
             if 'map_content_path' not in config_data: config_data['map_content_path'] = config_data['map_image_path']
             del config_data['map_image_path']
         config_data['display_type'] = "image"
+        config_data.pop('map_content_version', None) # Derived from the image file, not persisted
         if 'filter_params' in config_data:
             params = config_data['filter_params']
             keys_to_remove = ['backgroundImageFilename', 'defaultFontFamily', 'defaultTextSpeed', 'fontSize']
@@ -133,28 +273,20 @@ def save_map_config(map_filename, config_data):
             config_data['filter_params'] = params
         expected_path = os.path.join('maps', secure_filename(map_filename)).replace('\\', '/')
         config_data['map_content_path'] = expected_path # Ensure path matches filename
-        # Write the file
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config_data, f, indent=2, ensure_ascii=False)
+        # Queue the write; repeated saves of a map before it is written are coalesced
+        if config_writer.submit(config_path, config_data): CONFIG_SAVES_COALESCED.inc()
+        invalidate_map_state(map_filename); map_catalog.set_fields(secure_filename(map_filename), has_config=1)
         return True
-    except Exception as e:
-        print(f"Error saving config for {map_filename}: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error saving config for %s", map_filename)
         return False
 
 def get_default_filter_params():
-    filter_params = {}
-    text_params = ['defaultFontFamily', 'defaultTextSpeed', 'fontSize']
-    for f_id, f_config in available_filters.items():
-        filter_params[f_id] = {
-            key: param_data.get('value')
-            for key, param_data in f_config.get('params', {}).items()
-            if 'value' in param_data and key != 'backgroundImageFilename' and key not in text_params
-        }
-    return filter_params
+    # Copy of the precomputed defaults (parameter values are JSON scalars, so two levels deep is a full copy)
+    return {f_id: dict(params) for f_id, params in get_filter_registry()['default_filter_params'].items()}
 
 def get_default_session_state():
-    default_filter_id = "none" if "none" in available_filters else list(available_filters.keys())[0] if available_filters else ""
+    default_filter_id = get_filter_registry()['default_filter']
     return {
         "map_content_path": None,
         "display_type": "image",
@@ -163,7 +295,7 @@ def get_default_session_state():
         "filter_params": get_default_filter_params()
     }
 
-def get_state_for_map(map_filename):
+def build_state_for_map(map_filename):
     config = load_map_config(map_filename)
     if config:
         loaded_filter_params = config.get("filter_params", {})
@@ -188,8 +320,8 @@ def get_state_for_map(map_filename):
         if os.path.exists(map_path_on_disk) and allowed_map_file(map_filename):
             relative_path = os.path.join('maps', secure_filename(map_filename)).replace('\\', '/')
             display_type = "image"
-            default_filter_id = "none" if "none" in available_filters else list(available_filters.keys())[0] if available_filters else ""
-            print(f"Generating default image state for map: {relative_path}")
+            default_filter_id = get_filter_registry()['default_filter']
+            logger.debug("Generating default image state for map: %s", relative_path)
             return {
                 "map_content_path": relative_path,
                 "display_type": display_type,
@@ -198,9 +330,480 @@ def get_state_for_map(map_filename):
                 "filter_params": get_default_filter_params()
             }
         else:
-            print(f"Warning: Map file not found or not allowed: {map_filename}")
+            logger.warning("Map file not found or not allowed: %s", map_filename)
             return None
 
+# --- Map State Cache ---
+# Parsed, migrated and defaults-merged map states, validated against the config and map file stats.
+# Returned states are shared with the cache, so they are frozen: changing one raises TypeError. Plain dict/list
+# subclasses (rather than MappingProxyType) keep them JSON-serializable; copy.deepcopy returns a mutable copy.
+map_state_cache = {} # secured filename -> (validation key, state)
+map_state_cache_lock = threading.Lock()
+
+def reject_change(self, *args, **kwargs): raise TypeError("Cached map state is read-only; copy it before modifying")
+
+class ReadOnlyDict(dict):
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = reject_change
+    def __copy__(self): return dict(self)
+    def __deepcopy__(self, memo): return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+    def __reduce__(self): return (dict, (dict(self),))
+
+class ReadOnlyList(list):
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = extend = insert = pop = remove = clear = sort = reverse = reject_change
+    def __copy__(self): return list(self)
+    def __deepcopy__(self, memo): return [copy.deepcopy(value, memo) for value in self]
+    def __reduce__(self): return (list, (list(self),))
+
+def freeze_state(value):
+    if isinstance(value, dict): return ReadOnlyDict((key, freeze_state(item)) for key, item in value.items())
+    if isinstance(value, list): return ReadOnlyList(freeze_state(item) for item in value)
+    return value
+
+def get_file_signature(path):
+    try: st = os.stat(path)
+    except OSError: return None
+    return (st.st_mtime_ns, st.st_size)
+
+def get_state_for_map(map_filename):
+    secured_filename = secure_filename(map_filename)
+    key = (get_file_signature(get_map_config_path(secured_filename)), get_file_signature(os.path.join(app.config['MAPS_FOLDER'], secured_filename)))
+    cached = map_state_cache.get(secured_filename); hit = bool(cached and cached[0] == key)
+    record_cache_lookup('map_state', hit)
+    if hit: return cached[1]
+    state = build_state_for_map(map_filename)
+    if state is not None:
+        state['map_content_version'] = get_content_hash(os.path.join(app.config['MAPS_FOLDER'], secured_filename)) # Versions the image URL for HTTP caching
+        state = freeze_state(state)
+    with map_state_cache_lock:
+        if state is not None: map_state_cache[secured_filename] = (key, state)
+        else: map_state_cache.pop(secured_filename, None)
+    return state
+
+# --- Content Hashing & HTTP Caching ---
+content_hash_cache = {} # absolute path -> (file signature, hash)
+shader_asset_cache = {} # absolute path -> (file signature, precompressed shader asset)
+pyramid_meta_cache = {} # map filename -> (meta file signature, meta)
+
+def get_content_hash(path):
+    # Truncated SHA-256 of the file contents, recomputed only when mtime/size change
+    signature = get_file_signature(path)
+    if signature is None: return None
+    cached = content_hash_cache.get(path); hit = bool(cached and cached[0] == signature)
+    record_cache_lookup('content_hash', hit)
+    if hit: return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''): digest.update(chunk)
+    content_hash = digest.hexdigest()[:16]
+    content_hash_cache[path] = (signature, content_hash)
+    return content_hash
+
+def get_cache_control(requested_version, content_hash):
+    return IMMUTABLE_CACHE_CONTROL if requested_version and content_hash and requested_version == content_hash else REVALIDATE_CACHE_CONTROL
+
+def make_precompressed_asset(data):
+    # Body with its content hash and gzip/brotli variants, served by precompressed_response()
+    return {"hash": hashlib.sha256(data).hexdigest()[:16], "identity": data, "gzip": gzip.compress(data, compresslevel=9), "br": brotli.compress(data) if brotli else None}
+
+def get_shader_asset(path):
+    # Shader source with its hash and gzip/brotli variants, compressed once per file change
+    signature = get_file_signature(path)
+    if signature is None: return None
+    cached = shader_asset_cache.get(path); hit = bool(cached and cached[0] == signature)
+    record_cache_lookup('shader_asset', hit)
+    if hit: return cached[1]
+    with open(path, 'rb') as f: data = f.read()
+    asset = make_precompressed_asset(data)
+    shader_asset_cache[path] = (signature, asset)
+    return asset
+
+def get_shader_url(filter_id, shader_type):
+    shader_path = resolve_shader_path(filter_id, shader_type)
+    asset = get_shader_asset(shader_path) if shader_path else None
+    return f"/filters/{filter_id}/{shader_type}?v={asset['hash']}" if asset else None
+
+def get_cached_pyramid_meta(map_filename):
+    # Pyramid metadata without the source freshness check, for tile cache headers
+    meta_path = os.path.join(tiles.get_pyramid_dir(app.config['TILES_FOLDER'], map_filename), tiles.META_FILENAME)
+    signature = get_file_signature(meta_path)
+    if signature is None: return None
+    cached = pyramid_meta_cache.get(map_filename); hit = bool(cached and cached[0] == signature)
+    record_cache_lookup('pyramid_meta', hit)
+    if hit: return cached[1]
+    meta = tiles.load_pyramid_meta(app.config['TILES_FOLDER'], map_filename)
+    if meta is not None: pyramid_meta_cache[map_filename] = (signature, meta)
+    return meta
+
+def get_map_representation(file_path, requested_version, accept_header=''):
+    # (path, etag, cache_control) for a map image: the smallest ingested WebP/AVIF variant the
+    # client accepts, falling back to the stored original. Responses must carry `Vary: Accept`.
+    content_hash = get_content_hash(file_path)
+    cache_control = get_cache_control(requested_version, content_hash)
+    variants = []
+    for image_format in ('avif', 'webp'):
+        if content_hash and f"image/{image_format}" in (accept_header or ''):
+            variant_path = ingest.get_variant_path(app.config['VARIANTS_FOLDER'], content_hash, image_format); signature = get_file_signature(variant_path)
+            if signature: variants.append((signature[1], variant_path, image_format))
+    if variants:
+        _, variant_path, image_format = min(variants)
+        return variant_path, f"{content_hash}-{image_format}", cache_control
+    return file_path, content_hash, cache_control
+
+def get_tile_cache_validators(map_filename, tile_path, requested_version):
+    # (etag, cache_control) for a tile; tile URLs are versioned by the source image hash recorded at build time
+    meta = get_cached_pyramid_meta(secure_filename(map_filename))
+    source_hash = meta.get('source_hash') if meta else None
+    signature = get_file_signature(tile_path)
+    etag = f"{source_hash}-{os.path.basename(tile_path)}" if source_hash else (f"{signature[0]:x}-{signature[1]:x}" if signature else None)
+    return etag, get_cache_control(requested_version, source_hash)
+
+def precompressed_response(asset, mimetype):
+    # Serves the smallest precompressed variant the client accepts, with a per-encoding ETag
+    encoding = 'br' if asset['br'] and request.accept_encodings['br'] else 'gzip' if request.accept_encodings['gzip'] else 'identity'
+    response = Response(asset[encoding], mimetype=mimetype)
+    if encoding != 'identity': response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(asset['hash'] if encoding == 'identity' else f"{asset['hash']}-{encoding}")
+    response.headers['Cache-Control'] = get_cache_control(request.args.get('v'), asset['hash'])
+    return response.make_conditional(request)
+
+def conditional_json(payload):
+    # JSON response with a content ETag; browsers revalidate and get a 304 when unchanged
+    response = jsonify(payload)
+    response.add_etag(); response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+def invalidate_map_state(map_filename=None):
+    with map_state_cache_lock:
+        if map_filename is None: map_state_cache.clear()
+        else: map_state_cache.pop(secure_filename(map_filename), None)
+
+# --- Filter Registry ---
+# Everything derived from the filter configs is compiled once and pre-serialized: the /api/filters
+# payload, default filter params and the player bootstrap bundle (configs with inlined GLSL). The
+# filters folder is re-checked at most every FILTERS_CHECK_INTERVAL seconds and the registry is
+# rebuilt only when a file in it was added, removed or modified.
+LEGACY_FILTER_PARAMS = ('backgroundImageFilename', 'defaultFontFamily', 'defaultTextSpeed', 'fontSize')
+filter_registry = None
+filter_registry_checked = 0.0
+filter_registry_lock = threading.Lock()
+
+def get_filters_signature():
+    signature = []
+    for root, dirs, files in os.walk(FILTERS_FOLDER):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name); file_signature = get_file_signature(path)
+            if file_signature: signature.append((os.path.relpath(path, FILTERS_FOLDER), *file_signature))
+    return tuple(signature)
+
+def to_script_json(data):
+    # JSON that is safe inside an HTML <script> element (same escapes as Jinja's |tojson)
+    return data.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026').replace("'", '\\u0027')
+
+def build_filter_registry(filters, signature):
+    default_filter_params = {f_id: {key: param_data.get('value') for key, param_data in config.get('params', {}).items() if 'value' in param_data and key not in LEGACY_FILTER_PARAMS}
+                             for f_id, config in filters.items()}
+    client_filters = {}; bundle_filters = {}
+    for f_id, config in filters.items():
+        client_config = {k: v for k, v in config.items() if k not in ('vertex_shader_path', 'fragment_shader_path', 'params')}
+        client_config['params'] = {k: v for k, v in config.get('params', {}).items() if k not in LEGACY_FILTER_PARAMS}
+        client_config['vertex_shader_url'] = get_shader_url(f_id, 'vertex.glsl'); client_config['fragment_shader_url'] = get_shader_url(f_id, 'fragment.glsl')
+        client_filters[f_id] = client_config
+        bundle_filters[f_id] = dict(client_config)
+        for shader_type, key in (('vertex.glsl', 'vertexShader'), ('fragment.glsl', 'fragmentShader')): # Field names player.js caches loaded shaders under
+            shader_path = resolve_shader_path(f_id, shader_type); asset = get_shader_asset(shader_path) if shader_path else None
+            if asset: bundle_filters[f_id][key] = asset['identity'].decode('utf-8')
+    default_filter = "none" if "none" in filters else next(iter(filters), "")
+    filters_json = json.dumps(client_filters, ensure_ascii=False, separators=(',', ':'))
+    bootstrap = {"default_filter": default_filter, "default_filter_params": default_filter_params, "filters": bundle_filters}
+    bootstrap['registry_version'] = hashlib.sha256(json.dumps(bootstrap, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    bootstrap_json = json.dumps(bootstrap, ensure_ascii=False, separators=(',', ':'))
+    logger.info("Compiled filter registry %s (%d filters, bootstrap %d bytes)", bootstrap['registry_version'], len(filters), len(bootstrap_json))
+    return {"signature": signature, "default_filter": default_filter, "default_filter_params": default_filter_params,
+            "filters_asset": make_precompressed_asset(filters_json.encode('utf-8')), "bootstrap_asset": make_precompressed_asset(bootstrap_json.encode('utf-8')),
+            "bootstrap_script_json": to_script_json(bootstrap_json)}
+
+def get_filter_registry():
+    global filter_registry, filter_registry_checked
+    now = time.monotonic()
+    if filter_registry is not None and now - filter_registry_checked < app.config['FILTERS_CHECK_INTERVAL']: return filter_registry
+    with filter_registry_lock:
+        if filter_registry is None or now - filter_registry_checked >= app.config['FILTERS_CHECK_INTERVAL']:
+            signature = get_filters_signature() # Taken before loading, so edits made during the load are picked up next time
+            if filter_registry is None or signature != filter_registry['signature']:
+                reloaded = filter_registry is not None
+                if reloaded: logger.info("Filters folder changed, reloading filters"); load_available_filters()
+                filter_registry = build_filter_registry(available_filters, signature)
+                if reloaded: invalidate_map_state(None) # Cached map states embed the old filters' default params
+            filter_registry_checked = now
+    return filter_registry
+
+# --- Tile Pyramids ---
+tile_builds_in_progress = set()
+tile_builds_lock = threading.Lock()
+
+def build_tiles_for_map(map_filename):
+    # Must be called after a successful claim_tile_build(); the pyramid itself is built in the ingest process pool
+    source_path = os.path.join(app.config['MAPS_FOLDER'], map_filename)
+    try:
+        meta = get_ingest_pool().submit(tiles.build_tile_pyramid, source_path, app.config['TILES_FOLDER'], map_filename, tiles.TILE_SIZE, get_content_hash(source_path)).result()
+        logger.info("Built tile pyramid for '%s': %d levels", map_filename, len(meta['levels']))
+        return meta
+    except Exception: logger.exception("Error building tile pyramid for '%s'", map_filename); return None
+    finally:
+        with tile_builds_lock: tile_builds_in_progress.discard(map_filename)
+
+def claim_tile_build(map_filename):
+    # False if a build is already running for this map
+    with tile_builds_lock:
+        if map_filename in tile_builds_in_progress: return False
+        tile_builds_in_progress.add(map_filename)
+    return True
+
+def request_tile_build(map_filename):
+    # Starts a background pyramid build unless one is already running for this map
+    if not claim_tile_build(map_filename): return False
+    socketio.start_background_task(build_tiles_for_map, map_filename)
+    return True
+
+def get_tile_meta(map_filename):
+    # Returns fresh pyramid metadata, or None after scheduling an on-demand (backfill) build
+    source_path = os.path.join(app.config['MAPS_FOLDER'], map_filename)
+    if not os.path.isfile(source_path): return None
+    meta = tiles.load_pyramid_meta(app.config['TILES_FOLDER'], map_filename, source_path)
+    if meta is None: request_tile_build(map_filename)
+    return meta
+
+# --- Map Ingest Pipeline ---
+# Uploads are saved to the incoming folder and processed off the request thread. The CPU heavy
+# stages (decode/normalize, WebP/AVIF transcoding, tile pyramid) run in a process pool and
+# progress is pushed to the uploading GM client as 'ingest_progress' events.
+ingest_pool = None
+ingest_pool_lock = threading.Lock()
+ingest_jobs = {} # job_id -> job status
+ingest_jobs_lock = threading.Lock()
+client_notifier = None
+
+def get_ingest_pool():
+    # Created on first use; 'spawn' avoids forking a process that is running server threads
+    global ingest_pool
+    with ingest_pool_lock:
+        if ingest_pool is None:
+            ingest_pool = ProcessPoolExecutor(max_workers=app.config['INGEST_WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(ingest_pool.shutdown, wait=False, cancel_futures=True)
+        return ingest_pool
+
+def set_client_notifier(notifier):
+    # Lets the ASGI entry point deliver ingest events through its own Socket.IO server
+    global client_notifier; client_notifier = notifier
+
+def notify_client(event, payload, sid):
+    if client_notifier: client_notifier(event, payload, sid)
+    else: socketio.emit(event, payload, to=sid)
+
+def create_ingest_job(filename, socket_id=None):
+    job_id = os.urandom(8).hex(); now = time.time()
+    with ingest_jobs_lock:
+        for old_id in [j for j, job in ingest_jobs.items() if job['status'] != 'running' and job['updated'] < now - app.config['INGEST_JOB_TTL']]: del ingest_jobs[old_id]
+        ingest_jobs[job_id] = {"job_id": job_id, "filename": filename, "status": "running", "stage": "queued", "progress": 0, "message": None, "socket_id": socket_id, "updated": now}
+    return job_id
+
+def get_ingest_job(job_id):
+    with ingest_jobs_lock:
+        job = ingest_jobs.get(job_id)
+        return {k: v for k, v in job.items() if k not in ('socket_id', 'updated')} if job else None
+
+def update_ingest_job(job_id, **changes):
+    with ingest_jobs_lock:
+        job = ingest_jobs[job_id]; job.update(changes, updated=time.time()); socket_id = job['socket_id']
+    if socket_id: notify_client('ingest_progress', get_ingest_job(job_id), socket_id)
+
+def ensure_map_config(map_filename):
+    config_path = get_map_config_path(map_filename)
+    if config_writer.get_pending(config_path) is None and not os.path.exists(config_path):
+         logger.info("Creating default config for uploaded map '%s'", map_filename)
+         default_state = get_state_for_map(map_filename)
+         if default_state:
+             if not save_map_config(map_filename, default_state): logger.warning("Could not save default config for '%s'", map_filename)
+         else: logger.warning("Could not generate default state for '%s'", map_filename)
+
+def run_ingest_job(job_id, upload_path, filename):
+    pool = get_ingest_pool()
+    normalized_path = f"{upload_path}.normalized.{filename.rsplit('.', 1)[1].lower()}"
+    try:
+        update_ingest_job(job_id, stage='normalizing', progress=10)
+        info = pool.submit(ingest.normalize_image, upload_path, normalized_path, app.config['MAP_MAX_DIMENSION']).result()
+        content_hash = info['content_hash']
+        if not ensure_map_catalog(): catalog_synced.wait(app.config['MAP_CATALOG_SYNC_WAIT']) # The duplicate check needs the whole library indexed
+        existing = map_catalog.find_by_hash([content_hash, info['source_hash']]) # Maps stored before ingest existed are not normalized
+        if existing and existing != filename:
+            update_ingest_job(job_id, stage='done', progress=100, status='duplicate', filename=existing, content_hash=content_hash, message=f"Identical to existing map '{existing}'")
+            INGEST_JOBS.inc(status='duplicate'); logger.info("Ingest %s: '%s' duplicates '%s', upload discarded", job_id, filename, existing); return
+        map_path = os.path.join(app.config['MAPS_FOLDER'], filename)
+        if existing != filename: os.replace(normalized_path, map_path) # Unchanged re-uploads keep the stored file (and its caches)
+        else: content_hash = get_content_hash(map_path)
+        invalidate_map_state(filename); ensure_map_config(filename)
+        update_ingest_job(job_id, stage='variants', progress=40, content_hash=content_hash)
+        variants = pool.submit(ingest.build_variants, map_path, app.config['VARIANTS_FOLDER'], app.config['THUMBNAILS_FOLDER'], content_hash).result()
+        update_ingest_job(job_id, stage='tiles', progress=70)
+        if claim_tile_build(filename): build_tiles_for_map(filename)
+        refresh_catalog_entry(filename)
+        update_ingest_job(job_id, stage='done', progress=100, status='done', width=info['width'], height=info['height'], resized=info['resized'],
+                          variants=variants, thumbnail_url=f"/thumbnails/{content_hash}.webp")
+        INGEST_JOBS.inc(status='done')
+        logger.info("Ingest %s: '%s' ready (%dx%d, variants: %s)", job_id, filename, info['width'], info['height'], ', '.join(k for k in variants if k != 'thumbnail') or 'none')
+    except UnidentifiedImageError:
+        INGEST_JOBS.inc(status='rejected'); logger.info("Ingest %s: rejected '%s', not a decodable image", job_id, filename)
+        update_ingest_job(job_id, status='error', message="File is not a valid image")
+    except Exception as e:
+        INGEST_JOBS.inc(status='error'); logger.exception("Ingest %s: failed for '%s'", job_id, filename)
+        update_ingest_job(job_id, status='error', message=f"Could not process image ({type(e).__name__})")
+    finally:
+        for path in (upload_path, normalized_path):
+            if os.path.exists(path): os.remove(path)
+
+# --- Map Catalog ---
+# Listings are served from the catalog; it is updated by uploads/config saves and a periodic
+# rescan of the maps folder that only re-reads files whose size or mtime changed. The first scan
+# (which hashes and probes every map not yet in the catalog) runs in the background; until it
+# finishes, listings return what the catalog already has, flagged as 'building'.
+catalog_synced = threading.Event() # Set once the first scan has finished
+catalog_watcher_started = False
+catalog_watcher_lock = threading.Lock()
+thumbnail_backfills = set() # content hashes with a thumbnail build in flight
+thumbnail_backfill_failures = set() # content hashes whose thumbnail could not be built; not retried
+thumbnail_backfill_lock = threading.Lock()
+
+def get_thumbnail_url(content_hash):
+    if content_hash and os.path.isfile(ingest.get_thumbnail_path(app.config['THUMBNAILS_FOLDER'], content_hash)): return f"/thumbnails/{content_hash}.webp"
+    return None
+
+def request_thumbnail_backfill(map_filename, content_hash):
+    # Maps that did not go through the ingest pipeline get their thumbnail built in the pool, at most
+    # THUMBNAIL_BACKFILL_MAX at a time; maps turned away here are picked up by a later scan
+    with thumbnail_backfill_lock:
+        if not content_hash or content_hash in thumbnail_backfills or content_hash in thumbnail_backfill_failures: return False
+        if len(thumbnail_backfills) >= app.config['THUMBNAIL_BACKFILL_MAX']: return False
+        thumbnail_backfills.add(content_hash)
+    future = get_ingest_pool().submit(ingest.build_thumbnail, os.path.join(app.config['MAPS_FOLDER'], map_filename), app.config['THUMBNAILS_FOLDER'], content_hash)
+    def on_done(done): # Runs on a pool callback thread
+        error = done.exception()
+        with thumbnail_backfill_lock:
+            thumbnail_backfills.discard(content_hash)
+            if error is not None: thumbnail_backfill_failures.add(content_hash)
+        if error is None: map_catalog.set_fields(map_filename, thumbnail_url=get_thumbnail_url(content_hash))
+        else: logger.error("Error building thumbnail for '%s': %s", map_filename, error)
+    future.add_done_callback(on_done)
+    return True
+
+def backfill_missing_thumbnails():
+    with thumbnail_backfill_lock: skipped = len(thumbnail_backfills) + len(thumbnail_backfill_failures)
+    for map_filename, content_hash in map_catalog.find_missing_thumbnails(app.config['THUMBNAIL_BACKFILL_MAX'] + skipped):
+        thumbnail_url = get_thumbnail_url(content_hash)
+        if thumbnail_url: map_catalog.set_fields(map_filename, thumbnail_url=thumbnail_url)
+        else: request_thumbnail_backfill(map_filename, content_hash)
+
+def refresh_catalog_entry(map_filename):
+    # Re-reads a single map into the catalog, or drops it if the file is gone
+    map_path = os.path.join(app.config['MAPS_FOLDER'], map_filename)
+    try: st = os.stat(map_path)
+    except OSError: map_catalog.remove([map_filename]); return None
+    width, height = read_image_size(map_path); content_hash = get_content_hash(map_path)
+    record = {"filename": map_filename, "width": width, "height": height, "bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "content_hash": content_hash,
+              "has_config": os.path.exists(get_map_config_path(map_filename)), "thumbnail_url": get_thumbnail_url(content_hash)}
+    map_catalog.upsert(record)
+    if not record['thumbnail_url']: request_thumbnail_backfill(map_filename, content_hash)
+    return record
+
+def sync_map_catalog():
+    known = map_catalog.get_signatures(); seen = set()
+    config_names = set(os.listdir(app.config['CONFIGS_FOLDER'])) if os.path.isdir(app.config['CONFIGS_FOLDER']) else set()
+    with os.scandir(app.config['MAPS_FOLDER']) as entries:
+        for entry in entries:
+            if not entry.is_file() or not allowed_map_file(entry.name): continue
+            seen.add(entry.name); st = entry.stat(); signature = known.get(entry.name)
+            has_config = f"{secure_filename(entry.name)}_config.json" in config_names
+            if signature is None or signature[:2] != (st.st_mtime_ns, st.st_size): refresh_catalog_entry(entry.name)
+            elif signature[2] != has_config: map_catalog.set_fields(entry.name, has_config=int(has_config))
+    removed = [filename for filename in known if filename not in seen]
+    map_catalog.remove(removed)
+    for filename in removed: logger.info("Map removed from catalog: %s", filename)
+
+def catalog_watcher():
+    while True:
+        try: sync_map_catalog(); backfill_missing_thumbnails()
+        except Exception: logger.exception("Error scanning maps folder")
+        if not catalog_synced.is_set(): catalog_synced.set(); logger.info("Map catalog synced: %d maps", map_catalog.query(limit=1)[0])
+        socketio.sleep(app.config['MAP_CATALOG_SCAN_INTERVAL'])
+
+def ensure_map_catalog():
+    # Starts the background scanner on first use; returns True once the first scan has finished
+    global catalog_watcher_started
+    with catalog_watcher_lock:
+        start = not catalog_watcher_started; catalog_watcher_started = True
+    if start: socketio.start_background_task(catalog_watcher)
+    return catalog_synced.is_set()
+
+# --- Filter Snapshots ---
+# Server-side renders of a map through its filter (cpu_renderer.py), for clients that cannot run
+# the shaders. Encoded images are cached by map content hash + filter params + view + output size.
+snapshot_cache = OrderedDict() # key -> encoded image bytes, least recently used first
+snapshot_render_locks = {} # key -> lock held while that snapshot renders
+snapshot_cache_lock = threading.Lock()
+snapshot_render_slots = threading.BoundedSemaphore(app.config['SNAPSHOT_MAX_RENDERS'])
+
+class SnapshotBusyError(Exception):
+    pass
+
+def snap_snapshot_size(width, height):
+    # Rounds a requested size to one of a small set, bounding the distinct renders (and cache entries) clients can cause
+    aspect = round(min(max(width / height, 0.25), 4.0) / SNAPSHOT_ASPECT_STEP) * SNAPSHOT_ASPECT_STEP
+    snapped_height = next((h for h in SNAPSHOT_HEIGHTS if h >= height), SNAPSHOT_HEIGHTS[-1])
+    snapped_height = min(snapped_height, int(app.config['SNAPSHOT_MAX_DIMENSION'] / aspect))
+    return round(snapped_height * aspect), snapped_height
+
+def get_snapshot_state(map_filename, session_id=None):
+    # The live session state when the session is showing this map, otherwise the map's saved state
+    if session_id and SESSION_ID_REGEX.match(session_id):
+        entry = session_store.get(session_id)
+        if entry and os.path.basename(entry.state.get('map_content_path') or '') == map_filename: return entry.state
+    return get_state_for_map(map_filename)
+
+def get_snapshot_key(content_hash, filter_id, filter_params, view_state, width, height, image_format):
+    view = {k: view_state.get(k, default) for k, default in (('center_x', 0.5), ('center_y', 0.5), ('scale', 1.0))}
+    key_data = [cpu_renderer.RENDERER_VERSION, content_hash, filter_id, filter_params, view, width, height, image_format]
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def render_snapshot_bytes(map_path, filter_id, filter_params, view_state, width, height, image_format):
+    with Image.open(map_path) as image: snapshot = cpu_renderer.render_snapshot(image, filter_id, filter_params, view_state, width, height)
+    if image_format == 'jpeg': # No alpha: composite over the player's black background
+        background = Image.new('RGB', snapshot.size, (0, 0, 0)); background.paste(snapshot, mask=snapshot.getchannel('A')); snapshot = background
+    buffer = io.BytesIO()
+    snapshot.save(buffer, SNAPSHOT_FORMATS[image_format][0], **({'quality': 85} if image_format != 'png' else {}))
+    return buffer.getvalue()
+
+def get_snapshot(key, render_fn):
+    # Concurrent requests for the same key wait for a single render; at most SNAPSHOT_MAX_RENDERS different keys render at once
+    with snapshot_cache_lock:
+        record_cache_lookup('snapshot', key in snapshot_cache)
+        if key in snapshot_cache: snapshot_cache.move_to_end(key); return snapshot_cache[key]
+        render_lock = snapshot_render_locks.setdefault(key, threading.Lock())
+    with render_lock:
+        with snapshot_cache_lock:
+            if key in snapshot_cache: return snapshot_cache[key]
+        try:
+            if not snapshot_render_slots.acquire(timeout=app.config['SNAPSHOT_RENDER_WAIT']): raise SnapshotBusyError()
+            try:
+                with SNAPSHOT_RENDER_SECONDS.time(): data = render_fn()
+            finally: snapshot_render_slots.release()
+        finally:
+            with snapshot_cache_lock: snapshot_render_locks.pop(key, None)
+        with snapshot_cache_lock:
+            snapshot_cache[key] = data
+            while len(snapshot_cache) > app.config['SNAPSHOT_CACHE_SIZE']: snapshot_cache.popitem(last=False)
+    return data
+
 def merge_dicts(dict1, dict2):
     result = copy.deepcopy(dict1)
     for key, value in dict2.items():
@@ -210,6 +813,255 @@ def merge_dicts(dict1, dict2):
             result[key] = value
     return result
 
+def diff_state(old, new):
+    # Nested patch of the values in `new` that differ from `old` (applied with merge_dicts semantics).
+    # Returns None if a key was removed, since a merge patch cannot express deletions.
+    patch = {}
+    for key, old_value in old.items():
+        if key not in new: return None
+    for key, value in new.items():
+        if key not in old: patch[key] = value; continue
+        old_value = old[key]
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            sub_patch = diff_state(old_value, value)
+            if sub_patch is None: return None
+            if sub_patch: patch[key] = sub_patch
+        elif value != old_value or type(value) is not type(old_value):
+            patch[key] = value
+    return patch
+
+def get_full_state_message(entry):
+    # Full state payload with its version, sent on join and on resync requests
+    return {**entry.state, "version": entry.version}
+
+background_tasks_started = False
+background_tasks_lock = threading.Lock()
+
+scheduler_forgetter = None
+
+def set_scheduler_forgetter(forgetter):
+    # Lets the ASGI entry point hand scheduler cleanup to its event loop (its scheduler is not thread safe)
+    global scheduler_forgetter; scheduler_forgetter = forgetter
+
+def forget_session(session_id):
+    # Session store eviction callback, for idle sessions and for sessions evicted to make room: drops the
+    # session's scheduler state, metric series, prefetch queue and pending autosave. Runs under the store lock.
+    try:
+        if scheduler_forgetter: scheduler_forgetter(session_id)
+        else: update_scheduler.forget(session_id)
+        forget_session_metrics(session_id); forget_prefetch_queue(session_id)
+        with autosave_lock: autosave_pending.pop(session_id, None)
+        logger.info("Evicted session: %s", session_id)
+    except Exception: logger.exception("Error forgetting evicted session %s", session_id)
+
+def sweep_sessions():
+    try:
+        session_store.evict_idle() # Evicted sessions are cleaned up by forget_session
+        session_store.flush()
+    except Exception: logger.exception("Error sweeping sessions")
+
+def session_sweeper():
+    while True:
+        socketio.sleep(app.config['SESSION_SWEEP_INTERVAL'])
+        sweep_sessions()
+
+def ensure_background_tasks():
+    # Started lazily on first connection rather than at import time
+    global background_tasks_started
+    with background_tasks_lock:
+        if background_tasks_started: return
+        background_tasks_started = True
+    socketio.start_background_task(session_sweeper)
+    if app.config['SESSION_STATS_INTERVAL'] > 0: socketio.start_background_task(session_stats_reporter)
+    if app.config['CONFIG_AUTOSAVE_INTERVAL'] > 0: socketio.start_background_task(config_autosaver)
+
+# --- Session Stats ---
+# GM pages subscribe to the session they control and are sent 'session_stats' every SESSION_STATS_INTERVAL seconds
+session_stats_watchers = {} # GM socket sid -> watched session_id
+session_stats_lock = threading.Lock()
+
+def watch_session_stats(sid, data):
+    # Returns False when stats are disabled or the request is invalid
+    if app.config['SESSION_STATS_INTERVAL'] <= 0 or not isinstance(data, dict): return False
+    session_id = data.get('session_id')
+    if not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): return False
+    with session_stats_lock: session_stats_watchers[sid] = session_id
+    return True
+
+def unwatch_session_stats(sid):
+    with session_stats_lock: session_stats_watchers.pop(sid, None)
+
+def get_session_stats(session_id):
+    # Cumulative counters; the GM page turns consecutive reports into rates
+    update_count = GM_UPDATES.get(session=session_id); update_seconds = GM_UPDATE_SESSION_SECONDS.get(session=session_id)
+    return {"session_id": session_id, "players": session_store.member_count(session_id), "updates": update_count,
+            "broadcasts": BROADCASTS.get(session=session_id), "broadcast_bytes": BROADCAST_BYTES.get(session=session_id),
+            "avg_update_ms": round(update_seconds * 1000 / update_count, 3) if update_count else None, "time": time.time()}
+
+def collect_session_stats():
+    # (sid, stats) for every watching GM page
+    with session_stats_lock: watchers = list(session_stats_watchers.items())
+    return [(sid, get_session_stats(session_id)) for sid, session_id in watchers]
+
+def session_stats_reporter():
+    while True:
+        socketio.sleep(app.config['SESSION_STATS_INTERVAL'])
+        for sid, stats in collect_session_stats(): socketio.emit('session_stats', stats, to=sid)
+
+# --- Config Autosave ---
+# With CONFIG_AUTOSAVE_INTERVAL set, GM changes to a session's view and filter params are written back to the
+# shown map's config at most once per interval per session, through the write-behind queue. Pending changes
+# are saved before the session switches maps, and on shutdown.
+autosave_pending = {} # session_id -> map filename whose view/filters changed since the last autosave
+autosave_lock = threading.Lock()
+
+def mark_for_autosave(session_id, state):
+    map_content_path = state.get('map_content_path')
+    if app.config['CONFIG_AUTOSAVE_INTERVAL'] <= 0 or not map_content_path: return
+    with autosave_lock: autosave_pending[session_id] = os.path.basename(map_content_path)
+
+def autosave_session(session_id, state):
+    # Writes the session's view_state and filter_params into its map's config, if they changed since the last autosave
+    with autosave_lock: map_filename = autosave_pending.pop(session_id, None)
+    if not map_filename or os.path.basename(state.get('map_content_path') or '') != map_filename: return
+    config = load_map_config(map_filename) or state
+    if save_map_config(map_filename, {**config, "view_state": state.get('view_state'), "filter_params": state.get('filter_params')}): logger.debug("Session %s: autosaved config for '%s'", session_id, map_filename)
+
+def autosave_session_configs():
+    with autosave_lock: session_ids = list(autosave_pending)
+    for session_id in session_ids:
+        entry = session_store.get(session_id)
+        if entry is not None: autosave_session(session_id, entry.state)
+        else:
+            with autosave_lock: autosave_pending.pop(session_id, None)
+
+def config_autosaver():
+    while True:
+        socketio.sleep(app.config['CONFIG_AUTOSAVE_INTERVAL'])
+        try: autosave_session_configs()
+        except Exception: logger.exception("Error autosaving session configs")
+
+atexit.register(autosave_session_configs) # Runs before config_writer.close (atexit is last-in, first-out)
+
+# --- Map Prefetch Queue ---
+# The GM queues upcoming maps per session. Players are sent 'prefetch_hints' (URL, size, hash) to download and
+# decode in the background, report each result with 'prefetch_ready', and GM pages in the session's GM room get
+# 'prefetch_status' with per-map readiness, so a reveal is instant once every player has the map.
+prefetch_queues = {} # session_id -> list of hints, in GM order
+prefetch_reports = {} # session_id -> {map filename: {player sid: (content hash, ok)}}
+prefetch_lock = threading.Lock()
+
+def get_gm_room(session_id):
+    return f"gm:{session_id}"
+
+def get_valid_session_id(data):
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    return session_id if isinstance(session_id, str) and SESSION_ID_REGEX.match(session_id) else None
+
+def build_prefetch_hint(map_filename):
+    # Hint for one map, or None if it does not exist. The version matches what the map switch will broadcast,
+    # so the player's prefetched URL is exactly the one it will be told to load.
+    map_path = resolve_map_image_path(map_filename) if isinstance(map_filename, str) else None
+    state = get_state_for_map(map_filename) if map_path else None
+    if not state: return None
+    width, height = read_image_size(map_path)
+    return {"filename": secure_filename(map_filename), "map_content_path": state['map_content_path'], "map_content_version": state.get('map_content_version'),
+            "bytes": os.path.getsize(map_path), "width": width, "height": height}
+
+def set_prefetch_queue(data):
+    # Replaces a session's queue; returns the session_id, or None if the request is invalid, the session does not
+    # exist or too many sessions already have a queue. Queues are dropped when the session is evicted (forget_session).
+    session_id = get_valid_session_id(data)
+    if session_id is None or not isinstance(data.get('maps'), list): return None
+    if session_store.get(session_id) is None: return None
+    hints = []
+    for map_filename in data['maps'][:app.config['PREFETCH_QUEUE_MAX']]:
+        hint = build_prefetch_hint(map_filename)
+        if hint and all(h['filename'] != hint['filename'] for h in hints): hints.append(hint)
+    with prefetch_lock:
+        if not hints: prefetch_queues.pop(session_id, None); prefetch_reports.pop(session_id, None); return session_id
+        if session_id not in prefetch_queues and len(prefetch_queues) >= app.config['PREFETCH_MAX_SESSIONS']: logger.warning("Prefetch queue limit reached, rejecting queue for %s", session_id); return None
+        prefetch_queues[session_id] = hints
+        reports = prefetch_reports.setdefault(session_id, {}); queued = {hint['filename'] for hint in hints}
+        for filename in [f for f in reports if f not in queued]: del reports[filename] # Readiness of maps still queued is kept
+    if not session_store.has_session(session_id): forget_prefetch_queue(session_id); return None # Evicted while the hints were built
+    return session_id
+
+def has_prefetch_queue(session_id):
+    with prefetch_lock: return session_id in prefetch_queues
+
+def get_prefetch_hints(session_id):
+    with prefetch_lock: return {"session_id": session_id, "maps": list(prefetch_queues.get(session_id, []))}
+
+def record_prefetch_report(sid, data):
+    # Stores a player's result for a queued map; returns the session_id whose status changed, or None
+    session_id = get_valid_session_id(data); filename = data.get('filename') if session_id else None
+    with prefetch_lock:
+        if not any(hint['filename'] == filename for hint in prefetch_queues.get(session_id, [])): return None
+        ok = bool(data.get('ok'))
+        prefetch_reports.setdefault(session_id, {}).setdefault(filename, {})[sid] = (data.get('content_hash'), ok)
+    PREFETCH_REPORTS.inc(result='ready' if ok else 'failed')
+    return session_id
+
+def forget_prefetch_reports(sid, session_ids):
+    # Called with the sessions a disconnecting player was in; returns those with a queue, whose status changed
+    with prefetch_lock:
+        for session_id in session_ids:
+            for reports in prefetch_reports.get(session_id, {}).values(): reports.pop(sid, None)
+        return [session_id for session_id in session_ids if session_id in prefetch_queues]
+
+def forget_prefetch_queue(session_id):
+    with prefetch_lock: prefetch_queues.pop(session_id, None); prefetch_reports.pop(session_id, None)
+
+def get_prefetch_status(session_id):
+    # A map counts as ready for a player only if the player decoded the version currently queued
+    members = session_store.get_members(session_id)
+    with prefetch_lock:
+        maps = []
+        for hint in prefetch_queues.get(session_id, []):
+            results = [ok for sid, (content_hash, ok) in prefetch_reports.get(session_id, {}).get(hint['filename'], {}).items()
+                       if sid in members and content_hash == hint['map_content_version']]
+            maps.append({**hint, "ready": sum(results), "failed": len(results) - sum(results)})
+    return {"session_id": session_id, "players": len(members), "maps": maps}
+
+# --- Static Path Resolution ---
+# Shared by the Flask routes and the ASGI entry point (asgi_app.py); each returns an absolute path or None
+def resolve_map_image_path(filename):
+    safe_filename = secure_filename(filename)
+    if not allowed_map_file(safe_filename): return None
+    maps_dir = os.path.abspath(app.config['MAPS_FOLDER']); file_path = os.path.abspath(os.path.join(maps_dir, safe_filename))
+    if not file_path.startswith(maps_dir) or not os.path.isfile(file_path): return None
+    return file_path
+
+def resolve_shader_path(filter_id, shader_type):
+    secured_filter_id = secure_filename(filter_id); secured_shader_type = secure_filename(shader_type)
+    if secured_shader_type not in ['vertex.glsl', 'fragment.glsl']: return None
+    filters_dir = os.path.abspath(app.config['FILTERS_FOLDER']); shader_path = os.path.abspath(os.path.join(filters_dir, secured_filter_id, secured_shader_type))
+    if not shader_path.startswith(filters_dir) or not os.path.isfile(shader_path): return None
+    return shader_path
+
+def resolve_tile_path(map_filename, level, tile_name):
+    safe_map = secure_filename(map_filename); safe_tile = secure_filename(tile_name)
+    if not allowed_map_file(safe_map) or not re.match(r'^\d+_\d+\.(jpg|png)$', safe_tile): return None
+    tile_path = os.path.join(app.config['TILES_FOLDER'], safe_map, str(int(level)), safe_tile)
+    return tile_path if os.path.isfile(tile_path) else None
+
+def resolve_thumbnail_path(thumbnail_name):
+    if not re.match(r'^[0-9a-f]{16}\.webp$', thumbnail_name): return None
+    thumbnail_path = os.path.join(app.config['THUMBNAILS_FOLDER'], thumbnail_name)
+    return thumbnail_path if os.path.isfile(thumbnail_path) else None
+
+# --- Request Metrics ---
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    record_http_request(endpoint, response.status_code, time.perf_counter() - g.get('request_start', time.perf_counter()))
+    return response
+
 # --- HTTP Routes ---
 @app.route('/')
 def index():
@@ -220,65 +1072,86 @@ def player():
     session_id = request.args.get('session')
     if not session_id or not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id):
         return "Error: Session ID is missing, invalid, or too long.", 400
-    return render_template('player.html', session_id=session_id)
+    if not app.config['PLAYER_BOOTSTRAP_EMBED']: return render_template('player.html', session_id=session_id)
+    # Embeds the bootstrap bundle and, for an existing session, its current state, so the first frame needs no further API round trips
+    entry = session_store.get(session_id)
+    return render_template('player.html', session_id=session_id, bootstrap_json=get_filter_registry()['bootstrap_script_json'],
+                           initial_state=get_full_state_message(entry) if entry else None)
+
+@app.route('/metrics')
+def serve_metrics():
+    # Prometheus scrape target
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8', headers={'Cache-Control': 'no-store'})
 
 # --- Static File Serving ---
 @app.route('/maps/<path:filename>')
 def serve_map_image(filename):
-    # ** Full Implementation Restored **
-    print(f"[serve_map_image] Request for: {filename}")
-    safe_base_filename = secure_filename(filename)
-    print(f"[serve_map_image] Secured filename: {safe_base_filename}")
-    if not allowed_map_file(safe_base_filename): print(f"[serve_map_image] ERROR: File type not allowed"); return jsonify({"error": "File type not allowed"}), 404
-    maps_dir = app.config['MAPS_FOLDER']; print(f"[serve_map_image] Serving from directory: {maps_dir}")
+    file_path = resolve_map_image_path(filename)
+    if not file_path: return jsonify({"error": "Map image file not found"}), 404
     try:
-        file_path = os.path.join(maps_dir, safe_base_filename); print(f"[serve_map_image] Attempting to serve file path: {file_path}")
-        abs_maps_dir = os.path.abspath(maps_dir); abs_file_path = os.path.abspath(file_path)
-        if not os.path.exists(file_path): print(f"[serve_map_image] ERROR: File does not exist"); raise FileNotFoundError
-        if not abs_file_path.startswith(abs_maps_dir): print(f"[serve_map_image] ERROR: Path traversal attempt?"); raise FileNotFoundError
-        print(f"[serve_map_image] Calling send_from_directory for dir='{maps_dir}', filename='{safe_base_filename}'")
-        response = send_from_directory(maps_dir, safe_base_filename, as_attachment=False)
-        print(f"[serve_map_image] send_from_directory successful for {safe_base_filename}")
+        path, etag, cache_control = get_map_representation(file_path, request.args.get('v'), request.headers.get('Accept', ''))
+        response = send_file(path, etag=etag, conditional=True) # Handles If-None-Match (304) and Range (206)
+        response.headers['Cache-Control'] = cache_control; response.headers['Vary'] = 'Accept'
+        record_bytes_served('map', path, response.status_code, response.content_length if request.method != 'HEAD' else 0)
         return response
-    except FileNotFoundError: print(f"[serve_map_image] FileNotFoundError caught"); return jsonify({"error": "Map image file not found"}), 404
-    except Exception as e: print(f"[serve_map_image] !!! UNEXPECTED ERROR serving '{safe_base_filename}' !!!"); print(f"[serve_map_image] Exception type: {type(e).__name__}"); print(f"[serve_map_image] Exception args: {e.args}"); traceback.print_exc(); return jsonify({"error": "Internal server error"}), 500
+    except Exception: logger.exception("Error serving map image '%s'", filename); return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/filters/<path:filter_id>/<shader_type>')
 def serve_shader(filter_id, shader_type):
     # ** Full Implementation Restored **
-    secured_filter_id = secure_filename(filter_id); secured_shader_type = secure_filename(shader_type)
-    if secured_shader_type not in ['vertex.glsl', 'fragment.glsl']: return jsonify({"error": "Invalid shader type"}), 400
-    filters_dir = app.config['FILTERS_FOLDER']; filter_subdir = os.path.join(filters_dir, secured_filter_id)
+    if secure_filename(shader_type) not in ['vertex.glsl', 'fragment.glsl']: return jsonify({"error": "Invalid shader type"}), 400
     try:
-        shader_path = os.path.join(filter_subdir, secured_shader_type)
-        if not os.path.exists(shader_path) or not os.path.abspath(shader_path).startswith(os.path.abspath(filters_dir)): raise FileNotFoundError
-        return send_from_directory(filter_subdir, secured_shader_type, mimetype='text/plain')
+        shader_path = resolve_shader_path(filter_id, shader_type)
+        if not shader_path: raise FileNotFoundError
+        asset = get_shader_asset(shader_path)
+        if asset is None: raise FileNotFoundError
+        return precompressed_response(asset, 'text/plain')
     except FileNotFoundError: return jsonify({"error": "Shader file not found"}), 404
-    except Exception as e: print(f"Err serve shader {filter_id}/{shader_type}: {e}"); return jsonify({"error": "Server error"}), 500
+    except Exception: logger.exception("Error serving shader %s/%s", filter_id, shader_type); return jsonify({"error": "Server error"}), 500
+
+@app.route('/tiles/<map_filename>/<int:level>/<tile_name>')
+def serve_map_tile(map_filename, level, tile_name):
+    tile_path = resolve_tile_path(map_filename, level, tile_name)
+    if not tile_path: return jsonify({"error": "Tile not found"}), 404
+    etag, cache_control = get_tile_cache_validators(map_filename, tile_path, request.args.get('v'))
+    response = send_file(tile_path, etag=etag or True, conditional=True)
+    response.headers['Cache-Control'] = cache_control
+    record_bytes_served('tile', tile_path, response.status_code, response.content_length if request.method != 'HEAD' else 0)
+    return response
+
+@app.route('/thumbnails/<thumbnail_name>')
+def serve_thumbnail(thumbnail_name):
+    # Named by content hash, so always immutable
+    thumbnail_path = resolve_thumbnail_path(thumbnail_name)
+    if not thumbnail_path: return jsonify({"error": "Thumbnail not found"}), 404
+    response = send_file(thumbnail_path, etag=thumbnail_name.split('.')[0], conditional=True)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    record_bytes_served('thumbnail', thumbnail_path, response.status_code, response.content_length if request.method != 'HEAD' else 0)
+    return response
 
 # --- API Routes ---
 # ** Full Implementations Restored **
 @app.route('/api/filters', methods=['GET'])
 def get_filters():
-    client_safe_filters = {}; text_params = ['defaultFontFamily', 'defaultTextSpeed', 'fontSize']
-    for f_id, f_config in available_filters.items():
-         safe_config = {k: v for k, v in f_config.items() if k not in ['vertex_shader_path', 'fragment_shader_path']}
-         if 'params' in safe_config:
-             params_copy = copy.deepcopy(safe_config['params']); keys_to_remove = ['backgroundImageFilename'] + text_params
-             for key in keys_to_remove:
-                 if key in params_copy: del params_copy[key]
-             safe_config['params'] = params_copy
-         client_safe_filters[f_id] = safe_config
-    return jsonify(client_safe_filters)
+    # Pre-serialized in the filter registry; rebuilt only when the filters folder changes
+    return precompressed_response(get_filter_registry()['filters_asset'], 'application/json')
+
+@app.route('/api/bootstrap', methods=['GET'])
+def get_player_bootstrap():
+    # Everything a player needs before its first frame (filter configs with inlined GLSL, defaults) in one response
+    return precompressed_response(get_filter_registry()['bootstrap_asset'], 'application/json')
 
 @app.route('/api/maps', methods=['GET'])
 def list_map_content():
+    # Query params: q (filename search), sort (name|added|modified|size), order (asc|desc), offset, limit
     try:
-        maps_dir = app.config['MAPS_FOLDER'];
-        if not os.path.isdir(maps_dir): return jsonify([])
-        content_files = [f for f in os.listdir(maps_dir) if os.path.isfile(os.path.join(maps_dir, f)) and allowed_map_file(f)]
-        return jsonify(sorted(content_files))
-    except Exception as e: print(f"Error listing map content: {e}"); return jsonify({"error": "Server error"}), 500
+        offset = max(0, int(request.args.get('offset', 0))); limit = max(1, min(int(request.args.get('limit', 100)), MAX_PAGE_SIZE))
+    except ValueError: return jsonify({"error": "Invalid paging parameters"}), 400
+    try:
+        building = not ensure_map_catalog()
+        total, maps = map_catalog.query(request.args.get('q', '').strip() or None, request.args.get('sort', 'name'), request.args.get('order') == 'desc', offset, limit)
+        return conditional_json({"total": total, "offset": offset, "limit": limit, "maps": maps, "building": building})
+    except Exception: logger.exception("Error listing map content"); return jsonify({"error": "Server error"}), 500
 
 @app.route('/api/maps', methods=['POST'])
 def upload_map_content():
@@ -286,25 +1159,76 @@ def upload_map_content():
     file = request.files['mapFile']
     if file.filename == '': return jsonify({"error": "No selected file"}), 400
     if file and allowed_map_file(file.filename):
-        filename = secure_filename(file.filename); save_path = os.path.join(app.config['MAPS_FOLDER'], filename)
+        filename = secure_filename(file.filename); socket_id = request.form.get('socket_id') or None
         try:
-            file.save(save_path); config_path = get_map_config_path(filename)
-            if not os.path.exists(config_path):
-                 print(f"Creating default config for uploaded map '{filename}'.")
-                 default_state = get_state_for_map(filename)
-                 if default_state:
-                     if not save_map_config(filename, default_state): print(f"Warning: Failed save default config.")
-                 else: print(f"Warning: Could not generate default state.")
-            return jsonify({"success": True, "filename": filename}), 201
-        except Exception as e: print(f"Err save map upload '{filename}': {e}"); return jsonify({"error": "Could not save"}), 500
+            # Only the raw bytes are written here; validation and processing happen in the ingest pipeline
+            job_id = create_ingest_job(filename, socket_id); upload_path = os.path.join(app.config['INCOMING_FOLDER'], f"{job_id}_{filename}")
+            file.save(upload_path); socketio.start_background_task(run_ingest_job, job_id, upload_path, filename)
+            return jsonify({"success": True, "job_id": job_id, "filename": filename}), 202
+        except Exception: logger.exception("Error saving map upload '%s'", filename); return jsonify({"error": "Could not save"}), 500
     else: return jsonify({"error": f"File type not allowed. Allowed: {', '.join(ALLOWED_MAP_EXTENSIONS)}"}), 400
 
+@app.route('/api/ingest/<job_id>', methods=['GET'])
+def get_ingest_status(job_id):
+    job = get_ingest_job(job_id)
+    if job: return jsonify(job)
+    else: return jsonify({"error": "Ingest job not found"}), 404
+
+@app.route('/api/snapshot/<path:map_filename>', methods=['GET'])
+def get_map_snapshot(map_filename):
+    # Query params: session (use its live state), width, height, format (png|webp|jpeg).
+    # The size is rounded to the nearest allowed size (snap_snapshot_size); clients scale the image to fit.
+    if cpu_renderer is None: return jsonify({"error": "Snapshots are unavailable (NumPy is not installed)"}), 501
+    secured_filename = secure_filename(map_filename)
+    if not allowed_map_file(secured_filename): return jsonify({"error": "Invalid file type"}), 400
+    map_path = resolve_map_image_path(secured_filename)
+    if not map_path: return jsonify({"error": "Map file not found"}), 404
+    try:
+        width, height = snap_snapshot_size(max(1, int(request.args.get('width', 1280))), max(1, int(request.args.get('height', 720))))
+    except ValueError: return jsonify({"error": "Invalid snapshot size"}), 400
+    image_format = request.args.get('format', 'png').lower()
+    if image_format not in SNAPSHOT_FORMATS: return jsonify({"error": f"Format not supported. Supported: {', '.join(SNAPSHOT_FORMATS)}"}), 400
+    state = get_snapshot_state(secured_filename, request.args.get('session'))
+    if not state: return jsonify({"error": "Map state not found"}), 404
+    filter_id = state.get('current_filter') or 'none'
+    if not cpu_renderer.is_supported(filter_id): filter_id = 'none' # Rendered unfiltered
+    filter_params = state.get('filter_params', {}).get(filter_id, {}); view_state = state.get('view_state') or {}
+    key = get_snapshot_key(get_content_hash(map_path), filter_id, filter_params, view_state, width, height, image_format)
+    if request.if_none_match.contains(key): # Checked before rendering
+        response = Response(status=304); response.set_etag(key); response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL; return response
+    try: data = get_snapshot(key, lambda: render_snapshot_bytes(map_path, filter_id, filter_params, view_state, width, height, image_format))
+    except SnapshotBusyError:
+        response = jsonify({"error": "Snapshot renderer busy, retry shortly"}); response.status_code = 503; response.headers['Retry-After'] = '1'; return response
+    except Exception: logger.exception("Error rendering snapshot for '%s'", secured_filename); return jsonify({"error": "Could not render snapshot"}), 500
+    response = Response(data, mimetype=SNAPSHOT_FORMATS[image_format][1])
+    response.set_etag(key); response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    record_bytes_served('snapshot', f"snapshot.{image_format}", 200, len(data) if request.method != 'HEAD' else 0)
+    return response
+
+@app.route('/api/tiles/<path:map_filename>', methods=['GET'])
+def get_map_tiles(map_filename):
+    secured_filename = secure_filename(map_filename)
+    if not allowed_map_file(secured_filename): return jsonify({"error": "Invalid file type"}), 400
+    if not os.path.isfile(os.path.join(app.config['MAPS_FOLDER'], secured_filename)): return jsonify({"error": "Map file not found"}), 404
+    meta = get_tile_meta(secured_filename)
+    if meta is None: return jsonify({"status": "building"}), 202
+    url_template = f"/tiles/{secured_filename}/{{level}}/{{col}}_{{row}}.{meta['format']}" + (f"?v={meta['source_hash']}" if meta.get('source_hash') else "")
+    if 'width' not in request.args or 'height' not in request.args:
+        return conditional_json({"status": "ready", "url_template": url_template, **meta})
+    try:
+        center_x = float(request.args.get('center_x', 0.5)); center_y = float(request.args.get('center_y', 0.5)); scale = float(request.args.get('scale', 1.0))
+        viewport_width = int(request.args['width']); viewport_height = int(request.args['height'])
+        max_size = int(request.args['max_size']) if request.args.get('max_size') else None
+    except (TypeError, ValueError): return jsonify({"error": "Invalid viewport parameters"}), 400
+    selection = tiles.select_tiles(meta, center_x, center_y, scale, viewport_width, viewport_height, max_size)
+    return conditional_json({"status": "ready", "url_template": url_template, **selection})
+
 @app.route('/api/config/<path:map_filename>', methods=['GET'])
 def get_config(map_filename):
     secured_filename = secure_filename(map_filename)
     if not allowed_map_file(secured_filename): return jsonify({"error": "Invalid file type"}), 400
     map_state = get_state_for_map(secured_filename)
-    if map_state: return jsonify(map_state)
+    if map_state: return conditional_json(map_state)
     else: return jsonify({"error": "Map file not found"}), 404
 
 @app.route('/api/config/<path:map_filename>', methods=['POST'])
@@ -314,59 +1238,152 @@ def save_config_api(map_filename):
     if not request.is_json: return jsonify({"error": "Request must be JSON"}), 400
     config_data = request.get_json()
     if not isinstance(config_data, dict) or not all(k in config_data for k in ("map_content_path", "current_filter", "view_state", "filter_params")): return jsonify({"error": "Invalid config data structure"}), 400
-    if save_map_config(secured_filename, config_data): print(f"Map config saved: {secured_filename}"); return jsonify({"success": True}), 200
-    else: return jsonify({"error": "Could not save map configuration"}), 500
+    if not save_map_config(secured_filename, config_data): return jsonify({"error": "Could not save map configuration"}), 500
+    # Written behind: the GM page confirms the write (or reports its failure) through the status endpoint below
+    logger.info("Map config queued for saving: %s", secured_filename); return jsonify({"success": True, "pending": True}), 202
+
+@app.route('/api/config/<path:map_filename>/status', methods=['GET'])
+def get_config_status(map_filename):
+    # Whether a save of the map's config is still queued, and the outcome of its last write (including autosaves)
+    secured_filename = secure_filename(map_filename)
+    if not allowed_map_file(secured_filename): return jsonify({"error": "Invalid file type"}), 400
+    pending, last_write = config_writer.get_status(get_map_config_path(secured_filename))
+    return jsonify({"map_filename": secured_filename, "pending": pending, "last_write": {"ok": last_write[0], "time": last_write[1]} if last_write else None})
 
 # --- WebSocket Event Handlers ---
 # ** Full Implementations with updated validation **
 @socketio.on('connect')
-def handle_connect(): print(f"Client connected: {request.sid}")
+def handle_connect(): ensure_background_tasks(); SOCKET_CONNECTIONS.inc(); logger.debug("Client connected: %s", request.sid)
 
 @socketio.on('disconnect')
-def handle_disconnect(): print(f"Client disconnected: {request.sid}")
+def handle_disconnect():
+    session_ids = session_store.remove_member(request.sid); unwatch_session_stats(request.sid); SOCKET_CONNECTIONS.dec(); logger.debug("Client disconnected: %s", request.sid)
+    for session_id in forget_prefetch_reports(request.sid, session_ids): socketio.emit('prefetch_status', get_prefetch_status(session_id), to=get_gm_room(session_id))
 
-@socketio.on('join_session')
-def handle_join_session(data):
-    if not isinstance(data, dict) or 'session_id' not in data: socketio_emit('error', {'message': 'Invalid join request.'}, to=request.sid); return
+# Transport-neutral session logic, shared with the ASGI entry point (asgi_app.py)
+def prepare_join(data):
+    # Returns (session_id, entry, error_message)
+    if not isinstance(data, dict) or 'session_id' not in data: return None, None, 'Invalid join request.'
     session_id = data['session_id']
-    if not session_id or not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): socketio_emit('error', {'message': f'Invalid session ID format or length.'}, to=request.sid); return
-    join_room(session_id); print(f"Client {request.sid} joined session room: {session_id}")
-    current_session_state = session_states.get(session_id)
-    if not current_session_state: current_session_state = get_default_session_state(); session_states[session_id] = current_session_state
-    print(f"Sending initial state for session {session_id} to client {request.sid}")
-    socketio_emit('state_update', current_session_state, to=request.sid)
+    if not session_id or not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): return None, None, 'Invalid session ID format or length.'
+    try: entry = session_store.get_or_create(session_id, get_default_session_state)
+    except SessionLimitError: return None, None, 'Server session limit reached.'
+    return session_id, entry, None
 
-@socketio.on('gm_update')
-def handle_gm_update(data):
-    if not isinstance(data, dict) or 'session_id' not in data or 'update_data' not in data: return
+def get_requested_state(data):
+    # Full state message for a resync request, or None
+    if not isinstance(data, dict) or 'session_id' not in data: return None
+    session_id = data['session_id']
+    if not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): return None
+    entry = session_store.get(session_id)
+    if entry is None: return None
+    STATE_RESYNCS.inc(); return get_full_state_message(entry)
+
+def parse_gm_update(data):
+    # Returns (session_id, update_delta, immediate) or None if the update is invalid
+    if not isinstance(data, dict) or 'session_id' not in data or 'update_data' not in data: return None
     session_id = data['session_id']
     update_delta = data['update_data']
-    if not session_id or not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): print(f"Error: GM update received with invalid session ID: {session_id}"); return
-    if session_id not in session_states: print(f"Creating new session state for ID: {session_id}"); session_states[session_id] = get_default_session_state()
-    print(f"Received GM update for session {session_id}: {json.dumps(update_delta)}")
+    if not session_id or not isinstance(session_id, str) or not SESSION_ID_REGEX.match(session_id): logger.warning("GM update received with invalid session ID: %r", session_id); return None
+    if not isinstance(update_delta, dict): return None
+    # Map changes bypass coalescing so players start loading the new map straight away
+    return session_id, update_delta, 'map_content_path' in update_delta
+
+def apply_gm_update(session_id, update_delta):
+    # Applies a (possibly coalesced) GM delta to the session; returns the (event, payload) to broadcast, or None
+    start = time.perf_counter(); entry = None
     try:
-        current_state = copy.deepcopy(session_states[session_id]); new_content_path = update_delta.get('map_content_path')
+        try: entry = session_store.get_or_create(session_id, get_default_session_state)
+        except SessionLimitError: logger.warning("Session limit reached, dropping GM update for %s", session_id); return None
+        GM_UPDATES.inc(session=session_id) # Counted once the session exists, so rejected session IDs never get a metric series
+        previous_state = entry.state
+        current_state = previous_state; new_content_path = update_delta.get('map_content_path'); state_reset = False
+        if 'map_content_path' in update_delta and new_content_path != current_state.get('map_content_path'): autosave_session(session_id, previous_state) # Keep unsaved view/filter changes of the map being left
         if new_content_path and new_content_path != current_state.get('map_content_path'):
             map_filename = os.path.basename(new_content_path); map_path_on_disk = os.path.join(app.config['MAPS_FOLDER'], secure_filename(map_filename))
             if os.path.exists(map_path_on_disk) and allowed_map_file(map_filename):
                 new_map_state = get_state_for_map(map_filename)
-                if new_map_state: current_state = new_map_state; print(f"Session {session_id}: Reset state based on map '{map_filename}'.")
-                else: print(f"Warning: Could not generate state for map '{map_filename}'."); return
-            else: print(f"Warning: New content path invalid: '{new_content_path}'."); return
-        elif new_content_path is None and 'map_content_path' in update_delta: current_state = get_default_session_state()
-        updated_state = merge_dicts(current_state, update_delta); updated_state['display_type'] = 'image'
-        session_states[session_id] = updated_state; print(f"Session {session_id}: State updated. Broadcasting.")
-        socketio.emit('state_update', updated_state, room=session_id)
-    except Exception as e: print(f"Error processing GM update for session {session_id}: {e}"); traceback.print_exc()
+                if new_map_state: current_state = new_map_state; state_reset = True; logger.info("Session %s: reset state based on map '%s'", session_id, map_filename)
+                else: logger.warning("Could not generate state for map '%s'", map_filename); return None
+            else: logger.warning("New content path invalid: '%s'", new_content_path); return None
+        elif new_content_path is None and 'map_content_path' in update_delta: current_state = get_default_session_state(); state_reset = True
+        updated_state = merge_dicts(current_state, update_delta); updated_state['display_type'] = 'image' # merge_dicts copies, so shared/cached states are never modified
+        patch = None if state_reset else diff_state(previous_state, updated_state)
+        if patch == {}: return None # Nothing changed, nothing to broadcast
+        base_version = entry.version; version = base_version + 1
+        session_store.put(session_id, updated_state, version)
+        if patch and ('view_state' in patch or 'filter_params' in patch): mark_for_autosave(session_id, updated_state)
+        if patch is None:
+            logger.debug("Session %s: state reset (v%d), broadcasting full state", session_id, version)
+            message = 'state_update', {**updated_state, "version": version}
+        else: message = 'state_patch', {"version": version, "base_version": base_version, "patch": patch}
+        record_broadcast(session_id, *message)
+        return message
+    except Exception: logger.exception("Error processing GM update for session %s", session_id); return None
+    finally: record_gm_update(session_id if entry else None, time.perf_counter() - start)
+
+def apply_and_broadcast(session_id, update_delta):
+    message = apply_gm_update(session_id, update_delta)
+    if message: socketio.emit(message[0], message[1], room=session_id)
+
+update_scheduler = UpdateScheduler(apply_and_broadcast, app.config['GM_UPDATE_MAX_HZ'], start_background_task=socketio.start_background_task, sleep=socketio.sleep)
+
+@socketio.on('join_session')
+def handle_join_session(data):
+    session_id, entry, error = prepare_join(data)
+    if error: socketio_emit('error', {'message': error}, to=request.sid); return
+    join_room(session_id); session_store.add_member(session_id, request.sid); logger.debug("Client %s joined session room: %s", request.sid, session_id)
+    socketio_emit('state_update', get_full_state_message(entry), to=request.sid)
+    if has_prefetch_queue(session_id):
+        socketio_emit('prefetch_hints', get_prefetch_hints(session_id), to=request.sid)
+        socketio.emit('prefetch_status', get_prefetch_status(session_id), to=get_gm_room(session_id))
+
+@socketio.on('request_state')
+def handle_request_state(data):
+    # Players ask for a full resync when they detect a gap in patch versions
+    message = get_requested_state(data)
+    if message: socketio_emit('state_update', message, to=request.sid)
+
+@socketio.on('gm_update')
+def handle_gm_update(data):
+    parsed = parse_gm_update(data)
+    if parsed: update_scheduler.submit(*parsed)
+
+@socketio.on('watch_session_stats')
+def handle_watch_session_stats(data):
+    watch_session_stats(request.sid, data)
+
+@socketio.on('watch_prefetch_status')
+def handle_watch_prefetch_status(data):
+    session_id = get_valid_session_id(data)
+    if session_id: join_room(get_gm_room(session_id)); socketio_emit('prefetch_status', get_prefetch_status(session_id), to=request.sid)
+
+@socketio.on('set_prefetch_queue')
+def handle_set_prefetch_queue(data):
+    session_id = set_prefetch_queue(data)
+    if not session_id: socketio_emit('error', {'message': 'Invalid prefetch queue request.'}, to=request.sid); return
+    join_room(get_gm_room(session_id))
+    socketio.emit('prefetch_hints', get_prefetch_hints(session_id), room=session_id)
+    socketio.emit('prefetch_status', get_prefetch_status(session_id), to=get_gm_room(session_id))
+
+@socketio.on('prefetch_ready')
+def handle_prefetch_ready(data):
+    session_id = record_prefetch_report(request.sid, data)
+    if session_id: socketio.emit('prefetch_status', get_prefetch_status(session_id), to=get_gm_room(session_id))
 
 # --- Main Execution ---
-if __name__ == '__main__':
+def main():
+    # Development server; started by server.py (or `python app.py`, which hands over to it)
     print("------------------------------------------")
     print("Starting Dynamic Map Renderer server...")
-    print("Backend version: 2.5.2 (Hardcoded Session ID - Verified)") # Version updated
+    print("Backend version: 2.19.11 (Read-only Map State Cache)")
     print(f"Serving map images from: {app.config['MAPS_FOLDER']}")
     print(f"Using configs from: {app.config['CONFIGS_FOLDER']}")
     print(f"Loading filters from: {app.config['FILTERS_FOLDER']}")
+    print(f"Writing map tiles to: {app.config['TILES_FOLDER']}")
+    print(f"Ingest workers: {app.config['INGEST_WORKERS']} (max map dimension {app.config['MAP_MAX_DIMENSION']}px)")
+    print(f"Session store: {app.config['SESSION_STORE']}" + (f" ({app.config['SESSION_DB_PATH']})" if app.config['SESSION_STORE'] == 'sqlite' else ""))
+    print(f"Log level: {app.config['LOG_LEVEL'].upper()} ({app.config['LOG_FORMAT']}), metrics at /metrics")
     print("Access GM View: http://127.0.0.1:5000/")
     print("Access Player View: http://127.0.0.1:5000/player?session=my-game") # Example
     print("------------------------------------------")
@@ -0,0 +1,228 @@
+# asgi_app.py
+# Version: 1.8 (Threaded Session Sweep)
+# Alternative asyncio/ASGI entry point for large player fan-out.
+# Run with:  uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# Socket.IO events run on python-socketio's AsyncServer; map images, thumbnails, tiles and
+# static assets are streamed asynchronously; all other routes (including the in-memory precompressed
+# shaders) are served by the Flask app.
+
+import os
+import re
+import time
+import asyncio
+import logging
+import mimetypes
+from urllib.parse import parse_qs
+import socketio
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.security import safe_join
+
+import app as core
+from update_scheduler import AsyncUpdateScheduler
+
+CHUNK_SIZE = 64 * 1024
+STATIC_FOLDER = os.path.join(core.APP_ROOT, 'static')
+logger = logging.getLogger('dynamic_map.asgi')
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+flask_asgi = WsgiToAsgi(core.app)
+
+# --- Socket.IO Event Handlers ---
+async def apply_and_broadcast(session_id, update_delta):
+    message = await asyncio.to_thread(core.apply_gm_update, session_id, update_delta) # Map switches hash images and read configs; the scheduler's per-session lock keeps updates in order
+    if message: await sio.emit(message[0], message[1], room=session_id)
+
+update_scheduler = AsyncUpdateScheduler(apply_and_broadcast, core.app.config['GM_UPDATE_MAX_HZ'])
+sweeper_started = False
+event_loop = None
+
+def on_startup():
+    global event_loop; event_loop = asyncio.get_running_loop()
+
+def notify_client(event, payload, sid):
+    # Ingest jobs report progress from worker threads; hand the emit over to the event loop
+    if event_loop: asyncio.run_coroutine_threadsafe(sio.emit(event, payload, to=sid), event_loop)
+
+core.set_client_notifier(notify_client)
+
+def forget_scheduled_updates(session_id):
+    # Sessions can be evicted from worker threads (joins and updates run in to_thread); the scheduler lives on the loop
+    if event_loop: event_loop.call_soon_threadsafe(update_scheduler.forget, session_id)
+    else: update_scheduler.forget(session_id)
+
+core.set_scheduler_forgetter(forget_scheduled_updates)
+
+async def session_sweeper():
+    while True:
+        await sio.sleep(core.app.config['SESSION_SWEEP_INTERVAL'])
+        # Eviction, SQLite flushes and pruning run in a thread; only the scheduler cleanup comes back to the loop
+        await asyncio.to_thread(core.sweep_sessions)
+
+async def session_stats_reporter():
+    while True:
+        await sio.sleep(core.app.config['SESSION_STATS_INTERVAL'])
+        for sid, stats in core.collect_session_stats(): await sio.emit('session_stats', stats, to=sid)
+
+async def config_autosaver():
+    while True:
+        await sio.sleep(core.app.config['CONFIG_AUTOSAVE_INTERVAL'])
+        try: await asyncio.to_thread(core.autosave_session_configs) # Reads map configs from disk
+        except Exception: logger.exception("Error autosaving session configs")
+
+@sio.event
+async def connect(sid, environ):
+    global sweeper_started
+    if not sweeper_started:
+        sweeper_started = True; sio.start_background_task(session_sweeper)
+        if core.app.config['SESSION_STATS_INTERVAL'] > 0: sio.start_background_task(session_stats_reporter)
+        if core.app.config['CONFIG_AUTOSAVE_INTERVAL'] > 0: sio.start_background_task(config_autosaver)
+    core.SOCKET_CONNECTIONS.inc(); logger.debug("Client connected: %s", sid)
+
+@sio.event
+async def disconnect(sid, *args):
+    session_ids = core.session_store.remove_member(sid); core.unwatch_session_stats(sid); core.SOCKET_CONNECTIONS.dec(); logger.debug("Client disconnected: %s", sid)
+    for session_id in core.forget_prefetch_reports(sid, session_ids): await sio.emit('prefetch_status', core.get_prefetch_status(session_id), to=core.get_gm_room(session_id))
+
+@sio.on('join_session')
+async def join_session(sid, data):
+    session_id, entry, error = await asyncio.to_thread(core.prepare_join, data) # May load the session from SQLite
+    if error: await sio.emit('error', {'message': error}, to=sid); return
+    await sio.enter_room(sid, session_id); core.session_store.add_member(session_id, sid); logger.debug("Client %s joined session room: %s", sid, session_id)
+    await sio.emit('state_update', core.get_full_state_message(entry), to=sid)
+    if core.has_prefetch_queue(session_id):
+        await sio.emit('prefetch_hints', core.get_prefetch_hints(session_id), to=sid)
+        await sio.emit('prefetch_status', core.get_prefetch_status(session_id), to=core.get_gm_room(session_id))
+
+@sio.on('request_state')
+async def request_state(sid, data):
+    message = await asyncio.to_thread(core.get_requested_state, data)
+    if message: await sio.emit('state_update', message, to=sid)
+
+@sio.on('gm_update')
+async def gm_update(sid, data):
+    parsed = core.parse_gm_update(data)
+    if parsed: await update_scheduler.submit(*parsed)
+
+@sio.on('watch_session_stats')
+async def watch_session_stats(sid, data):
+    core.watch_session_stats(sid, data)
+
+@sio.on('watch_prefetch_status')
+async def watch_prefetch_status(sid, data):
+    session_id = core.get_valid_session_id(data)
+    if session_id: await sio.enter_room(sid, core.get_gm_room(session_id)); await sio.emit('prefetch_status', core.get_prefetch_status(session_id), to=sid)
+
+@sio.on('set_prefetch_queue')
+async def set_prefetch_queue(sid, data):
+    session_id = await asyncio.to_thread(core.set_prefetch_queue, data) # Hint building hashes map files
+    if not session_id: await sio.emit('error', {'message': 'Invalid prefetch queue request.'}, to=sid); return
+    await sio.enter_room(sid, core.get_gm_room(session_id))
+    await sio.emit('prefetch_hints', core.get_prefetch_hints(session_id), room=session_id)
+    await sio.emit('prefetch_status', core.get_prefetch_status(session_id), to=core.get_gm_room(session_id))
+
+@sio.on('prefetch_ready')
+async def prefetch_ready(sid, data):
+    session_id = core.record_prefetch_report(sid, data)
+    if session_id: await sio.emit('prefetch_status', core.get_prefetch_status(session_id), to=core.get_gm_room(session_id))
+
+# --- Non-Blocking File Serving ---
+def parse_range(range_header, size):
+    # Single byte range only; returns (start, end) inclusive, or None to send the whole file
+    match = re.match(r'^bytes=(\d*)-(\d*)$', range_header.strip()) if range_header else None
+    if not match or (not match.group(1) and not match.group(2)): return None
+    if match.group(1):
+        start = int(match.group(1)); end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start = max(0, size - int(match.group(2))); end = size - 1
+    return (start, end) if start <= end < size else None
+
+async def send_file(send, path, request_headers, method, etag=None, cache_control=core.REVALIDATE_CACHE_CONTROL, vary=None):
+    # Returns (status, body bytes sent)
+    try: size = (await asyncio.to_thread(os.stat, path)).st_size
+    except OSError: return await send_not_found(send)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = [(b'content-type', content_type.encode()), (b'cache-control', cache_control.encode()), (b'accept-ranges', b'bytes')]
+    if vary: headers.append((b'vary', vary.encode()))
+    if etag:
+        quoted_etag = f'"{etag}"'; headers.append((b'etag', quoted_etag.encode()))
+        if_none_match = request_headers.get(b'if-none-match', b'').decode('latin-1')
+        if quoted_etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers[1:]})
+            await send({'type': 'http.response.body', 'body': b''}); return 304, 0
+    byte_range = parse_range(request_headers.get(b'range', b'').decode('latin-1'), size)
+    start, end = byte_range if byte_range else (0, size - 1)
+    if byte_range: headers.append((b'content-range', f"bytes {start}-{end}/{size}".encode()))
+    headers.append((b'content-length', str(end - start + 1 if size else 0).encode()))
+    status = 206 if byte_range else 200
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    if method == 'HEAD' or not size: await send({'type': 'http.response.body', 'body': b''}); return status, 0
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk: break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+        if remaining > 0: await send({'type': 'http.response.body', 'body': b''}) # File shrank mid-response
+    finally: await asyncio.to_thread(f.close)
+    return status, end - start + 1 - remaining
+
+async def send_not_found(send):
+    body = b'{"error": "File not found"}'
+    await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+    return 404, 0
+
+# Each resolver returns (path, etag, cache_control, vary), or None for a 404
+def resolve_map(match, version, request_headers):
+    path = core.resolve_map_image_path(match.group(1))
+    accept = request_headers.get(b'accept', b'').decode('latin-1')
+    return (*core.get_map_representation(path, version, accept), 'Accept') if path else None
+
+def resolve_thumbnail(match, version, request_headers):
+    path = core.resolve_thumbnail_path(match.group(1))
+    return (path, match.group(1).split('.')[0], core.IMMUTABLE_CACHE_CONTROL, None) if path else None
+
+def resolve_tile(match, version, request_headers):
+    path = core.resolve_tile_path(match.group(1), match.group(2), match.group(3))
+    return (path, *core.get_tile_cache_validators(match.group(1), path, version), None) if path else None
+
+def resolve_static(match, version, request_headers):
+    path = safe_join(STATIC_FOLDER, match.group(1))
+    signature = core.get_file_signature(path) if path and os.path.isfile(path) else None
+    return (path, f"{signature[0]:x}-{signature[1]:x}", core.REVALIDATE_CACHE_CONTROL, None) if signature else None
+
+# (pattern, resolver, endpoint name matching the Flask route for request metrics, kind counted in map bytes served)
+FILE_ROUTES = [
+    (re.compile(r'^/maps/([^/]+)$'), resolve_map, 'serve_map_image', 'map'),
+    (re.compile(r'^/thumbnails/([^/]+)$'), resolve_thumbnail, 'serve_thumbnail', 'thumbnail'),
+    (re.compile(r'^/tiles/([^/]+)/(\d+)/([^/]+)$'), resolve_tile, 'serve_map_tile', 'tile'),
+    (re.compile(r'^/static/(.+)$'), resolve_static, 'static', None),
+]
+
+async def http_app(scope, receive, send):
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        for pattern, resolve, endpoint, kind in FILE_ROUTES:
+            match = pattern.match(scope['path'])
+            if match:
+                start = time.perf_counter()
+                version = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('v', [None])[0]
+                request_headers = dict(scope['headers'])
+                resolved = await asyncio.to_thread(resolve, match, version, request_headers) # Hashing and stat calls stay off the loop
+                if not resolved: status, byte_count = await send_not_found(send)
+                else:
+                    path, etag, cache_control, vary = resolved
+                    status, byte_count = await send_file(send, path, request_headers, scope['method'], etag, cache_control, vary)
+                    if kind: core.record_bytes_served(kind, path, status, byte_count)
+                core.record_http_request(endpoint, status, time.perf_counter() - start)
+                return
+    await flask_asgi(scope, receive, send)
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=on_startup, on_shutdown=core.session_store.flush)
+
+if __name__ == '__main__':
+    import uvicorn
+    print("Starting Dynamic Map Renderer (ASGI mode)...")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
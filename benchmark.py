@@ -0,0 +1,229 @@
+# benchmark.py
+# Version: 1.2 (Bootstrap Bundle Timing)
+# Load test and micro-benchmarks for the Socket.IO session path.
+# Runs the app in-process and drives it with Flask-SocketIO test clients (no network, no browser):
+#   python benchmark.py all --sessions 2 --players 50 --duration 10 --rate 60
+#   python benchmark.py micro --compare benchmark_results/<previous>.json
+# Results are written as JSON (benchmark_results/ by default) so runs can be compared across versions.
+
+import os
+import sys
+import json
+import math
+import time
+import timeit
+import argparse
+import platform
+import subprocess
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FOLDER = os.path.join(APP_ROOT, 'benchmark_results')
+
+# --- Measurement Helpers ---
+def percentiles(values, points=(50, 90, 99)):
+    # Nearest-rank percentiles plus max/mean; empty input gives None values
+    ordered = sorted(values)
+    result = {f"p{p}": ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] if ordered else None for p in points}
+    result["max"] = ordered[-1] if ordered else None
+    result["mean"] = sum(ordered) / len(ordered) if ordered else None
+    return result
+
+def get_rss_bytes():
+    # Current resident set size (Linux), falling back to the peak RSS reported by getrusage
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+        except ImportError: return None
+
+def get_git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_ROOT, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+def get_backend_version():
+    # Read from the app.py header so the benchmark does not depend on import side effects
+    with open(os.path.join(APP_ROOT, 'app.py'), encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('# Version:'): return line.split(':', 1)[1].strip()
+    return None
+
+def time_call(fn, repeat=5):
+    # timeit auto-ranging; reports the best and median per-call time of `repeat` runs
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {"iterations": number * repeat, "best_us": runs[0] * 1e6, "median_us": runs[len(runs) // 2] * 1e6, "ops_per_sec": 1.0 / runs[len(runs) // 2]}
+
+class RecordingQueue(list):
+    # Stands in for a test client's message queue: records the arrival time, size and benchmark
+    # sequence number of each event instead of keeping the payloads
+    def __init__(self):
+        super().__init__(); self.records = [] # (perf_counter time, event name, bench_seq or None, payload bytes)
+
+    def append(self, item):
+        payload = item['args'][0] if item['args'] else {}
+        body = payload.get('patch', payload) if isinstance(payload, dict) else {}
+        size = len(json.dumps(item['args'], separators=(',', ':')))
+        self.records.append((time.perf_counter(), item['name'], body.get('bench_seq') if isinstance(body, dict) else None, size))
+
+# --- Load Test ---
+def run_load_test(core, sessions, players, duration, rate, map_filename):
+    # Each session has one GM sending view changes (like dragging a slider) at `rate` Hz and
+    # `players` players. Latency is measured from a GM emit to each player's receipt of the first
+    # broadcast that includes it, so time spent in the coalescing buffer is counted.
+    socketio, app = core.socketio, core.app
+    rss_before = get_rss_bytes()
+    groups = []; join_times = []
+    for s in range(sessions):
+        session_id = f"bench-{os.getpid()}-{s}"
+        gm = socketio.test_client(app); player_clients = []
+        gm.emit('gm_update', {'session_id': session_id, 'update_data': {'map_content_path': f"maps/{map_filename}"}})
+        for _ in range(players):
+            client = socketio.test_client(app); client.queue = RecordingQueue()
+            start = time.perf_counter(); client.emit('join_session', {'session_id': session_id}); join_times.append((time.perf_counter() - start) * 1000)
+            player_clients.append(client)
+        groups.append((session_id, gm, player_clients))
+    rss_connected = get_rss_bytes()
+    time.sleep(0.2)
+    for _, _, player_clients in groups:
+        for client in player_clients: client.queue.records.clear()
+
+    send_times = [dict() for _ in groups] # per session: seq -> send time
+    interval = 1.0 / rate; seq = 0
+    cpu_start = time.process_time(); start = time.perf_counter(); next_send = start
+    while time.perf_counter() - start < duration:
+        seq += 1; phase = seq / 20.0
+        update = {'view_state': {'center_x': round(0.5 + 0.3 * math.sin(phase), 4), 'center_y': round(0.5 + 0.3 * math.cos(phase), 4), 'scale': 1.0}, 'bench_seq': seq}
+        for index, (session_id, gm, _) in enumerate(groups):
+            send_times[index][seq] = time.perf_counter(); gm.emit('gm_update', {'session_id': session_id, 'update_data': update})
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    time.sleep(max(0.5, 2.0 / max(1.0, app.config['GM_UPDATE_MAX_HZ'] or 1.0))) # Let the last coalesced flush go out
+    cpu_seconds = time.process_time() - cpu_start
+
+    latencies = []; missed = 0; broadcasts = 0; bytes_per_player = []
+    for index, (_, _, player_clients) in enumerate(groups):
+        times = send_times[index]
+        for player_number, client in enumerate(player_clients):
+            delivered = 0
+            for received_at, _, bench_seq, _ in client.queue.records:
+                if bench_seq is None or bench_seq <= delivered: continue
+                latencies.extend((received_at - times[s]) * 1000 for s in range(delivered + 1, bench_seq + 1))
+                delivered = bench_seq
+            missed += seq - delivered
+            bytes_per_player.append(sum(record[3] for record in client.queue.records))
+            if player_number == 0: broadcasts += len(client.queue.records)
+    for _, gm, player_clients in groups:
+        for client in player_clients: client.disconnect()
+        gm.disconnect()
+    messages = broadcasts * players
+    return {
+        "sessions": sessions, "players_per_session": players, "duration_s": elapsed, "gm_update_rate_hz": rate,
+        "gm_update_max_hz": app.config['GM_UPDATE_MAX_HZ'], "map": map_filename,
+        "gm_updates_sent": seq * sessions, "updates_not_delivered": missed,
+        "join_ms": percentiles(join_times),
+        "update_to_receive_ms": percentiles(latencies),
+        "broadcasts_per_second": broadcasts / elapsed, "messages_delivered_per_second": messages / elapsed,
+        "bytes_per_player": percentiles(bytes_per_player), "bytes_per_player_per_second": (sum(bytes_per_player) / len(bytes_per_player) / elapsed) if bytes_per_player else None,
+        "server_cpu_seconds": cpu_seconds, "server_cpu_percent": 100.0 * cpu_seconds / elapsed, # In-process: includes the simulated clients
+        "rss_mb": {"before": rss_before / 2**20 if rss_before else None, "connected": rss_connected / 2**20 if rss_connected else None, "after": (get_rss_bytes() or 0) / 2**20 or None},
+    }
+
+# --- Micro-benchmarks ---
+def run_micro_benchmarks(core, map_filename):
+    results = {}
+    map_state = core.get_state_for_map(map_filename)
+    if map_state is None: raise SystemExit(f"Map not found or not loadable: {map_filename}")
+    delta = {'view_state': {'center_x': 0.25, 'center_y': 0.75, 'scale': 1.5}}
+    merged = core.merge_dicts(map_state, delta)
+    results["merge_dicts"] = time_call(lambda: core.merge_dicts(map_state, delta))
+    results["diff_state"] = time_call(lambda: core.diff_state(map_state, merged))
+    session_id = f"bench-micro-{os.getpid()}"
+    core.apply_gm_update(session_id, {'map_content_path': f"maps/{map_filename}"})
+    toggle = [0]
+    def apply_update():
+        toggle[0] ^= 1; core.apply_gm_update(session_id, {'view_state': {'center_x': 0.25 + 0.5 * toggle[0]}})
+    results["apply_gm_update"] = time_call(apply_update)
+    results["get_state_for_map_cached"] = time_call(lambda: core.get_state_for_map(map_filename))
+    def load_uncached():
+        core.invalidate_map_state(map_filename); core.get_state_for_map(map_filename)
+    results["get_state_for_map_uncached"] = time_call(load_uncached)
+    client = core.app.test_client()
+    etag = client.get('/api/filters').headers.get('ETag')
+    results["api_filters"] = time_call(lambda: client.get('/api/filters'))
+    results["api_filters_not_modified"] = time_call(lambda: client.get('/api/filters', headers={'If-None-Match': etag}))
+    results["api_bootstrap"] = time_call(lambda: client.get('/api/bootstrap'))
+    return results
+
+# --- Reporting ---
+COMPARE_METRICS = [
+    ('load', 'update_to_receive_ms', 'p50'), ('load', 'update_to_receive_ms', 'p99'), ('load', 'broadcasts_per_second'),
+    ('load', 'bytes_per_player_per_second'), ('load', 'server_cpu_percent'), ('load', 'join_ms', 'p50'),
+] + [('micro', name, 'median_us') for name in ('merge_dicts', 'diff_state', 'apply_gm_update', 'get_state_for_map_cached', 'get_state_for_map_uncached', 'api_filters', 'api_filters_not_modified')]
+
+def lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data: return None
+        data = data[key]
+    return data
+
+def print_comparison(baseline, results):
+    print(f"\nCompared with {baseline['meta'].get('backend_version')} ({baseline['meta'].get('git_commit')}):")
+    for path in COMPARE_METRICS:
+        old, new = lookup(baseline, path), lookup(results, path)
+        if old is None or new is None: continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {'.'.join(path):<45} {old:>12.2f} -> {new:>12.2f}  {change}")
+
+def print_summary(results):
+    load = results.get('load')
+    if load:
+        latency = load['update_to_receive_ms']
+        print(f"Load: {load['sessions']} session(s) x {load['players_per_session']} players, {load['gm_updates_sent']} GM updates in {load['duration_s']:.1f}s")
+        if latency['p50'] is not None: print(f"  update->receive ms: p50 {latency['p50']:.2f}  p90 {latency['p90']:.2f}  p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+        print(f"  broadcasts/s: {load['broadcasts_per_second']:.1f}  messages/s: {load['messages_delivered_per_second']:.1f}  not delivered: {load['updates_not_delivered']}")
+        if load['bytes_per_player_per_second'] is not None: print(f"  bytes/player/s: {load['bytes_per_player_per_second']:.0f}  cpu: {load['server_cpu_percent']:.0f}%  rss: {load['rss_mb']['after']:.1f} MB")
+    for name, stats in (results.get('micro') or {}).items():
+        print(f"  {name:<28} {stats['median_us']:>10.2f} us  ({stats['ops_per_sec']:.0f} ops/s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test and micro-benchmarks for the Dynamic Map Renderer session path.")
+    parser.add_argument('suite', nargs='?', choices=['load', 'micro', 'all'], default='all')
+    parser.add_argument('--sessions', type=int, default=1, help="Simulated GMs, each with their own session")
+    parser.add_argument('--players', type=int, default=20, help="Simulated players per session")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds of GM updates to send")
+    parser.add_argument('--rate', type=float, default=60.0, help="GM updates per second per session")
+    parser.add_argument('--map', dest='map_filename', help="Map to use (default: first map in maps/)")
+    parser.add_argument('--output', help="Results file (default: benchmark_results/<timestamp>-<commit>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SESSION_STORE', 'memory') # Never write benchmark sessions into a real session database
+    os.environ.setdefault('LOG_LEVEL', 'WARNING') # Keep per-connection logging out of the results
+    sys.path.insert(0, APP_ROOT)
+    import app as core
+    map_filename = args.map_filename or next((f for f in sorted(os.listdir(core.app.config['MAPS_FOLDER'])) if core.allowed_map_file(f)), None)
+    if not map_filename: raise SystemExit("No maps found; add a map to maps/ or pass --map.")
+
+    results = {"meta": {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'), "backend_version": get_backend_version(), "git_commit": get_git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(), "args": vars(args),
+    }}
+    if args.suite in ('micro', 'all'): print("Running micro-benchmarks..."); results["micro"] = run_micro_benchmarks(core, map_filename)
+    if args.suite in ('load', 'all'): print("Running load test..."); results["load"] = run_load_test(core, args.sessions, args.players, args.duration, args.rate, map_filename)
+    print_summary(results)
+
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['git_commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f: print_comparison(json.load(f), results)
+
+if __name__ == '__main__':
+    main()
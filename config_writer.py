@@ -0,0 +1,110 @@
+# config_writer.py
+# Version: 1.1
+# Crash-safe JSON file writes (temp file + fsync + rename) behind a coalescing write-behind queue
+
+import os
+import json
+import stat
+import time
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger('dynamic_map.config_writer')
+
+def get_new_file_mode():
+    # Mode open() gives a new file: 0o666 minus the umask. The umask can only be read by setting it, so this runs once, at import
+    umask = os.umask(0o022); os.umask(umask)
+    return 0o666 & ~umask
+
+NEW_FILE_MODE = get_new_file_mode()
+
+def sync_directory(directory):
+    # Makes a completed rename durable; directories cannot be opened for fsync on Windows
+    try: fd = os.open(directory, os.O_RDONLY)
+    except OSError: return
+    try: os.fsync(fd)
+    except OSError: pass
+    finally: os.close(fd)
+
+def write_json_atomic(path, data):
+    # Readers (and a restart after a crash) see either the previous file or the complete new one, never a partial write
+    directory = os.path.dirname(path) or '.'
+    try: mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError: mode = NEW_FILE_MODE
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False); f.flush(); os.fsync(f.fileno())
+        os.chmod(temp_path, mode) # mkstemp creates the file as 0600; the replaced file keeps its mode, a new one gets the usual mode
+        os.replace(temp_path, path)
+    except BaseException:
+        try: os.unlink(temp_path)
+        except OSError: pass
+        raise
+    sync_directory(directory)
+
+class WriteBehindWriter:
+    # Writes are queued per path and done by a single worker thread, so writes to one file never overlap.
+    # Saving a path that is still queued replaces the queued data: only the newest version is written.
+    # `on_written(path, ok)` is called by the worker after each write attempt; the last outcome per path is kept for get_status.
+    def __init__(self, write_fn=write_json_atomic, on_written=None):
+        self.write_fn = write_fn
+        self.on_written = on_written
+        self.condition = threading.Condition()
+        self.pending = {}     # path -> newest queued data, in order of first submission
+        self.in_flight = None # (path, data) being written
+        self.results = {}     # path -> (ok, time) of the last finished write
+        self.worker = None
+        self.closed = False
+
+    def submit(self, path, data):
+        # Returns True if the data replaced a queued, not yet written version of the same path
+        with self.condition:
+            if self.closed: raise RuntimeError("Writer is closed")
+            coalesced = path in self.pending
+            self.pending[path] = data; self.condition.notify_all()
+            if self.worker is None: self.worker = threading.Thread(target=self._run, name='config-writer', daemon=True); self.worker.start()
+        return coalesced
+
+    def get_pending(self, path):
+        # Newest data for the path that may not be on disk yet, or None, so reads see their own saves
+        with self.condition:
+            if path in self.pending: return self.pending[path]
+            return self.in_flight[1] if self.in_flight and self.in_flight[0] == path else None
+
+    def get_status(self, path):
+        # (pending, last_result): whether a write of the path is queued or running, and (ok, time) of the last finished write or None
+        with self.condition: return path in self.pending or bool(self.in_flight and self.in_flight[0] == path), self.results.get(path)
+
+    def wait_written(self, path, timeout=None):
+        # Waits until no write of the path is queued or running; returns whether the last write succeeded, or None on timeout (or if the path was never written)
+        with self.condition:
+            if not self.condition.wait_for(lambda: path not in self.pending and not (self.in_flight and self.in_flight[0] == path), timeout): return None
+            result = self.results.get(path)
+            return result[0] if result else None
+
+    def pending_count(self):
+        with self.condition: return len(self.pending) + (1 if self.in_flight else 0)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed: self.condition.wait()
+                if not self.pending: return
+                path = next(iter(self.pending)); self.in_flight = (path, self.pending.pop(path))
+            ok = True
+            try: self.write_fn(*self.in_flight)
+            except Exception: ok = False; logger.exception("Failed to write %s", path) # The previous file is left intact
+            try:
+                if self.on_written: self.on_written(path, ok)
+            except Exception: logger.exception("Write callback failed for %s", path)
+            with self.condition: self.results[path] = (ok, time.time()); self.in_flight = None; self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        # Waits until everything queued so far has been written; returns False on timeout
+        with self.condition: return self.condition.wait_for(lambda: not self.pending and self.in_flight is None, timeout)
+
+    def close(self, timeout=10.0):
+        self.flush(timeout)
+        with self.condition: self.closed = True; self.condition.notify_all()
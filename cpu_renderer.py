@@ -0,0 +1,175 @@
+# cpu_renderer.py
+# Version: 1.1 (Cropped Textures)
+# Vectorized NumPy port of the static parts of the filter shaders, for server-rendered snapshots.
+# Mirrors player.js: the map is a plane 1 unit tall viewed by an orthographic camera placed by
+# view_state, and every output pixel runs the fragment shader maths on its plane UV (vUv).
+# Time-driven effects (static noise, flicker, picture roll, distortion, interference, hum bar,
+# wobble) are left out; a snapshot is the filter as it looks when those are at rest.
+# Only the part of the map the filter samples is decoded to floats, at about the on-screen resolution,
+# so a render's memory use follows the snapshot size rather than the map size.
+
+import math
+import numpy as np
+from PIL import Image
+
+RENDERER_VERSION = 2 # Bump whenever output changes, so cached snapshots are invalidated
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+AMBER_BASE = np.array([1.0, 0.65, 0.1], dtype=np.float32)
+TEXTURE_MARGIN = 2 # Texels kept around the sampled region, so bilinear neighbours at its edge are real map texels
+MAX_TEXELS_PER_PIXEL = 4 # Texture budget per output pixel; reached only when sampling wraps across the map
+
+# --- Shader Helpers (GLSL semantics) ---
+def smoothstep(edge0, edge1, x):
+    t = np.clip((x - edge0) / (edge1 - edge0), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+def fract(x):
+    return x - np.floor(x)
+
+class Texture:
+    # Float RGBA `pixels` (h, w, 4) of a window of the map. `full_width`/`full_height` are the size of the whole
+    # map at the texture's resolution and `offset_x`/`offset_y` the window's top-left corner in it, in texels.
+    __slots__ = ('pixels', 'full_width', 'full_height', 'offset_x', 'offset_y')
+    def __init__(self, pixels, full_width, full_height, offset_x=0, offset_y=0):
+        self.pixels = pixels; self.full_width = full_width; self.full_height = full_height; self.offset_x = offset_x; self.offset_y = offset_y
+
+def sample_bilinear(texture, u, v, channels=slice(None)):
+    # texture2D with LinearFilter and ClampToEdge; UV origin is bottom-left (three.js flipY). Samples outside the
+    # texture's window clamp to its edge. Gathers use flat indices, which is much faster than 2D fancy indexing.
+    pixels = texture.pixels[..., channels]
+    height, width, channel_count = pixels.shape
+    flat = pixels.reshape(height * width, channel_count)
+    x = (u * texture.full_width - 0.5 - texture.offset_x).ravel(); y = ((1.0 - v) * texture.full_height - 0.5 - texture.offset_y).ravel()
+    x0 = np.floor(x); y0 = np.floor(y)
+    fx = (x - x0)[:, None]; fy = (y - y0)[:, None]
+    x0 = x0.astype(np.int32); y0 = y0.astype(np.int32)
+    x1 = np.clip(x0 + 1, 0, width - 1); y1 = np.clip(y0 + 1, 0, height - 1)
+    np.clip(x0, 0, width - 1, out=x0); np.clip(y0, 0, height - 1, out=y0)
+    row0 = y0 * width; row1 = y1 * width
+    top = flat.take(row0 + x0, axis=0); top += (flat.take(row0 + x1, axis=0) - top) * fx
+    bottom = flat.take(row1 + x0, axis=0); bottom += (flat.take(row1 + x1, axis=0) - bottom) * fx
+    top += (bottom - top) * fy
+    return top.reshape(*np.shape(u), channel_count)
+
+# --- Geometry ---
+def prepare_texture(image, width, height, scale, bounds=(0.0, 0.0, 1.0, 1.0)):
+    # Texture of the UV window `bounds` (u_min, v_min, u_max, v_max), pre-reduced to about the on-screen resolution
+    # (what mipmapping would pick), and further if the window would exceed MAX_TEXELS_PER_PIXEL texels per output pixel.
+    # Pass an image that is not loaded yet so JPEGs can be decoded at reduced scale; the window is cut before the
+    # reduction and the float conversion.
+    required_height = max(1.0, height * max(0.01, scale))
+    if image.size[1] > 2 * required_height: image.draft(None, (math.ceil(image.size[0] * required_height / image.size[1]), math.ceil(required_height)))
+    u_min, v_min, u_max, v_max = bounds
+    factor = max(1, int(image.size[1] // required_height))
+    while True:
+        full_width = math.ceil(image.size[0] / factor); full_height = math.ceil(image.size[1] / factor)
+        left = max(0, math.floor(u_min * full_width) - TEXTURE_MARGIN); right = min(full_width, math.ceil(u_max * full_width) + TEXTURE_MARGIN)
+        top = max(0, math.floor((1.0 - v_max) * full_height) - TEXTURE_MARGIN); bottom = min(full_height, math.ceil((1.0 - v_min) * full_height) + TEXTURE_MARGIN)
+        excess = (right - left) * (bottom - top) / (MAX_TEXELS_PER_PIXEL * width * height)
+        if excess <= 1.0 or full_height == 1: break
+        factor = max(factor + 1, math.ceil(factor * math.sqrt(excess)))
+    box = (left * factor, top * factor, min(image.size[0], right * factor), min(image.size[1], bottom * factor))
+    region = image.reduce(factor, box) if factor > 1 else image.crop(box)
+    return Texture(np.asarray(region.convert('RGBA'), dtype=np.float32) / 255.0, full_width, full_height, left, top)
+
+def get_sample_bounds(covered, *uv_pairs):
+    # UV bounding box (u_min, v_min, u_max, v_max) of the sample coordinates at covered pixels, within [0, 1]
+    u_values = [np.broadcast_to(u, covered.shape)[covered] for u, _ in uv_pairs]; v_values = [np.broadcast_to(v, covered.shape)[covered] for _, v in uv_pairs]
+    if not u_values[0].size: return 0.0, 0.0, 0.0, 0.0
+    clip = lambda value: min(1.0, max(0.0, float(value)))
+    return (clip(min(u.min() for u in u_values)), clip(min(v.min() for v in v_values)),
+            clip(max(u.max() for u in u_values)), clip(max(v.max() for v in v_values)))
+
+def compute_plane_uv(view_state, width, height, image_aspect):
+    # Plane UV (vUv) under each output pixel, and a mask of pixels covered by the plane
+    scale = max(0.01, float(view_state.get('scale', 1.0)))
+    center_x = float(view_state.get('center_x', 0.5)); center_y = float(view_state.get('center_y', 0.5))
+    view_height = 1.0 / scale; view_width = view_height * (width / height)
+    camera_x = (center_x - 0.5) * image_aspect; camera_y = -(center_y - 0.5)
+    px = (np.arange(width, dtype=np.float32) + 0.5) / width - 0.5
+    py = 0.5 - (np.arange(height, dtype=np.float32) + 0.5) / height
+    u = np.broadcast_to(((camera_x + px * view_width) / image_aspect + 0.5)[None, :], (height, width))
+    v = np.broadcast_to((camera_y + py * view_height + 0.5)[:, None], (height, width))
+    covered = (u >= 0.0) & (u <= 1.0) & (v >= 0.0) & (v <= 1.0)
+    return u, v, covered
+
+# --- Filters ---
+# Each renderer works out where it samples the map, then calls load_texture(*uv_pairs) once to get a Texture covering them
+def render_none(load_texture, u, v, frag_y, params):
+    color = sample_bilinear(load_texture((u, v)), u, v)
+    if float(params.get('invertDisplay', 0.0)) > 0.5: color[..., :3] = 1.0 - color[..., :3]
+    color[..., 3] = np.where(color[..., 3] < 0.01, 0.0, color[..., 3])
+    return color
+
+def tint_amber(luminance, amount):
+    return luminance[..., None] * ((1.0 - amount) + amount * AMBER_BASE)
+
+def tint_green(luminance, amount):
+    return luminance[..., None] * np.array([1.0 - amount, 1.0, 1.0 - amount * 0.8], dtype=np.float32)
+
+def make_retro_filter(tint_fn, tint_param):
+    # retro_sci_fi_* fragment.glsl at rest; the variants differ only in their tint
+    def render(load_texture, u, v, frag_y, params):
+        p = lambda name, default=0.0: float(params.get(name, default))
+        # 1. Barrel warp and skew
+        centered_u = u * 2.0 - 1.0; centered_v = v * 2.0 - 1.0
+        warp = 1.0 + p('crtWarp') * (centered_u * centered_u + centered_v * centered_v)
+        final_u = (centered_u * warp + 1.0) / 2.0; final_v = (centered_v * warp + 1.0) / 2.0
+        keep = (final_u >= -0.2) & (final_u <= 1.2) & (final_v >= -0.2) & (final_v <= 1.2)
+        final_v = fract(final_v)
+        final_u = final_u + (final_v - 0.5) * p('skew')
+        sample_u = fract(final_u); sample_v = final_v
+        # 2. Chromatic aberration: offset along the direction from the centre, scaled by distance
+        aberration = p('chromaticAberration')
+        if aberration:
+            offset_u = (u - 0.5) * aberration; offset_v = (v - 0.5) * aberration
+            red_uv = (fract(sample_u + offset_u), fract(sample_v + offset_v)); blue_uv = (fract(sample_u - offset_u), fract(sample_v - offset_v))
+            texture = load_texture((sample_u, sample_v), red_uv, blue_uv)
+            red = sample_bilinear(texture, *red_uv, channels=slice(0, 1))[..., 0]
+            base = sample_bilinear(texture, sample_u, sample_v)
+            blue = sample_bilinear(texture, *blue_uv, channels=slice(2, 3))[..., 0]
+            rgb = np.stack([red, base[..., 1], blue], axis=-1)
+        else:
+            base = sample_bilinear(load_texture((sample_u, sample_v)), sample_u, sample_v); rgb = base[..., :3]
+        keep &= base[..., 3] >= 0.01
+        # 3. Colour effects
+        luminance = rgb @ LUMA
+        if p('invertColors') > 0.5: luminance = 1.0 - luminance
+        color = tint_fn(luminance, p(tint_param, 0.8))
+        color = ((color - 0.5) * p('contrast', 1.0) + 0.5) * p('brightness', 1.0)
+        scanline_factor = np.mod(frag_y * 0.5, 2.0)
+        color *= (1.0 - smoothstep(0.9, 1.1, scanline_factor) * p('scanlineIntensity'))[:, None, None]
+        radius = 0.75 - p('vignetteAmount') * 0.4
+        distance = np.sqrt((u - 0.5) ** 2 + (v - 0.5) ** 2)
+        color *= smoothstep(radius + 0.4, radius - 0.4, distance)[..., None]
+        # 4. Rounded corner mask
+        corner_radius = p('roundedCorners'); box = 0.5 - corner_radius
+        outside_u = np.maximum(np.abs(u - 0.5) - box, 0.0); outside_v = np.maximum(np.abs(v - 0.5) - box, 0.0)
+        corner_mask = 1.0 - smoothstep(-0.005, 0.005, np.sqrt(outside_u ** 2 + outside_v ** 2) - corner_radius)
+        color *= corner_mask[..., None]
+        alpha = base[..., 3] * corner_mask
+        keep &= alpha >= 0.01
+        return np.concatenate([np.clip(color, 0.0, 1.0), np.where(keep, alpha, 0.0)[..., None]], axis=-1)
+    return render
+
+FILTER_RENDERERS = {
+    'none': render_none,
+    'retro_sci_fi_amber': make_retro_filter(tint_amber, 'amberTint'),
+    'retro_sci_fi_green': make_retro_filter(tint_green, 'greenTint'),
+}
+
+def is_supported(filter_id):
+    return filter_id in FILTER_RENDERERS
+
+# --- Snapshot ---
+def render_snapshot(image, filter_id, params, view_state, width, height):
+    # Returns an RGBA PIL image of the player's view; filters without a CPU port render as 'none'
+    image_aspect = image.size[0] / image.size[1]; scale = float(view_state.get('scale', 1.0))
+    u, v, covered = compute_plane_uv(view_state, width, height, image_aspect)
+    if not covered.any(): return Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    load_texture = lambda *uv_pairs: prepare_texture(image, width, height, scale, get_sample_bounds(covered, *uv_pairs)) # Only pixels on the plane are kept
+    frag_y = height - np.arange(height, dtype=np.float32) - 0.5 # gl_FragCoord.y counts up from the bottom
+    color = FILTER_RENDERERS.get(filter_id, render_none)(load_texture, u, v, frag_y, params or {})
+    color[..., 3] *= covered
+    color[..., :3] *= (color[..., 3] > 0)[..., None] # Discarded fragments are fully transparent
+    return Image.fromarray(np.round(color * 255.0).astype(np.uint8), 'RGBA')
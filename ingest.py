@@ -0,0 +1,110 @@
+# ingest.py
+# Version: 1.1 (Standalone Thumbnail Stage)
+# Map upload ingest stages. Each stage is a plain top-level function so it can run in a
+# process pool: verify/decode/normalize the upload, then build compressed variants and a thumbnail.
+
+import os
+import hashlib
+from PIL import Image, ImageOps, features
+
+MAX_DIMENSION = 8192
+THUMBNAIL_SIZE = 256
+WEBP_QUALITY = 85
+AVIF_QUALITY = 60
+SAVE_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+def hash_file(path):
+    # Same truncated SHA-256 the server uses to version map URLs
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''): digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def save_atomic(image, dest_path, image_format, **options):
+    tmp_path = f"{dest_path}.tmp-{os.getpid()}"
+    try:
+        image.save(tmp_path, image_format, **options)
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+# --- Stage 1: Verify, Decode & Normalize ---
+def normalize_image(source_path, dest_path, max_dimension=MAX_DIMENSION):
+    # Rejects files that are not decodable images, applies EXIF orientation, drops all
+    # metadata (EXIF, text chunks, comments) and downscales originals larger than
+    # `max_dimension`. Saved in the format implied by dest_path's extension.
+    with Image.open(source_path) as probe: probe.verify() # Structural check; the image must be reopened afterwards
+    with Image.open(source_path) as src:
+        source_format = src.format
+        src.load()
+        transposed = src.getexif().get(0x0112, 1) != 1 # EXIF orientation tag
+        image = ImageOps.exif_transpose(src) if transposed else src
+        original_size = image.size
+        resized = max(original_size) > max_dimension
+        if resized: image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        extension = dest_path.rsplit('.', 1)[-1].lower()
+        image_format = SAVE_FORMATS[extension]
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        if image_format == 'JPEG':
+            # Reuse the source quantization tables when the pixels are untouched, avoiding generation loss
+            if source_format == 'JPEG' and image is src and not resized and image.mode in ('RGB', 'L'): options = {'quality': 'keep', 'optimize': True}
+            else: image = image.convert('RGB'); options = {'quality': 92, 'optimize': True}
+        elif image_format == 'PNG':
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'): image = image.convert('RGBA' if has_alpha else 'RGB')
+            options = {'optimize': True}
+        else:
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            options = {'quality': 90}
+        image.info.clear() # Strip metadata carried over from the source
+        save_atomic(image, dest_path, image_format, **options)
+    return {
+        "width": image.size[0], "height": image.size[1],
+        "original_width": original_size[0], "original_height": original_size[1],
+        "resized": resized, "source_format": source_format,
+        "bytes": os.path.getsize(dest_path), "content_hash": hash_file(dest_path),
+        "source_hash": hash_file(source_path) # Lets re-uploads of an already stored original be recognised
+    }
+
+# --- Stage 2: Compressed Variants & Thumbnail ---
+def get_variant_path(variants_dir, content_hash, image_format):
+    return os.path.join(variants_dir, f"{content_hash}.{image_format}")
+
+def get_thumbnail_path(thumbnails_dir, content_hash):
+    return os.path.join(thumbnails_dir, f"{content_hash}.webp")
+
+def build_variants(source_path, variants_dir, thumbnails_dir, content_hash, thumbnail_size=THUMBNAIL_SIZE):
+    # Variants and thumbnails are content addressed, so identical uploads share them
+    os.makedirs(variants_dir, exist_ok=True); os.makedirs(thumbnails_dir, exist_ok=True)
+    produced = {}
+    with Image.open(source_path) as src:
+        src.load()
+        has_alpha = src.mode in ('RGBA', 'LA', 'PA') or (src.mode == 'P' and 'transparency' in src.info)
+        image = src.convert('RGBA' if has_alpha else 'RGB')
+        source_bytes = os.path.getsize(source_path)
+        candidates = [('webp', 'WEBP', {'quality': WEBP_QUALITY, 'method': 4})]
+        if features.check('avif'): candidates.append(('avif', 'AVIF', {'quality': AVIF_QUALITY}))
+        for extension, image_format, options in candidates:
+            if src.format == image_format: continue
+            variant_path = get_variant_path(variants_dir, content_hash, extension)
+            if not os.path.exists(variant_path): save_atomic(image, variant_path, image_format, **options)
+            # Only keep variants that are actually smaller than the original
+            if os.path.getsize(variant_path) < source_bytes: produced[extension] = os.path.getsize(variant_path)
+            else: os.remove(variant_path)
+        produced['thumbnail'] = save_thumbnail(image, thumbnails_dir, content_hash, thumbnail_size)
+    return produced
+
+def save_thumbnail(image, thumbnails_dir, content_hash, thumbnail_size=THUMBNAIL_SIZE):
+    thumbnail_path = get_thumbnail_path(thumbnails_dir, content_hash)
+    if not os.path.exists(thumbnail_path):
+        thumbnail = image.copy(); thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+        save_atomic(thumbnail, thumbnail_path, 'WEBP', quality=80)
+    return os.path.getsize(thumbnail_path)
+
+def build_thumbnail(source_path, thumbnails_dir, content_hash, thumbnail_size=THUMBNAIL_SIZE):
+    # Thumbnail only, for maps stored before the ingest pipeline existed
+    os.makedirs(thumbnails_dir, exist_ok=True)
+    with Image.open(source_path) as src:
+        src.draft('RGB', (thumbnail_size * 2, thumbnail_size * 2)) # JPEG: decode at reduced scale
+        has_alpha = src.mode in ('RGBA', 'LA', 'PA') or (src.mode == 'P' and 'transparency' in src.info)
+        return save_thumbnail(src.convert('RGBA' if has_alpha else 'RGB'), thumbnails_dir, content_hash, thumbnail_size)
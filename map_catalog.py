@@ -0,0 +1,98 @@
+# map_catalog.py
+# Version: 1.1 (Missing Thumbnail Lookup)
+# Persistent SQLite index of the map library (dimensions, size, content hash, config presence,
+# thumbnail), kept up to date incrementally so listings never have to touch the maps folder
+
+import time
+import sqlite3
+import threading
+from PIL import Image
+
+SORT_COLUMNS = {'name': 'filename COLLATE NOCASE', 'added': 'added', 'modified': 'mtime_ns', 'size': 'bytes'}
+MAX_PAGE_SIZE = 1000
+RECORD_FIELDS = ('filename', 'width', 'height', 'bytes', 'mtime_ns', 'content_hash', 'has_config', 'thumbnail_url', 'added')
+
+def read_image_size(path):
+    # Header-only read; returns (None, None) for files Pillow cannot identify
+    try:
+        with Image.open(path) as image: return image.size
+    except Exception: return None, None
+
+class MapCatalog:
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS maps (filename TEXT PRIMARY KEY, width INTEGER, height INTEGER, bytes INTEGER NOT NULL,
+                           mtime_ns INTEGER NOT NULL, content_hash TEXT, has_config INTEGER NOT NULL, thumbnail_url TEXT, added REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS maps_added ON maps (added)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS maps_mtime ON maps (mtime_ns)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS maps_bytes ON maps (bytes)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS maps_hash ON maps (content_hash)")
+        self.db.commit()
+
+    def _to_record(self, row):
+        record = dict(zip(RECORD_FIELDS, row)); record['has_config'] = bool(record['has_config'])
+        return record
+
+    def get_signatures(self):
+        # filename -> (mtime_ns, bytes, has_config), used to find entries that need refreshing
+        with self.lock:
+            return {row[0]: (row[1], row[2], bool(row[3])) for row in self.db.execute("SELECT filename, mtime_ns, bytes, has_config FROM maps")}
+
+    def get(self, filename):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(RECORD_FIELDS)} FROM maps WHERE filename = ?", (filename,)).fetchone()
+        return self._to_record(row) if row else None
+
+    def find_by_hash(self, content_hashes):
+        # First filename (by name) whose content hash is one of `content_hashes`
+        content_hashes = [h for h in content_hashes if h]
+        if not content_hashes: return None
+        with self.lock:
+            row = self.db.execute(f"SELECT filename FROM maps WHERE content_hash IN ({', '.join('?' * len(content_hashes))}) ORDER BY filename LIMIT 1", content_hashes).fetchone()
+        return row[0] if row else None
+
+    def find_missing_thumbnails(self, limit):
+        # (filename, content_hash) of maps that have no thumbnail yet
+        with self.lock:
+            return self.db.execute("SELECT filename, content_hash FROM maps WHERE thumbnail_url IS NULL AND content_hash IS NOT NULL ORDER BY filename LIMIT ?", (limit,)).fetchall()
+
+    def upsert(self, record):
+        # Keeps the original 'added' time of an existing entry
+        with self.lock:
+            self.db.execute("""INSERT INTO maps (filename, width, height, bytes, mtime_ns, content_hash, has_config, thumbnail_url, added)
+                               VALUES (:filename, :width, :height, :bytes, :mtime_ns, :content_hash, :has_config, :thumbnail_url, :added)
+                               ON CONFLICT(filename) DO UPDATE SET width = excluded.width, height = excluded.height, bytes = excluded.bytes,
+                               mtime_ns = excluded.mtime_ns, content_hash = excluded.content_hash, has_config = excluded.has_config,
+                               thumbnail_url = excluded.thumbnail_url""",
+                            {**record, 'has_config': int(bool(record['has_config'])), 'added': record.get('added') or time.time()})
+            self.db.commit()
+
+    def set_fields(self, filename, **fields):
+        if not fields: return
+        with self.lock:
+            self.db.execute(f"UPDATE maps SET {', '.join(f'{name} = ?' for name in fields)} WHERE filename = ?", (*fields.values(), filename))
+            self.db.commit()
+
+    def remove(self, filenames):
+        if not filenames: return
+        with self.lock:
+            self.db.executemany("DELETE FROM maps WHERE filename = ?", [(filename,) for filename in filenames])
+            self.db.commit()
+
+    def query(self, search=None, sort='name', descending=False, offset=0, limit=100):
+        # Returns (total matching, page of records). Unknown sort keys fall back to name.
+        where, params = "", []
+        if search:
+            where = "WHERE filename LIKE ? ESCAPE '\\'"
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        order = f"{SORT_COLUMNS.get(sort, SORT_COLUMNS['name'])} {'DESC' if descending else 'ASC'}, filename"
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE)); offset = max(0, int(offset))
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM maps {where}", params).fetchone()[0]
+            rows = self.db.execute(f"SELECT {', '.join(RECORD_FIELDS)} FROM maps {where} ORDER BY {order} LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+        return total, [self._to_record(row) for row in rows]
+
+    def close(self):
+        with self.lock: self.db.close()
@@ -0,0 +1,161 @@
+# observability.py
+# Version: 1.0
+# Level-controlled logging setup and a small thread-safe metrics registry (counters, gauges and
+# histograms) rendered in the Prometheus text exposition format, without a client library.
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# --- Logging ---
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line; fields passed with extra={...} are included as keys
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        entry.update({k: v for k, v in vars(record).items() if k not in STANDARD_RECORD_FIELDS})
+        if record.exc_info: entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(name, level='INFO', log_format='text'):
+    # Configures the application's logger tree only, leaving the root logger to the host (uvicorn, tests)
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [handler]; logger.setLevel(str(level).upper()); logger.propagate = False
+    return logger
+
+# --- Metrics ---
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs: return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) and value != int(value) else str(int(value))
+
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {} # label values tuple -> value
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        with self.lock: return self.values.get(self._key(labels), 0)
+
+    def remove(self, **labels):
+        # Drops one label set, e.g. the series of a session that no longer exists
+        with self.lock: self.values.pop(self._key(labels), None)
+
+    def samples(self):
+        with self.lock: items = list(self.values.items())
+        return [(self.name, format_labels(self.labelnames, key), value) for key, value in items]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{name}{labels} {format_value(value)}" for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock: self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), collect=None):
+        # `collect` returns {label values tuple: value} at scrape time, for values owned by other objects
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock: self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock: self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.collect is None: return super().samples()
+        return [(self.name, format_labels(self.labelnames, key), value) for key, value in self.collect().items()]
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None: series = self.values[key] = [[0] * len(self.buckets), 0.0, 0] # bucket counts, sum, count
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[0][i] += 1; break
+            series[1] += value; series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        # Observes the elapsed seconds; also usable as a decorator (a fresh timer per call)
+        start = time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        # (count, sum) for one label set
+        with self.lock: series = self.values.get(self._key(labels))
+        return (series[2], series[1]) if series else (0, 0.0)
+
+    def samples(self):
+        with self.lock: items = [(key, list(series[0]), series[1], series[2]) for key, series in self.values.items()]
+        samples = []
+        for key, bucket_counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", format_labels(self.labelnames, key, [('le', format_value(bound))]), cumulative))
+            samples.append((f"{self.name}_bucket", format_labels(self.labelnames, key, [('le', '+Inf')]), count))
+            samples.append((f"{self.name}_sum", format_labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", format_labels(self.labelnames, key), count))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric); return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), collect=None):
+        return self.register(Gauge(name, help_text, labelnames, collect))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
@@ -0,0 +1,10 @@
+# server.py
+# Version: 1.0
+# Entry point for the Flask-SocketIO development server:  python server.py  (or python app.py)
+# Ingest workers are spawned processes, and a spawned process re-imports the launching script as
+# __mp_main__. Launching from this file keeps that re-import trivial; launching app.py directly would
+# re-run the whole server setup (Flask/SocketIO app, SQLite stores, filter loading, logging) in every worker.
+
+if __name__ == '__main__':
+    import app
+    app.main()
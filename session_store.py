@@ -0,0 +1,193 @@
+# session_store.py
+# Version: 1.6 (Session Presence Check)
+# Bounded session state storage: in-memory LRU/TTL backend and a SQLite-snapshotting backend
+
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class SessionLimitError(Exception):
+    pass
+
+class SessionEntry:
+    __slots__ = ('state', 'version', 'last_active', 'members', 'dirty')
+    def __init__(self, state, version=0, last_active=None):
+        self.state = state
+        self.version = version
+        self.last_active = last_active if last_active is not None else time.time()
+        self.members = set()
+        self.dirty = True
+
+class MemorySessionStore:
+    # Keeps at most `max_sessions` sessions in LRU order. Sessions with no connected
+    # members are evicted once idle for `idle_ttl` seconds, or earlier to make room.
+    # Also the base for storage-backed stores, which override _load/_evict/flush/close.
+    # Entries are returned live; callers replace `state` through put() rather than mutating it in place.
+    # `on_evict(session_id)` is called, with the store lock held, for every session dropped from memory
+    # (to make room or when idle), so callers can drop whatever else they keep per session.
+    def __init__(self, max_sessions=1000, idle_ttl=6 * 3600, on_evict=None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self.entries = OrderedDict()  # session_id -> SessionEntry, least recently used first
+        self.sid_sessions = {}        # socket sid -> set of session_ids it joined
+        self.lock = threading.RLock()
+
+    def _load(self, session_id):
+        return None # No backing storage
+
+    def _evict(self, session_id):
+        if self.entries.pop(session_id, None) is not None and self.on_evict: self.on_evict(session_id)
+
+    def _touch(self, session_id, entry):
+        entry.last_active = time.time(); self.entries.move_to_end(session_id)
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                entry = self._load(session_id)
+                if entry is None: return None
+                self._insert(session_id, entry)
+            self._touch(session_id, entry)
+            return entry
+
+    def _insert(self, session_id, entry):
+        if len(self.entries) >= self.max_sessions:
+            victim = next((sid for sid, e in self.entries.items() if not e.members), None)
+            if victim is None: raise SessionLimitError(f"Session limit ({self.max_sessions}) reached")
+            self._evict(victim)
+        self.entries[session_id] = entry
+
+    def get_or_create(self, session_id, factory):
+        with self.lock:
+            entry = self.get(session_id)
+            if entry is None:
+                entry = SessionEntry(factory()); self._insert(session_id, entry)
+            return entry
+
+    def put(self, session_id, state, version):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None: entry = SessionEntry(state, version); self._insert(session_id, entry)
+            entry.state = state; entry.version = version; entry.dirty = True
+            self._touch(session_id, entry)
+
+    def add_member(self, session_id, sid):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None: return
+            entry.members.add(sid); self.sid_sessions.setdefault(sid, set()).add(session_id)
+
+    def remove_member(self, sid):
+        # Returns the session_ids the socket was a member of
+        with self.lock:
+            session_ids = self.sid_sessions.pop(sid, set())
+            for session_id in session_ids:
+                entry = self.entries.get(session_id)
+                if entry is not None: entry.members.discard(sid); entry.last_active = time.time()
+            return session_ids
+
+    def member_count(self, session_id):
+        with self.lock:
+            entry = self.entries.get(session_id)
+            return len(entry.members) if entry else 0
+
+    def get_members(self, session_id):
+        # Copy of the sids joined to the session
+        with self.lock:
+            entry = self.entries.get(session_id)
+            return set(entry.members) if entry else set()
+
+    def member_counts(self):
+        # session_id -> connected members, for sessions that have any
+        with self.lock:
+            return {session_id: len(entry.members) for session_id, entry in self.entries.items() if entry.members}
+
+    def has_session(self, session_id):
+        # Whether the session is held in memory; unlike get(), does not load it or count as activity
+        with self.lock: return session_id in self.entries
+
+    def session_count(self):
+        with self.lock: return len(self.entries)
+
+    def evict_idle(self):
+        cutoff = time.time() - self.idle_ttl
+        with self.lock:
+            expired = [sid for sid, e in self.entries.items() if not e.members and e.last_active < cutoff]
+            for session_id in expired: self._evict(session_id)
+            return expired
+
+    def flush(self):
+        pass # No backing storage
+
+    def close(self):
+        self.flush()
+
+class SQLiteSessionStore(MemorySessionStore):
+    # Memory store that snapshots session state to SQLite. Dirty sessions are written on
+    # flush() and before eviction; sessions missing from memory (e.g. after a restart)
+    # are loaded back from the database on first access. Stored rows not used for
+    # `stored_ttl` seconds are deleted, and at most `max_stored` rows are kept (least
+    # recently active deleted first), since any client can create a session by joining it.
+    def __init__(self, db_path, max_sessions=1000, idle_ttl=6 * 3600, stored_ttl=30 * 86400, max_stored=10000, on_evict=None):
+        super().__init__(max_sessions, idle_ttl, on_evict)
+        self.stored_ttl = stored_ttl
+        self.max_stored = max_stored
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state TEXT NOT NULL, version INTEGER NOT NULL, last_active REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)")
+        self.db.commit()
+
+    def _load(self, session_id):
+        row = self.db.execute("SELECT state, version, last_active FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None: return None
+        entry = SessionEntry(json.loads(row[0]), row[1], row[2]); entry.dirty = False
+        return entry
+
+    def _write(self, items):
+        if not items: return
+        self.db.executemany("INSERT OR REPLACE INTO sessions (session_id, state, version, last_active) VALUES (?, ?, ?, ?)",
+                            [(session_id, json.dumps(e.state), e.version, e.last_active) for session_id, e in items])
+        self.db.commit()
+        for _, e in items: e.dirty = False
+
+    def _evict(self, session_id):
+        entry = self.entries.get(session_id)
+        if entry is not None and entry.dirty: self._write([(session_id, entry)])
+        super()._evict(session_id)
+
+    def evict_idle(self):
+        with self.lock:
+            expired = super().evict_idle(); self.prune_stored()
+            return expired
+
+    def prune_stored(self):
+        # Deletes expired rows and rows beyond max_stored; sessions held in memory are kept, their rows may just be stale
+        with self.lock:
+            stale = [row[0] for row in self.db.execute("SELECT session_id FROM sessions WHERE last_active < ?", (time.time() - self.stored_ttl,))]
+            excess = [row[0] for row in self.db.execute("SELECT session_id FROM sessions ORDER BY last_active DESC LIMIT -1 OFFSET ?", (self.max_stored,))]
+            doomed = {session_id for session_id in stale + excess if session_id not in self.entries}
+            if not doomed: return 0
+            self.db.executemany("DELETE FROM sessions WHERE session_id = ?", [(session_id,) for session_id in doomed])
+            self.db.commit()
+            return len(doomed)
+
+    def stored_count(self):
+        with self.lock: return self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def flush(self):
+        with self.lock:
+            self._write([(session_id, e) for session_id, e in self.entries.items() if e.dirty])
+
+    def close(self):
+        with self.lock:
+            self.flush(); self.db.close()
+
+def create_session_store(backend, db_path=None, max_sessions=1000, idle_ttl=6 * 3600, stored_ttl=30 * 86400, max_stored=10000, on_evict=None):
+    if backend == 'sqlite': return SQLiteSessionStore(db_path, max_sessions, idle_ttl, stored_ttl, max_stored, on_evict)
+    if backend == 'memory': return MemorySessionStore(max_sessions, idle_ttl, on_evict)
+    raise ValueError(f"Unknown session store backend: {backend}")
@@ -1,17 +1,30 @@
 // static/js/gm.js
-// Version: 1.52 (Restore Event Listeners, Handlers, and ResetUI)
+// Version: 1.59 (Config Write Status)
 
 // --- Global Variables ---
 const currentSessionId = "my-game"; // Hardcoded Session ID
 let availableFilters = {};
-let mapList = [];
+let mapList = []; // Catalog records for the current page of maps
+let mapSearchTimer = null;
+const MAP_LIST_PAGE_SIZE = 200;
+const MAP_LIST_BUILDING_RETRY_MS = 3000; // Re-fetch interval while the server's first library scan is running
+const CONFIG_STATUS_POLL_MS = 1000; // Poll interval while a saved config is still being written
+const CONFIG_STATUS_POLL_LIMIT = 30;
+let mapListRetryTimer = null;
 let currentState = {};
 let socket = null;
 let currentMapFilename = null; // Added back
+const ingestJobs = {}; // job_id -> latest ingest status, for uploads made from this page
+let lastSessionStats = null; // Previous 'session_stats' report, turned into rates by the next one
+let prefetchQueue = []; // Queued maps with player readiness, from the latest 'prefetch_status'
+const INGEST_STAGE_LABELS = { queued: 'Queued', normalizing: 'Verifying & normalizing', variants: 'Compressing', tiles: 'Building tiles', done: 'Done' };
 
 // --- DOM Elements ---
 const filterSelect = document.getElementById('filter-select');
 const mapSelect = document.getElementById('map-select');
+const mapSearchInput = document.getElementById('map-search');
+const mapThumbnail = document.getElementById('map-thumbnail');
+const mapDetails = document.getElementById('map-details');
 const playerUrlDisplay = document.getElementById('player-url-display');
 const gmMapDisplay = document.getElementById('gm-map-display'); // Added back
 const gmMapImage = document.getElementById('gm-map-image');     // Added back
@@ -23,6 +36,9 @@ const mapFileInput = document.getElementById('map-file-input');   // Added back
 const uploadStatus = document.getElementById('upload-status');     // Added back
 const copyPlayerUrlButton = document.getElementById('copy-player-url'); // Added back
 const copyStatusDisplay = document.getElementById('copy-status');     // Added back
+const sessionStatsDisplay = document.getElementById('session-stats');
+const queueMapButton = document.getElementById('queue-map-button');
+const prefetchQueueList = document.getElementById('prefetch-queue-list');
 const viewXInput = document.getElementById('view-center-x'); // Added back
 const viewYInput = document.getElementById('view-center-y'); // Added back
 const viewScaleInput = document.getElementById('view-scale'); // Added back
@@ -35,7 +51,7 @@ console.log("DOM Element Refs Check -> playerUrlDisplay:", playerUrlDisplay);
 
 // --- Initialization ---
 document.addEventListener('DOMContentLoaded', async () => {
-    console.log("GM View Initializing (v1.52 - Restore Listeners & Handlers)..."); // Version updated
+    console.log("GM View Initializing (v1.59 - Config Write Status)..."); // Version updated
 
     console.log(`GM controlling HARDCODED Session ID: ${currentSessionId}`);
 
@@ -74,10 +90,13 @@ function connectWebSocket() {
     try { socket = io(); console.log("Socket.IO object created:", socket); }
     catch (error) { console.error("Error initializing Socket.IO connection:", error); return; }
     console.log("Setting up Socket.IO event handlers...");
-    socket.on('connect', () => { console.log(`WebSocket connected: ${socket.id}`); });
+    socket.on('connect', () => { console.log(`WebSocket connected: ${socket.id}`); socket.emit('watch_session_stats', { session_id: currentSessionId }); socket.emit('watch_prefetch_status', { session_id: currentSessionId }); }); // Server only reports when SESSION_STATS_INTERVAL is set
     socket.on('disconnect', (reason) => { console.warn(`WebSocket disconnected: ${reason}`); });
     socket.on('connect_error', (error) => { console.error('WS connection error:', error); });
     socket.on('error', (data) => { console.error('Server WS Error:', data.message || data); });
+    socket.on('ingest_progress', handleIngestProgress);
+    socket.on('session_stats', handleSessionStats);
+    socket.on('prefetch_status', handlePrefetchStatus);
     console.log("WebSocket event handlers set up.");
 }
 
@@ -85,8 +104,11 @@ function connectWebSocket() {
 // *** Full Implementations ***
 async function loadAvailableFilters() { console.log("[loadAvailableFilters] Fetching filter configurations..."); try { const response = await fetch('/api/filters'); console.log("[loadAvailableFilters] Fetch complete. Status:", response.status, "Ok:", response.ok); if (!response.ok) { throw new Error(`HTTP error! Status: ${response.status}`); } const jsonData = await response.json(); console.log("[loadAvailableFilters] JSON parsed successfully."); availableFilters = jsonData || {}; console.log("[loadAvailableFilters] Filter configurations assigned:", Object.keys(availableFilters)); } catch (error) { console.error("[loadAvailableFilters] Error:", error); availableFilters = {}; throw error; } }
 function populateFilterList() { console.log("Attempting to populate filter list..."); if (!filterSelect) { console.error("populateFilterList: filterSelect element not found!"); return; } filterSelect.innerHTML = ''; console.log(" -> Value of availableFilters inside populateFilterList:", availableFilters); if (!availableFilters || typeof availableFilters !== 'object' || Object.keys(availableFilters).length === 0) { console.warn("Cannot populate: availableFilters empty."); filterSelect.innerHTML = '<option value="">-- No Filters --</option>'; return; } let filterIds; try { filterIds = Object.keys(availableFilters); const sortedFilterIds = filterIds.sort((a, b) => { if (a === 'none') return -1; if (b === 'none') return 1; const filterA = availableFilters[a]; const filterB = availableFilters[b]; const nameA = (filterA && filterA.name) ? filterA.name : a; const nameB = (filterB && filterB.name) ? filterB.name : b; return nameA.localeCompare(nameB); }); console.log(" -> Sorted filter IDs:", sortedFilterIds); sortedFilterIds.forEach(filterId => { const filterData = availableFilters[filterId]; if (filterData) { addFilterOption(filterData.name || filterId, filterId); } else { console.warn(`Filter definition missing for ID: ${filterId}`); } }); console.log(`Filter options length AFTER loop: ${filterSelect.options.length}`); const defaultSelection = availableFilters['none'] ? 'none' : (sortedFilterIds[0] || ''); if (filterSelect.options.length > 0) { if (filterSelect.querySelector(`option[value="${defaultSelection}"]`)) { filterSelect.value = defaultSelection; } else { filterSelect.value = filterSelect.options[0].value; } } console.log("Filter list population complete. Final selection:", filterSelect.value); } catch (error) { console.error("Error during filter list population:", error); filterSelect.innerHTML = '<option value="">-- Error --</option>'; } }
-async function populateMapList() { console.log("Fetching and populating map list..."); if (!mapSelect) { console.error("populateMapList: mapSelect not found!"); return; } mapSelect.innerHTML = '<option value="">-- Loading Maps --</option>'; try { const response = await fetch('/api/maps'); if (!response.ok) { throw new Error(`HTTP error! Status: ${response.status}`); } const mapData = await response.json(); mapList = mapData || []; console.log("Map list fetched:", mapList); mapSelect.innerHTML = '<option value="">-- Select Map --</option>'; if (mapList && mapList.length > 0) { mapList.forEach(addMapOption); console.log(`Map list populated with ${mapSelect.options.length - 1} options.`); } else { console.warn("No maps found."); mapSelect.innerHTML = '<option value="">-- No Maps --</option>'; } currentMapFilename = null; } catch (error) { console.error('Error fetching/populating map list:', error); mapSelect.innerHTML = '<option value="">-- Error --</option>'; mapList = []; throw error; } }
-function addMapOption(filename) { if (!mapSelect) { return; } const option = document.createElement('option'); option.value = filename; option.textContent = filename; try { mapSelect.appendChild(option); } catch (error) { console.error(`Error appending map option ${filename}:`, error); } }
+async function populateMapList() { console.log("Fetching and populating map list..."); if (!mapSelect) { console.error("populateMapList: mapSelect not found!"); return; } mapSelect.innerHTML = '<option value="">-- Loading Maps --</option>'; try { const params = new URLSearchParams({ limit: MAP_LIST_PAGE_SIZE, sort: 'name' }); const search = mapSearchInput ? mapSearchInput.value.trim() : ''; if (search) { params.set('q', search); } const response = await fetch(`/api/maps?${params}`); if (!response.ok) { throw new Error(`HTTP error! Status: ${response.status}`); } const mapData = await response.json(); mapList = mapData.maps || []; console.log(`Map list fetched: ${mapList.length} of ${mapData.total}`); mapSelect.innerHTML = '<option value="">-- Select Map --</option>'; if (mapList && mapList.length > 0) { mapList.forEach(addMapOption); if (mapData.total > mapList.length) { const moreOption = document.createElement('option'); moreOption.disabled = true; moreOption.textContent = `-- ${mapData.total - mapList.length} more, refine search --`; mapSelect.appendChild(moreOption); } console.log(`Map list populated with ${mapList.length} options.`); } else { console.warn("No maps found."); mapSelect.innerHTML = `<option value="">-- ${search ? 'No Matches' : 'No Maps'} --</option>`; } if (mapData.building) { const buildingOption = document.createElement('option'); buildingOption.disabled = true; buildingOption.textContent = '-- Indexing map library, more maps soon --'; mapSelect.appendChild(buildingOption); scheduleMapListRetry(); } currentMapFilename = null; updateMapInfo(null); } catch (error) { console.error('Error fetching/populating map list:', error); mapSelect.innerHTML = '<option value="">-- Error --</option>'; mapList = []; throw error; } }
+function scheduleMapListRetry() { clearTimeout(mapListRetryTimer); mapListRetryTimer = setTimeout(() => { if (mapSelect && !mapSelect.value) { populateMapList().catch(() => {}); } else { scheduleMapListRetry(); } }, MAP_LIST_BUILDING_RETRY_MS); } // Never resets a map the GM has picked
+function addMapOption(map) { if (!mapSelect) { return; } const option = document.createElement('option'); option.value = map.filename; option.textContent = map.width && map.height ? `${map.filename} (${map.width}x${map.height})` : map.filename; try { mapSelect.appendChild(option); } catch (error) { console.error(`Error appending map option ${map.filename}:`, error); } }
+function updateMapInfo(filename) { const map = filename ? mapList.find(m => m.filename === filename) : null; if (mapThumbnail) { if (map && map.thumbnail_url) { mapThumbnail.src = map.thumbnail_url; mapThumbnail.style.display = 'block'; } else { mapThumbnail.removeAttribute('src'); mapThumbnail.style.display = 'none'; } } if (mapDetails) { mapDetails.textContent = map ? [map.width && map.height ? `${map.width}x${map.height}` : null, `${(map.bytes / (1024 * 1024)).toFixed(1)} MB`, map.has_config ? 'saved config' : 'no saved config'].filter(Boolean).join(' · ') : ''; } }
+function handleMapSearchInput() { clearTimeout(mapSearchTimer); mapSearchTimer = setTimeout(() => { populateMapList().catch(() => {}); }, 250); }
 function addFilterOption(displayName, filterId) { if (!filterSelect) { return; } const option = document.createElement('option'); option.value = filterId; option.textContent = displayName; try { filterSelect.appendChild(option); } catch (error) { console.error(`!!! Error using filterSelect.appendChild() for option ${filterId}:`, error); } }
 
 // --- UI Reset ---
@@ -112,7 +134,7 @@ function resetUI() {
 
 // *** ADDED BACK ***
 async function loadMapDataForGM(filename) {
-    if (!filename) { resetUI(); return; } currentMapFilename = filename; console.log(`Loading GM preview data for map: ${filename}`); if(gmMapPlaceholder) gmMapPlaceholder.style.display = 'none'; if(gmMapImage) gmMapImage.style.display = 'none'; if(gmMapDisplay) gmMapDisplay.style.display = 'flex'; try { const apiUrl = `/api/config/${encodeURIComponent(filename)}?t=${Date.now()}`; console.log(`Fetching config for GM preview: ${apiUrl}`); const configResponse = await fetch(apiUrl); if (!configResponse.ok) { throw new Error(`Config load failed (${configResponse.status})`); } const mapConfig = await configResponse.json(); console.log("Loaded map config for GM:", mapConfig); console.log(" -> Received view_state from config:", JSON.stringify(mapConfig?.view_state)); currentState = mapConfig; if (!currentState || typeof currentState !== 'object') throw new Error("Invalid config data."); currentState.view_state = currentState.view_state || { center_x: 0.5, center_y: 0.5, scale: 1.0 }; currentState.current_filter = currentState.current_filter || (availableFilters['none'] ? 'none' : Object.keys(availableFilters)[0] || ''); currentState.filter_params = currentState.filter_params || get_default_filter_params(); currentState.display_type = "image"; currentState.map_content_path = currentState.map_content_path || `maps/${filename}`; const imageUrl = currentState.map_content_path; if (!imageUrl) throw new Error("Map content path missing."); if(gmMapImage) { gmMapImage.src = imageUrl; gmMapImage.alt = `Preview of ${filename}`; gmMapImage.style.display = 'block'; } else { console.error("loadMapDataForGM: gmMapImage not found!");} if (availableFilters[currentState.current_filter]) { if(filterSelect) filterSelect.value = currentState.current_filter; else console.error("loadMapDataForGM: filterSelect not found!"); } updateFilterControls(); updateViewControls(); if(viewXInput) viewXInput.disabled = false; if(viewYInput) viewYInput.disabled = false; if(viewScaleInput) viewScaleInput.disabled = false; if(saveButton) { saveButton.disabled = false; saveButton.title = `Save settings to ${filename}_config.json`; } } catch (error) { console.error(`Error loading GM preview data for ${filename}:`, error); alert(`Error loading preview: ${error.message}`); resetUI(); }
+    if (!filename) { resetUI(); return; } currentMapFilename = filename; console.log(`Loading GM preview data for map: ${filename}`); if(gmMapPlaceholder) gmMapPlaceholder.style.display = 'none'; if(gmMapImage) gmMapImage.style.display = 'none'; if(gmMapDisplay) gmMapDisplay.style.display = 'flex'; try { const apiUrl = `/api/config/${encodeURIComponent(filename)}`; console.log(`Fetching config for GM preview: ${apiUrl}`); const configResponse = await fetch(apiUrl); if (!configResponse.ok) { throw new Error(`Config load failed (${configResponse.status})`); } const mapConfig = await configResponse.json(); console.log("Loaded map config for GM:", mapConfig); console.log(" -> Received view_state from config:", JSON.stringify(mapConfig?.view_state)); currentState = mapConfig; if (!currentState || typeof currentState !== 'object') throw new Error("Invalid config data."); currentState.view_state = currentState.view_state || { center_x: 0.5, center_y: 0.5, scale: 1.0 }; currentState.current_filter = currentState.current_filter || (availableFilters['none'] ? 'none' : Object.keys(availableFilters)[0] || ''); currentState.filter_params = currentState.filter_params || get_default_filter_params(); currentState.display_type = "image"; currentState.map_content_path = currentState.map_content_path || `maps/${filename}`; const imageUrl = currentState.map_content_version ? `${currentState.map_content_path}?v=${currentState.map_content_version}` : currentState.map_content_path; if (!imageUrl) throw new Error("Map content path missing."); if(gmMapImage) { gmMapImage.src = imageUrl; gmMapImage.alt = `Preview of ${filename}`; gmMapImage.style.display = 'block'; } else { console.error("loadMapDataForGM: gmMapImage not found!");} if (availableFilters[currentState.current_filter]) { if(filterSelect) filterSelect.value = currentState.current_filter; else console.error("loadMapDataForGM: filterSelect not found!"); } updateFilterControls(); updateViewControls(); if(viewXInput) viewXInput.disabled = false; if(viewYInput) viewYInput.disabled = false; if(viewScaleInput) viewScaleInput.disabled = false; if(saveButton) { saveButton.disabled = false; saveButton.title = `Save settings to ${filename}_config.json`; } warnIfConfigWriteFailed(filename); } catch (error) { console.error(`Error loading GM preview data for ${filename}:`, error); alert(`Error loading preview: ${error.message}`); resetUI(); }
 }
 // *** END ADDED BACK ***
 
@@ -129,6 +151,7 @@ function setupEventListeners() {
     console.log("--- Running setupEventListeners ---");
     // REMOVED Session ID Input Listener
     if (mapSelect) { mapSelect.addEventListener('change', handleMapSelectionChange); console.log(" -> Listener attached to mapSelect 'change'"); } else { console.error("setupEventListeners: mapSelect not found!"); }
+    if (mapSearchInput) { mapSearchInput.addEventListener('input', handleMapSearchInput); console.log(" -> Listener attached to mapSearchInput 'input'"); } else { console.error("setupEventListeners: mapSearchInput not found!"); }
     if (filterSelect) { filterSelect.addEventListener('change', handleFilterChange); console.log(" -> Listener attached to filterSelect 'change'"); } else { console.error("setupEventListeners: filterSelect not found!"); }
     if (saveButton) { saveButton.addEventListener('click', saveConfiguration); console.log(" -> Listener attached to saveButton 'click'"); } else { console.error("setupEventListeners: saveButton not found!"); }
     if (mapUploadForm) { mapUploadForm.addEventListener('submit', handleMapUpload); console.log(" -> Listener attached to mapUploadForm 'submit'"); } else { console.error("setupEventListeners: mapUploadForm not found!"); }
@@ -136,6 +159,7 @@ function setupEventListeners() {
     if (viewYInput) { viewYInput.addEventListener('input', handleViewChange); console.log(" -> Listener attached to viewYInput 'input'"); } else { console.error("setupEventListeners: viewYInput not found!"); }
     if (viewScaleInput) { viewScaleInput.addEventListener('input', handleViewChange); console.log(" -> Listener attached to viewScaleInput 'input'"); } else { console.error("setupEventListeners: viewScaleInput not found!"); }
     if (copyPlayerUrlButton) { copyPlayerUrlButton.addEventListener('click', copyPlayerUrlToClipboard); console.log(" -> Listener attached to copyPlayerUrlButton 'click'"); } else { console.error("setupEventListeners: copyPlayerUrlButton not found!"); }
+    if (queueMapButton) { queueMapButton.addEventListener('click', handleQueueMapClick); console.log(" -> Listener attached to queueMapButton 'click'"); } else { console.error("setupEventListeners: queueMapButton not found!"); }
     console.log("--- setupEventListeners complete ---");
 }
 // *** END ADDED BACK ***
@@ -143,9 +167,11 @@ function setupEventListeners() {
 
 // Define Handlers
 // *** ADDED BACK ***
-async function handleMapSelectionChange(event) { console.log("--- handleMapSelectionChange Fired! ---"); const selectedFilename = event.target.value; if (!selectedFilename) { resetUI(); sendUpdate({ map_content_path: null, display_type: 'image' }); return; } console.log(`Map selected by GM: ${selectedFilename}`); const newPath = `maps/${selectedFilename}`; const newType = 'image'; console.log(`Sending content switch update: path=${newPath}, type=${newType}`); sendUpdate({ map_content_path: newPath, display_type: newType }); await loadMapDataForGM(selectedFilename); console.log(`GM preview updated for ${selectedFilename}`); }
+async function handleMapSelectionChange(event) { console.log("--- handleMapSelectionChange Fired! ---"); const selectedFilename = event.target.value; updateMapInfo(selectedFilename); if (!selectedFilename) { resetUI(); sendUpdate({ map_content_path: null, display_type: 'image' }); return; } console.log(`Map selected by GM: ${selectedFilename}`); const newPath = `maps/${selectedFilename}`; const newType = 'image'; console.log(`Sending content switch update: path=${newPath}, type=${newType}`); sendUpdate({ map_content_path: newPath, display_type: newType }); await loadMapDataForGM(selectedFilename); console.log(`GM preview updated for ${selectedFilename}`); }
 function handleFilterChange(event) { console.log("--- handleFilterChange Fired! ---"); if (!currentMapFilename) { alert("Select map first."); event.target.value = currentState.current_filter || ''; return; } const newFilterId = event.target.value; console.log(`Filter selected: ${newFilterId}`); currentState.current_filter = newFilterId; currentState.filter_params = currentState.filter_params || {}; if (!currentState.filter_params[newFilterId]) { const filterDef = availableFilters[newFilterId]; currentState.filter_params[newFilterId] = {}; if (filterDef?.params) { for (const key in filterDef.params) { if (key !== 'backgroundImageFilename' && filterDef.params[key].value !== undefined) { currentState.filter_params[newFilterId][key] = filterDef.params[key].value; } } } } updateFilterControls(); const updatePayload = { current_filter: newFilterId, filter_params: { [newFilterId]: currentState.filter_params[newFilterId] || {} } }; sendUpdate(updatePayload); }
-async function handleMapUpload(event) { console.log("--- handleMapUpload Fired! ---"); event.preventDefault(); if (!mapFileInput || !mapFileInput.files || mapFileInput.files.length === 0) { uploadStatus.textContent = 'Select file.'; uploadStatus.style.color = 'orange'; return; } const file = mapFileInput.files[0]; const allowedTypes = ['image/png', 'image/jpeg', 'image/webp']; if (!allowedTypes.includes(file.type)) { uploadStatus.textContent = 'Invalid file type.'; uploadStatus.style.color = 'red'; return; } const formData = new FormData(); formData.append('mapFile', file); uploadStatus.textContent = 'Uploading...'; uploadStatus.style.color = 'black'; try { const response = await fetch('/api/maps', { method: 'POST', body: formData }); const result = await response.json(); if (response.ok && result.success) { uploadStatus.textContent = `Success: ${result.filename}`; uploadStatus.style.color = 'green'; mapFileInput.value = ''; await populateMapList(); if (mapList.includes(result.filename)) { mapSelect.value = result.filename; handleMapSelectionChange({ target: mapSelect }); } } else { uploadStatus.textContent = `Failed: ${result.error || 'Server error'}`; uploadStatus.style.color = 'red'; } } catch (error) { console.error('Upload error:', error); uploadStatus.textContent = 'Failed: Network error.'; uploadStatus.style.color = 'red'; } }
+async function handleMapUpload(event) { console.log("--- handleMapUpload Fired! ---"); event.preventDefault(); if (!mapFileInput || !mapFileInput.files || mapFileInput.files.length === 0) { uploadStatus.textContent = 'Select file.'; uploadStatus.style.color = 'orange'; return; } const file = mapFileInput.files[0]; const allowedTypes = ['image/png', 'image/jpeg', 'image/webp']; if (!allowedTypes.includes(file.type)) { uploadStatus.textContent = 'Invalid file type.'; uploadStatus.style.color = 'red'; return; } const formData = new FormData(); formData.append('mapFile', file); if (socket && socket.connected) { formData.append('socket_id', socket.id); } uploadStatus.textContent = 'Uploading...'; uploadStatus.style.color = 'black'; try { const response = await fetch('/api/maps', { method: 'POST', body: formData }); const result = await response.json(); if (response.ok && result.success) { mapFileInput.value = ''; if (!ingestJobs[result.job_id]) { handleIngestProgress({ job_id: result.job_id, filename: result.filename, status: 'running', stage: 'queued', progress: 0 }); } if (!socket || !socket.connected) { pollIngestJob(result.job_id); } } else { uploadStatus.textContent = `Failed: ${result.error || 'Server error'}`; uploadStatus.style.color = 'red'; } } catch (error) { console.error('Upload error:', error); uploadStatus.textContent = 'Failed: Network error.'; uploadStatus.style.color = 'red'; } }
+async function handleIngestProgress(job) { if (!job || !job.job_id) { return; } const previous = ingestJobs[job.job_id]; if (previous && previous.status !== 'running') { return; } ingestJobs[job.job_id] = job; console.log("Ingest progress:", job); if (job.status === 'running') { uploadStatus.textContent = `${INGEST_STAGE_LABELS[job.stage] || job.stage} ${job.filename}... (${job.progress}%)`; uploadStatus.style.color = 'black'; return; } if (job.status === 'error') { uploadStatus.textContent = `Failed: ${job.message || 'Could not process image'}`; uploadStatus.style.color = 'red'; return; } uploadStatus.textContent = job.status === 'duplicate' ? `Already uploaded as ${job.filename}` : `Success: ${job.filename}`; uploadStatus.style.color = 'green'; if (mapSearchInput) { mapSearchInput.value = ''; } await populateMapList(); if (!mapList.some(m => m.filename === job.filename)) { addMapOption({ filename: job.filename, width: job.width, height: job.height }); } mapSelect.value = job.filename; handleMapSelectionChange({ target: mapSelect }); }
+async function pollIngestJob(jobId) { /* Fallback when progress events cannot reach this page */ while (!ingestJobs[jobId] || ingestJobs[jobId].status === 'running') { await new Promise(resolve => setTimeout(resolve, 1000)); try { const response = await fetch(`/api/ingest/${jobId}`); if (!response.ok) { throw new Error(`HTTP error! Status: ${response.status}`); } await handleIngestProgress(await response.json()); } catch (error) { console.error('Ingest status error:', error); uploadStatus.textContent = 'Failed: Lost track of upload.'; uploadStatus.style.color = 'red'; return; } } }
 function handleControlChange(event) { console.log("--- handleControlChange Fired! --- Target:", event.target.id); if (!currentMapFilename || !currentState || !currentState.filter_params) return; const input = event.target; const filterId = input.dataset.filterId; const paramKey = input.dataset.paramKey; if (!filterId || !paramKey || paramKey === 'backgroundImageFilename') return; let value; if (input.type === 'checkbox') { value = input.checked ? 1.0 : 0.0; } else if (input.type === 'range' || input.type === 'number') { value = parseFloat(input.value); } else { value = input.value; } if (input.type === 'range') { const valueSpan = document.getElementById(`param-value-${paramKey}`); if (valueSpan) { const paramConfig = availableFilters[filterId]?.params[paramKey]; if (paramConfig?.min === 0 && paramConfig?.max === 1 && paramConfig?.step === 1) { valueSpan.textContent = ` (${value === 1.0 ? 'On' : 'Off'})`; } else { valueSpan.textContent = ` (${value.toFixed(paramConfig?.step >= 0.1 ? 2 : 3)})`; } } } currentState.filter_params = currentState.filter_params || {}; currentState.filter_params[filterId] = currentState.filter_params[filterId] || {}; if (currentState.filter_params[filterId][paramKey] !== value) { currentState.filter_params[filterId][paramKey] = value; const updatePayload = { filter_params: { [filterId]: { [paramKey]: value } } }; sendUpdate(updatePayload); } }
 function handleViewChange(event) { console.log("--- handleViewChange Fired! --- Target:", event.target.id); if (!currentMapFilename || !currentState || !currentState.view_state) return; const input = event.target; const key = input.id.replace('view-', '').replace('-', '_'); const value = parseFloat(input.value); if (currentState.view_state[key] !== value) { currentState.view_state[key] = value; updateViewControls(); const updatePayload = { view_state: { [key]: value } }; sendUpdate(updatePayload); } }
 // *** END ADDED BACK ***
@@ -154,7 +180,11 @@ function handleViewChange(event) { console.log("--- handleViewChange Fired! ---
 // --- State Updates & Saving ---
 // *** ADDED BACK ***
 function sendUpdate(updateData) { console.log("--- sendUpdate called ---"); console.log(" -> updateData:", JSON.stringify(updateData)); console.log(" -> socket connected:", socket?.connected); console.log(" -> currentSessionId:", currentSessionId); const validIdRegex = /^[a-zA-Z0-9_-]{1,50}$/; if (!currentSessionId || !validIdRegex.test(currentSessionId)) { console.error("Cannot send update: Session ID is empty or invalid."); return; } if (!socket || !socket.connected) { console.warn("Cannot send update: WS disconnected."); return; } const payload = { session_id: currentSessionId, update_data: updateData }; console.log(`Attempting to emit 'gm_update':`, JSON.stringify(payload)); try { socket.emit('gm_update', payload); console.log(" -> 'gm_update' emitted."); } catch (error) { console.error("!!! Error during socket.emit:", error); } }
-async function saveConfiguration() { console.log("--- saveConfiguration Fired! ---"); console.log(" -> Checking currentMapFilename:", currentMapFilename); if (!currentMapFilename) { console.log(" -> FAILED check: file missing."); alert("Select map first."); return; } console.log(" -> Check passed: file present."); console.log(" -> Checking currentState:", currentState); console.log(" -> Checking currentState.map_content_path:", currentState?.map_content_path); if (!currentState || !currentState.map_content_path) { console.log(" -> FAILED check: state invalid."); alert("Cannot save: state invalid."); return; } console.log(" -> Check passed: state present."); const expectedPath = `maps/${currentMapFilename}`; if (currentState.map_content_path !== expectedPath) { console.warn(`Adjusting path before save.`); currentState.map_content_path = expectedPath; } if (currentState.map_image_path) delete currentState.map_image_path; if (currentState.filter_params) { for (const filterId in currentState.filter_params) { if (currentState.filter_params[filterId]?.backgroundImageFilename !== undefined) { delete currentState.filter_params[filterId].backgroundImageFilename; } const textParams = ['defaultFontFamily', 'defaultTextSpeed', 'fontSize']; textParams.forEach(p => { if (currentState.filter_params[filterId]?.[p] !== undefined) { delete currentState.filter_params[filterId][p]; } }); } } console.log("Saving configuration:", JSON.stringify(currentState)); saveButton.textContent = "Saving..."; saveButton.disabled = true; try { console.log(`Sending POST to /api/config/${encodeURIComponent(currentMapFilename)}`); const response = await fetch(`/api/config/${encodeURIComponent(currentMapFilename)}`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(currentState), }); console.log("Save fetch response status:", response.status, "Ok:", response.ok); const contentType = response.headers.get("content-type"); let result = { success: response.ok }; if (contentType && contentType.indexOf("application/json") !== -1) { console.log("Attempting to parse JSON response..."); result = await response.json(); console.log("Save response result:", result); } else { console.log("Response was not JSON."); if (!response.ok) { result.error = `Save failed: ${response.status}`; } } if (response.ok && result.success) { console.log("Save successful."); alert(`Configuration saved for ${currentMapFilename}!`); } else { throw new Error(result.error || `Save failed: ${response.status}`); } } catch (error) { console.error('Save configuration error:', error); alert(`Error saving configuration: ${error.message}`); } finally { saveButton.textContent = "Save Map Config"; saveButton.disabled = !currentMapFilename; console.log("Save finally block executed."); } }
+async function saveConfiguration() { console.log("--- saveConfiguration Fired! ---"); console.log(" -> Checking currentMapFilename:", currentMapFilename); if (!currentMapFilename) { console.log(" -> FAILED check: file missing."); alert("Select map first."); return; } console.log(" -> Check passed: file present."); console.log(" -> Checking currentState:", currentState); console.log(" -> Checking currentState.map_content_path:", currentState?.map_content_path); if (!currentState || !currentState.map_content_path) { console.log(" -> FAILED check: state invalid."); alert("Cannot save: state invalid."); return; } console.log(" -> Check passed: state present."); const expectedPath = `maps/${currentMapFilename}`; if (currentState.map_content_path !== expectedPath) { console.warn(`Adjusting path before save.`); currentState.map_content_path = expectedPath; } if (currentState.map_image_path) delete currentState.map_image_path; if (currentState.filter_params) { for (const filterId in currentState.filter_params) { if (currentState.filter_params[filterId]?.backgroundImageFilename !== undefined) { delete currentState.filter_params[filterId].backgroundImageFilename; } const textParams = ['defaultFontFamily', 'defaultTextSpeed', 'fontSize']; textParams.forEach(p => { if (currentState.filter_params[filterId]?.[p] !== undefined) { delete currentState.filter_params[filterId][p]; } }); } } console.log("Saving configuration:", JSON.stringify(currentState)); saveButton.textContent = "Saving..."; saveButton.disabled = true; try { console.log(`Sending POST to /api/config/${encodeURIComponent(currentMapFilename)}`); const response = await fetch(`/api/config/${encodeURIComponent(currentMapFilename)}`, { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(currentState), }); console.log("Save fetch response status:", response.status, "Ok:", response.ok); const contentType = response.headers.get("content-type"); let result = { success: response.ok }; if (contentType && contentType.indexOf("application/json") !== -1) { console.log("Attempting to parse JSON response..."); result = await response.json(); console.log("Save response result:", result); } else { console.log("Response was not JSON."); if (!response.ok) { result.error = `Save failed: ${response.status}`; } } if (response.ok && result.success && result.pending) { const lastWrite = await waitForConfigWrite(currentMapFilename); if (!lastWrite?.ok) { throw new Error(lastWrite ? "The server could not write the config file." : "The config file is still being written."); } alert(`Configuration saved for ${currentMapFilename}!`); } else if (response.ok && result.success) { console.log("Save successful."); alert(`Configuration saved for ${currentMapFilename}!`); } else { throw new Error(result.error || `Save failed: ${response.status}`); } } catch (error) { console.error('Save configuration error:', error); alert(`Error saving configuration: ${error.message}`); } finally { saveButton.textContent = "Save Map Config"; saveButton.disabled = !currentMapFilename; console.log("Save finally block executed."); } }
+// Saves (and autosaves) are written to disk in the background; the status endpoint reports the outcome of the last write
+async function fetchConfigStatus(filename) { const response = await fetch(`/api/config/${encodeURIComponent(filename)}/status`); if (!response.ok) { throw new Error(`Config status failed (${response.status})`); } return response.json(); }
+async function waitForConfigWrite(filename) { for (let attempt = 0; attempt < CONFIG_STATUS_POLL_LIMIT; attempt++) { const status = await fetchConfigStatus(filename); if (!status.pending) { return status.last_write; } await new Promise(resolve => setTimeout(resolve, CONFIG_STATUS_POLL_MS)); } return null; }
+async function warnIfConfigWriteFailed(filename) { try { const status = await fetchConfigStatus(filename); if (status.last_write && !status.last_write.ok && filename === currentMapFilename) { alert(`Warning: the last save of ${filename}'s configuration could not be written to disk.`); } } catch (error) { console.warn("Could not check config write status:", error); } }
 // *** END ADDED BACK ***
 
 
@@ -167,9 +197,18 @@ function updateViewControls() { console.log("--- updateViewControls called ---")
 // --- Session/Player URL Display ---
 // *** ADDED BACK ***
 function updatePlayerUrlDisplay() { console.log("--- updatePlayerUrlDisplay called ---"); console.log(" -> playerUrlDisplay element:", playerUrlDisplay); console.log(" -> currentSessionId:", currentSessionId); const validIdRegex = /^[a-zA-Z0-9_-]{1,50}$/; if (playerUrlDisplay && currentSessionId && validIdRegex.test(currentSessionId)) { const playerPath = `/player?session=${encodeURIComponent(currentSessionId)}`; const fullUrl = window.location.origin + playerPath; console.log(" -> Constructed URL:", fullUrl); playerUrlDisplay.value = fullUrl; console.log(" -> Set playerUrlDisplay.value to:", playerUrlDisplay.value); } else if (playerUrlDisplay) { console.warn(" -> Could not update Player URL: Session ID invalid or missing."); playerUrlDisplay.value = "Enter valid Session ID above..."; } else { console.error(" -> Could not update Player URL: element not found."); } }
+function handleSessionStats(stats) { if (!sessionStatsDisplay || !stats || stats.session_id !== currentSessionId) { return; } const previous = lastSessionStats; lastSessionStats = stats; const elapsed = previous ? stats.time - previous.time : 0; const rate = (key) => Math.max(0, stats[key] - previous[key]) / elapsed; const parts = [`${stats.players} player${stats.players === 1 ? '' : 's'}`]; if (elapsed > 0) { parts.push(`${rate('updates').toFixed(1)} updates/s`); parts.push(`${(rate('broadcast_bytes') * stats.players / 1024).toFixed(1)} KB/s to players`); } if (stats.avg_update_ms !== null) { parts.push(`${stats.avg_update_ms.toFixed(2)} ms/update`); } sessionStatsDisplay.textContent = parts.join(' · '); }
 function copyPlayerUrlToClipboard() { console.log("--- copyPlayerUrlToClipboard Fired! ---"); if (!playerUrlDisplay) return; playerUrlDisplay.select(); playerUrlDisplay.setSelectionRange(0, 99999); try { const successful = document.execCommand('copy'); if (successful) { copyStatusDisplay.textContent = 'Copied!'; copyStatusDisplay.style.color = 'green'; } else { throw new Error('execCommand failed'); } } catch (err) { console.error('Failed to copy Player URL:', err); copyStatusDisplay.textContent = 'Copy failed.'; copyStatusDisplay.style.color = 'red'; if (navigator.clipboard) { navigator.clipboard.writeText(playerUrlDisplay.value).then(() => { copyStatusDisplay.textContent = 'Copied!'; copyStatusDisplay.style.color = 'green'; }).catch(clipErr => { console.error('navigator.clipboard fallback failed:', clipErr); copyStatusDisplay.textContent = 'Copy failed.'; copyStatusDisplay.style.color = 'red'; }); } } setTimeout(() => { copyStatusDisplay.textContent = ''; }, 2500); }
 // *** END ADDED BACK ***
 
+// --- Map Prefetch Queue ---
+// Players download queued maps in the background; a map is safe to reveal instantly once every player has it
+function setPrefetchQueue(filenames) { if (!socket || !socket.connected) { console.warn("Cannot update prefetch queue: WS disconnected."); return; } socket.emit('set_prefetch_queue', { session_id: currentSessionId, maps: filenames }); }
+function handleQueueMapClick() { const filename = mapSelect?.value; if (!filename) { return; } const queued = prefetchQueue.map(entry => entry.filename); if (!queued.includes(filename)) { setPrefetchQueue([...queued, filename]); } }
+function handlePrefetchStatus(status) { if (!status || status.session_id !== currentSessionId) { return; } prefetchQueue = status.maps || []; renderPrefetchQueue(status.players); }
+function renderPrefetchQueue(playerCount) { if (!prefetchQueueList) { return; } prefetchQueueList.innerHTML = ''; prefetchQueue.forEach(entry => { const item = document.createElement('li'); item.classList.toggle('ready', entry.ready >= playerCount); const label = document.createElement('span'); label.textContent = `${entry.filename} — ${entry.ready}/${playerCount} ready${entry.failed ? `, ${entry.failed} failed` : ''}`; label.title = `${(entry.bytes / 1048576).toFixed(1)} MB`; const showButton = document.createElement('button'); showButton.type = 'button'; showButton.textContent = 'Show'; showButton.addEventListener('click', () => revealQueuedMap(entry.filename)); const removeButton = document.createElement('button'); removeButton.type = 'button'; removeButton.textContent = '✕'; removeButton.title = 'Remove from queue'; removeButton.addEventListener('click', () => setPrefetchQueue(prefetchQueue.map(queued => queued.filename).filter(filename => filename !== entry.filename))); item.append(label, showButton, removeButton); prefetchQueueList.appendChild(item); }); }
+function revealQueuedMap(filename) { if (!mapSelect) { return; } if (!Array.from(mapSelect.options).some(option => option.value === filename)) { addMapOption({ filename }); } mapSelect.value = filename; handleMapSelectionChange({ target: mapSelect }); }
+
 // --- Helpers ---
 // *** ADDED BACK ***
 function get_default_filter_params() { const fp = {}; for (const f_id in availableFilters) { const fc = availableFilters[f_id]; fp[f_id] = {}; if (fc && fc.params) { for (const key in fc.params) { if (fc.params[key].value !== undefined && key !== 'backgroundImageFilename') { fp[f_id][key] = fc.params[key].value; } } } } return fp; }
@@ -1,5 +1,5 @@
 // static/js/player.js
-// Version: 1.24 (Revert - Init/Connect/Receive Initial State)
+// Version: 1.32 (Tile Windows)
 // Logic for Player view
 
 // --- Global Variables ---
@@ -14,15 +14,30 @@ let filterDefinitions = {}; // Stores { filterId: { config: {...}, vertexShader:
 let currentViewState = {};
 let currentFilterParams = {};
 let currentMapContentPath = null;
+let currentMapContentUrl = null; // Path plus content version, so a replaced image is reloaded
+let tileState = null; // { mapFilename, level, width, height, window: {x, y, width, height}, canvas, ctx, texture, loaded: Set, drawn: Set, dirty }
+let tileRefreshTimer = null;
+let sessionState = null; // Last full state received, kept current by applying patches
+let sessionStateVersion = null;
+let bootstrapStateVersion = null; // Version of the state embedded in player.html, until the join reply arrives
+let snapshotMode = false; // Show server-rendered frames (/api/snapshot) instead of running the shaders
+let snapshotTimer = null;
+const SNAPSHOT_REFRESH_DELAY_MS = 200;
+const SNAPSHOT_RETRY_DELAY_MS = 2000; // The server answers 503 while its snapshot renderer is busy
+let prefetchHints = []; // Upcoming maps queued by the GM, in order ({ filename, map_content_path, map_content_version, bytes, ... })
+const prefetchedImages = new Map(); // Content URL -> decoded Image, used instead of downloading when the GM switches to it
+const prefetchFailures = new Set(); // Content URLs that failed, not retried until the queue changes
+let prefetchRunning = false;
 
 // --- DOM Elements ---
 const canvas = document.getElementById('player-canvas');
 const statusDiv = document.getElementById('status');
+const snapshotImage = document.getElementById('player-snapshot');
 
 
 // --- Initialization ---
 async function init() {
-    console.log("Player View Initializing (v1.24 Revert)...");
+    console.log("Player View Initializing (v1.32 Tile Windows)...");
 
     textureLoader.setPath('/'); // Set base path for texture loading
 
@@ -37,12 +52,13 @@ async function init() {
     }
     displayStatus(`Initializing Session: ${currentSessionId}...`);
     console.log(`Player joining session: ${currentSessionId}`);
+    if (urlParams.get('render') === 'snapshot') { startSnapshotMode(); return; } // Opt-in for low-power devices
 
-    // Load Filter Definitions first
-    console.log("Calling loadAllFilterConfigs()...");
+    // Load Filter Definitions (with their shaders) first
+    console.log("Calling loadBootstrap()...");
     try {
-        await loadAllFilterConfigs();
-        console.log("Finished loadAllFilterConfigs().");
+        await loadBootstrap();
+        console.log("Finished loadBootstrap().");
     } catch (error) {
         console.error("Failed to load filter configs during init:", error);
         // Continue initialization, but filters might not work
@@ -63,8 +79,7 @@ async function init() {
         renderer.setClearColor(0x000000, 0); // Transparent background for canvas
     } catch (error) {
         console.error("WebGL Initialization failed:", error);
-        displayStatus("ERROR: WebGL failed to initialize.");
-        isRenderingPaused = true; return;
+        isRenderingPaused = true; startSnapshotMode(); return; // Fall back to server-rendered frames
      }
     console.log("Scene, Camera, Renderer setup complete.");
 
@@ -85,9 +100,9 @@ async function init() {
     console.log("Basic shaders obtained.");
     try {
         material = new THREE.ShaderMaterial({
-            uniforms: { ...commonUniforms, mapTexture: { value: null } },
+            uniforms: { ...commonUniforms, mapTexture: { value: null }, mapWindow: { value: new THREE.Vector4(0, 0, 1, 1) } },
             vertexShader: initialVertexShader,
-            fragmentShader: initialFragmentShader,
+            fragmentShader: withMapWindow(initialFragmentShader),
             transparent: true, depthWrite: false, side: THREE.DoubleSide
         });
         console.log("THREE.ShaderMaterial created.");
@@ -95,7 +110,7 @@ async function init() {
             console.error(`SHADER ERROR for filter ${currentFilterId}:`, e.error);
             displayStatus(`ERROR: Shader failed for filter ${currentFilterId}. Reverting.`);
             const basicVert = getBasicVertexShader(); const basicFrag = getBasicFragmentShader();
-            if (basicVert && basicFrag) { material.vertexShader = basicVert; material.fragmentShader = basicFrag; material.needsUpdate = true; }
+            if (basicVert && basicFrag) { material.vertexShader = basicVert; material.fragmentShader = withMapWindow(basicFrag); material.needsUpdate = true; }
             currentFilterId = 'none_fallback';
         });
     } catch (error) {
@@ -118,6 +133,10 @@ async function init() {
     console.log("Adding resize listener...");
     window.addEventListener('resize', onWindowResize, false);
 
+    // Start loading the map from the state embedded in the page, before the socket has connected
+    const initialState = readEmbeddedJson('player-initial-state');
+    if (initialState) { handleFullState(initialState); bootstrapStateVersion = sessionStateVersion; }
+
     console.log("Calling connectWebSocket()...");
     connectWebSocket(); // Attempt connection
     console.log("Called connectWebSocket(). Starting animation loop...");
@@ -127,6 +146,30 @@ async function init() {
 }
 
 // --- Filter Definition Loading ---
+function readEmbeddedJson(elementId) {
+    const element = document.getElementById(elementId);
+    if (!element) { return null; }
+    try { return JSON.parse(element.textContent); }
+    catch (error) { console.error(`Invalid embedded JSON in #${elementId}:`, error); return null; }
+}
+
+async function loadBootstrap() {
+    // Filter configs with inlined shaders, embedded in player.html or fetched in a single request
+    let bundle = readEmbeddedJson('player-bootstrap');
+    if (!bundle) {
+        try {
+            const response = await fetch('/api/bootstrap');
+            if (!response.ok) { throw new Error(`HTTP error! Status: ${response.status}`); }
+            bundle = await response.json();
+        } catch (error) {
+            console.error("[loadBootstrap] Bootstrap bundle unavailable, loading filter configs instead:", error);
+            await loadAllFilterConfigs(); return; // Shaders are then fetched per filter by loadFilterShaders()
+        }
+    }
+    filterDefinitions = bundle.filters || {};
+    console.log(`[loadBootstrap] Filter registry ${bundle.registry_version}:`, Object.keys(filterDefinitions));
+}
+
 async function loadAllFilterConfigs() {
     console.log("[loadAllFilterConfigs] Fetching filter configurations...");
     try {
@@ -167,8 +210,9 @@ async function loadFilterShaders(filterId) {
 
      console.log(`Fetching shaders for filter: ${filterId}`);
      try {
-         const vertPath = `/filters/${encodeURIComponent(filterId)}/vertex.glsl`;
-         const fragPath = `/filters/${encodeURIComponent(filterId)}/fragment.glsl`;
+         // Prefer the content-versioned URLs, which the browser may cache indefinitely
+         const vertPath = filterDefinitions[filterId].vertex_shader_url || `/filters/${encodeURIComponent(filterId)}/vertex.glsl`;
+         const fragPath = filterDefinitions[filterId].fragment_shader_url || `/filters/${encodeURIComponent(filterId)}/fragment.glsl`;
          const [vertResponse, fragResponse] = await Promise.all([fetch(vertPath), fetch(fragPath)]);
          if (!vertResponse.ok) throw new Error(`Vert fetch failed (${vertResponse.status})`);
          if (!fragResponse.ok) throw new Error(`Frag fetch failed (${fragResponse.status})`);
@@ -202,20 +246,62 @@ function connectWebSocket() {
     socket.on('connect', () => { console.log(`WebSocket connected: ${socket.id}`); displayStatus(`Connected.`); socket.emit('join_session', { session_id: currentSessionId }); });
     socket.on('disconnect', (reason) => { console.warn(`WebSocket disconnected: ${reason}`); displayStatus(`Disconnected.`); });
     socket.on('connect_error', (error) => { console.error('WebSocket connection error:', error); displayStatus(`Connection Error.`); });
-    socket.on('state_update', handleStateUpdate);
+    socket.on('state_update', handleFullState);
+    socket.on('state_patch', handleStatePatch);
+    socket.on('prefetch_hints', handlePrefetchHints);
     socket.on('error', (data) => { console.error('Server WS Error:', data.message || data); displayStatus(`SERVER ERROR.`); });
     console.log("WebSocket event handlers set up.");
 }
 
 
+// --- Versioned State Sync ---
+function handleFullState(message) {
+    if (!message || typeof message !== 'object') { console.error("Invalid full state received."); return; }
+    const { version, ...state } = message;
+    if (bootstrapStateVersion !== null) {
+        // The join reply usually repeats the embedded state; re-applying it would start a second map load
+        const repeated = version === bootstrapStateVersion && sessionStateVersion === bootstrapStateVersion;
+        bootstrapStateVersion = null;
+        if (repeated) { console.log(`[handleFullState] v${version} already applied from the page.`); return; }
+    }
+    sessionState = state; sessionStateVersion = typeof version === 'number' ? version : null;
+    console.log(`[handleFullState] Full state v${sessionStateVersion}`);
+    handleStateUpdate(sessionState);
+}
+
+function handleStatePatch(message) {
+    if (!message || typeof message.version !== 'number' || !message.patch) { console.error("Invalid state patch received."); return; }
+    if (sessionState === null || message.base_version !== sessionStateVersion) {
+        // Missed an update (or joined mid-stream): ask the server for the full state
+        console.warn(`[handleStatePatch] Version gap (have v${sessionStateVersion}, patch based on v${message.base_version}). Requesting resync.`);
+        sessionStateVersion = null;
+        if (socket?.connected) socket.emit('request_state', { session_id: currentSessionId });
+        return;
+    }
+    sessionState = mergePatch(sessionState, message.patch); sessionStateVersion = message.version;
+    handleStateUpdate(sessionState);
+}
+
+function mergePatch(target, patch) {
+    const result = { ...target };
+    for (const key in patch) {
+        const value = patch[key];
+        if (value && typeof value === 'object' && !Array.isArray(value) && result[key] && typeof result[key] === 'object') { result[key] = mergePatch(result[key], value); }
+        else { result[key] = value; }
+    }
+    return result;
+}
+
 // --- State Update Handler ---
 async function handleStateUpdate(state) {
     console.log('[handleStateUpdate] Received state:', JSON.stringify(state));
     if (!state || typeof state !== 'object') { console.error("Invalid state received."); return; }
+    if (snapshotMode) { scheduleSnapshotRefresh(); return; }
     displayStatus("Applying state..."); isRenderingPaused = false;
     currentViewState = state.view_state || { center_x: 0.5, center_y: 0.5, scale: 1.0 };
     const newFilterId = state.current_filter || 'none';
     const newContentPath = state.map_content_path || null;
+    const newContentUrl = getContentUrl(newContentPath, state.map_content_version);
     console.log(`[handleStateUpdate] Processing: Path='${newContentPath}', Filter='${newFilterId}'`);
     // Update filter params based on received state
     if (state.filter_params && state.filter_params[newFilterId]) { currentFilterParams = state.filter_params[newFilterId]; }
@@ -228,8 +314,8 @@ async function handleStateUpdate(state) {
         if (newFilterId !== currentFilterId || !filterDefinitions[newFilterId]?.vertexShader) {
             console.log(`Filter change/load: ${currentFilterId} -> ${newFilterId}`);
             shadersOk = await loadFilterShaders(newFilterId);
-            if (!shadersOk) { /* Fallback to basic */ material.vertexShader = getBasicVertexShader(); material.fragmentShader = getBasicFragmentShader(); currentFilterId = 'none_fallback'; shaderChanged = true; }
-            else { /* Assign new shaders */ const newVert = filterDefinitions[newFilterId].vertexShader; const newFrag = filterDefinitions[newFilterId].fragmentShader; if(material.vertexShader !== newVert){ material.vertexShader = newVert; shaderChanged = true; } if(material.fragmentShader !== newFrag){ material.fragmentShader = newFrag; shaderChanged = true; } currentFilterId = newFilterId; }
+            if (!shadersOk) { /* Fallback to basic */ material.vertexShader = getBasicVertexShader(); material.fragmentShader = withMapWindow(getBasicFragmentShader()); currentFilterId = 'none_fallback'; shaderChanged = true; }
+            else { /* Assign new shaders */ const newVert = filterDefinitions[newFilterId].vertexShader; const newFrag = withMapWindow(filterDefinitions[newFilterId].fragmentShader); if(material.vertexShader !== newVert){ material.vertexShader = newVert; shaderChanged = true; } if(material.fragmentShader !== newFrag){ material.fragmentShader = newFrag; shaderChanged = true; } currentFilterId = newFilterId; }
         }
         // 2. Update Uniforms
         const filterConfig = filterDefinitions[currentFilterId]; // Use potentially updated currentFilterId
@@ -238,28 +324,31 @@ async function handleStateUpdate(state) {
         if (shaderChanged) { material.needsUpdate = true; console.log("Shader material marked for update.");}
 
         // 3. Update Texture if path changed
-        if (newContentPath !== currentMapContentPath) {
-            console.log(`Content path change: ${currentMapContentPath} -> ${newContentPath}`);
-            await updateTexture(newContentPath, material, 'foreground'); // Load new texture or clear if null
-            currentMapContentPath = newContentPath;
+        if (newContentUrl !== currentMapContentUrl) {
+            console.log(`Content change: ${currentMapContentUrl} -> ${newContentUrl}`);
+            if (tileState && newContentUrl) tileState = null; // Never reuse tiles across content versions
+            const tiled = newContentPath && !prefetchedImages.has(newContentUrl) ? await loadTiledTexture(newContentPath, currentViewState) : false; // A prefetched map is already decoded in full
+            if (!tiled) { tileState = null; await updateTexture(newContentUrl, material, 'foreground'); } // Full image fallback, or clear if null
+            currentMapContentPath = newContentPath; currentMapContentUrl = newContentUrl;
         } else {
              // Ensure plane visibility matches texture state even if path didn't change
              planeMesh.visible = material.uniforms.mapTexture.value !== null;
         }
         // 4. Update Camera
         updateCameraView(currentViewState);
+        if (tileState) scheduleTileRefresh();
         console.log("[handleStateUpdate] Update applied successfully."); displayStatus("");
     } catch (error) { console.error("[handleStateUpdate] Error applying state:", error); displayStatus(`ERROR applying state.`); }
 }
 
 // --- Uniform Handling ---
 function updateUniformsForMaterial(targetMaterial, filterConfig, paramsForFilter) {
-    const expectedUniforms = new Set(['mapTexture', 'resolution', 'time']); const currentUniforms = targetMaterial.uniforms; let uniformsChanged = false;
+    const expectedUniforms = new Set(['mapTexture', 'mapWindow', 'resolution', 'time']); const currentUniforms = targetMaterial.uniforms; let uniformsChanged = false;
     if (filterConfig?.params) { for (const paramKey in filterConfig.params) { const paramDef = filterConfig.params[paramKey]; if (paramKey === 'backgroundImageFilename') continue; const uniformName = `u${paramKey.charAt(0).toUpperCase() + paramKey.slice(1)}`; expectedUniforms.add(uniformName); const value = paramsForFilter?.[paramKey] ?? paramDef.value ?? null; if (typeof value === 'number' && isFinite(value)) { if (!currentUniforms[uniformName]) { currentUniforms[uniformName] = { value: value }; uniformsChanged = true; } else if (currentUniforms[uniformName].value !== value) { currentUniforms[uniformName].value = value; uniformsChanged = true; } } else { if (currentUniforms[uniformName] && currentUniforms[uniformName].value !== null) { currentUniforms[uniformName].value = null; uniformsChanged = true; } } } }
     if (cleanupUniforms(targetMaterial, expectedUniforms)) { uniformsChanged = true; }
 }
 function cleanupUniforms(targetMaterial, expectedUniformSet) {
-     const baseUniforms = ['mapTexture', 'resolution', 'time']; let removed = false;
+     const baseUniforms = ['mapTexture', 'mapWindow', 'resolution', 'time']; let removed = false;
      for (const uniformName in targetMaterial.uniforms) { if (baseUniforms.includes(uniformName)) continue; if (expectedUniformSet && !expectedUniformSet.has(uniformName)) { delete targetMaterial.uniforms[uniformName]; removed = true; } else if (!expectedUniformSet) { delete targetMaterial.uniforms[uniformName]; removed = true; } } return removed;
 }
 
@@ -267,11 +356,177 @@ function cleanupUniforms(targetMaterial, expectedUniformSet) {
 async function updateTexture(newTexturePath, targetMaterial, logPrefix = 'texture') {
     let aspectChanged = false; const currentUniformValue = targetMaterial.uniforms.mapTexture?.value; const currentUniformSrc = currentUniformValue?.image?.src || null; const potentialFullUrl = newTexturePath ? new URL(newTexturePath, window.location.origin).href : null; const pathChanged = currentUniformSrc !== potentialFullUrl;
     console.log(`[updateTexture] Called. Path: ${newTexturePath}, PathChanged: ${pathChanged}`);
-    if (!newTexturePath) { if (currentUniformValue) { console.log(`[updateTexture] Clearing texture.`); currentUniformValue.dispose(); targetMaterial.uniforms.mapTexture.value = null; if (planeMesh) { planeMesh.scale.set(1, 1, 1); planeMesh.visible = false; aspectChanged = true; } } return Promise.resolve(aspectChanged); }
-    if (pathChanged) { console.log(`[updateTexture] Loading new texture: ${newTexturePath}`); displayStatus(`Loading map...`); return new Promise((resolve, reject) => { textureLoader.load(newTexturePath, (texture) => { try { const texImg = texture.image; console.log(`[updateTexture] onLoad: Success. Path: ${newTexturePath}`, texImg); if (targetMaterial?.uniforms?.mapTexture) { if (targetMaterial.uniforms.mapTexture.value) targetMaterial.uniforms.mapTexture.value.dispose(); targetMaterial.uniforms.mapTexture.value = texture; texture.needsUpdate = true; if (texImg?.naturalWidth > 0 && texImg?.naturalHeight > 0) { const textureAspect = texImg.naturalWidth / texImg.naturalHeight; if (planeMesh.scale.x !== textureAspect || planeMesh.scale.y !== 1.0) { planeMesh.scale.set(textureAspect, 1.0, 1.0); aspectChanged = true; console.log(`[updateTexture] onLoad: Plane aspect updated: ${textureAspect.toFixed(3)}`); } planeMesh.visible = true; console.log("[updateTexture] onLoad: Plane visible."); } else { console.warn("[updateTexture] onLoad: Invalid texture dims."); planeMesh.visible = false; } displayStatus(""); resolve(aspectChanged); } else { reject(new Error("Material missing")); } } catch(e) { reject(e); } }, undefined, (error) => { console.error(`[updateTexture] onError: Failed loading texture ${newTexturePath}`, error); displayStatus(`ERROR loading map.`); if (targetMaterial?.uniforms?.mapTexture) targetMaterial.uniforms.mapTexture.value = null; if (planeMesh) planeMesh.visible = false; reject(error); } ); });
+    if (!newTexturePath) { if (currentUniformValue) { console.log(`[updateTexture] Clearing texture.`); currentUniformValue.dispose(); targetMaterial.uniforms.mapTexture.value = null; targetMaterial.uniforms.mapWindow?.value.set(0, 0, 1, 1); if (planeMesh) { planeMesh.scale.set(1, 1, 1); planeMesh.visible = false; aspectChanged = true; } } return Promise.resolve(aspectChanged); }
+    if (pathChanged) { console.log(`[updateTexture] Loading new texture: ${newTexturePath}`); displayStatus(`Loading map...`); return new Promise((resolve, reject) => { loadMapTexture(newTexturePath, (texture) => { try { const texImg = texture.image; console.log(`[updateTexture] onLoad: Success. Path: ${newTexturePath}`, texImg); if (targetMaterial?.uniforms?.mapTexture) { if (targetMaterial.uniforms.mapTexture.value) targetMaterial.uniforms.mapTexture.value.dispose(); targetMaterial.uniforms.mapTexture.value = texture; targetMaterial.uniforms.mapWindow?.value.set(0, 0, 1, 1); texture.needsUpdate = true; if (texImg?.naturalWidth > 0 && texImg?.naturalHeight > 0) { const textureAspect = texImg.naturalWidth / texImg.naturalHeight; if (planeMesh.scale.x !== textureAspect || planeMesh.scale.y !== 1.0) { planeMesh.scale.set(textureAspect, 1.0, 1.0); aspectChanged = true; console.log(`[updateTexture] onLoad: Plane aspect updated: ${textureAspect.toFixed(3)}`); } planeMesh.visible = true; console.log("[updateTexture] onLoad: Plane visible."); } else { console.warn("[updateTexture] onLoad: Invalid texture dims."); planeMesh.visible = false; } displayStatus(""); resolve(aspectChanged); } else { reject(new Error("Material missing")); } } catch(e) { reject(e); } }, (error) => { console.error(`[updateTexture] onError: Failed loading texture ${newTexturePath}`, error); displayStatus(`ERROR loading map.`); if (targetMaterial?.uniforms?.mapTexture) targetMaterial.uniforms.mapTexture.value = null; if (planeMesh) planeMesh.visible = false; reject(error); } ); });
     } else { console.log(`[updateTexture] Path unchanged.`); planeMesh.visible = targetMaterial.uniforms.mapTexture.value !== null; return Promise.resolve(false); }
 }
 
+function loadMapTexture(url, onLoad, onError) {
+    // Wraps the decoded image when the map was prefetched, so the switch needs no download or decode
+    const image = prefetchedImages.get(url);
+    if (!image) { textureLoader.load(url, onLoad, undefined, onError); return; }
+    const texture = new THREE.Texture(image); texture.needsUpdate = true; onLoad(texture);
+}
+
+// --- Map Prefetching ---
+function getContentUrl(path, version) { return path && version ? `${path}?v=${version}` : path; }
+function getHintUrl(hint) { return getContentUrl(hint.map_content_path, hint.map_content_version); }
+
+function handlePrefetchHints(message) {
+    if (!message || !Array.isArray(message.maps)) { console.error("Invalid prefetch hints received."); return; }
+    prefetchHints = message.maps; prefetchFailures.clear();
+    const queued = new Set(prefetchHints.map(getHintUrl));
+    for (const url of prefetchedImages.keys()) { if (!queued.has(url) && url !== currentMapContentUrl) prefetchedImages.delete(url); } // Release dequeued maps
+    console.log(`[prefetch] ${prefetchHints.length} map(s) queued by the GM.`);
+    // Server-rendered frames need nothing downloaded; otherwise maps already decoded (or on screen) are reported straight away
+    for (const hint of prefetchHints) { if (snapshotMode || prefetchedImages.has(getHintUrl(hint)) || getHintUrl(hint) === currentMapContentUrl) reportPrefetch(hint, true); }
+    if (!snapshotMode) runPrefetchQueue();
+}
+
+async function runPrefetchQueue() {
+    // One map at a time in GM order, so the next map is ready first and the one on screen keeps most of the bandwidth
+    if (prefetchRunning) return; prefetchRunning = true;
+    const isPending = (hint) => { const url = getHintUrl(hint); return !prefetchedImages.has(url) && !prefetchFailures.has(url) && url !== currentMapContentUrl; };
+    try {
+        for (let hint = prefetchHints.find(isPending); hint; hint = prefetchHints.find(isPending)) {
+            const url = getHintUrl(hint);
+            try {
+                const image = await prefetchImage(url);
+                if (!prefetchHints.some(queuedHint => getHintUrl(queuedHint) === url)) continue; // Dequeued while downloading
+                prefetchedImages.set(url, image); reportPrefetch(hint, true);
+                console.log(`[prefetch] Ready: ${hint.filename} (${(hint.bytes / 1048576).toFixed(1)} MB)`);
+            } catch (error) { console.warn(`[prefetch] Failed: ${hint.filename}`, error); prefetchFailures.add(url); reportPrefetch(hint, false); }
+        }
+    } finally { prefetchRunning = false; }
+}
+
+function prefetchImage(url) {
+    // An <img> rather than fetch(), so the browser negotiates the same AVIF/WebP variant (Vary: Accept) as a texture load would
+    const image = new Image(); image.src = `/${url}`;
+    return image.decode().then(() => image);
+}
+
+function reportPrefetch(hint, ok) {
+    if (socket?.connected) socket.emit('prefetch_ready', { session_id: currentSessionId, filename: hint.filename, content_hash: hint.map_content_version, ok });
+}
+
+// --- Tile Pyramid Handling ---
+async function requestTileSelection(mapFilename, viewState) {
+    const dpr = window.devicePixelRatio || 1;
+    const params = new URLSearchParams({
+        center_x: viewState?.center_x ?? 0.5, center_y: viewState?.center_y ?? 0.5, scale: viewState?.scale ?? 1.0,
+        width: Math.round(window.innerWidth * dpr), height: Math.round(window.innerHeight * dpr),
+        max_size: renderer?.capabilities?.maxTextureSize || 4096
+    });
+    try {
+        const response = await fetch(`/api/tiles/${encodeURIComponent(mapFilename)}?${params}`);
+        if (response.status !== 200) { console.log(`[requestTileSelection] Tiles unavailable for ${mapFilename} (status ${response.status}).`); return null; }
+        return await response.json();
+    } catch (error) { console.warn("[requestTileSelection] Error fetching tile selection:", error); return null; }
+}
+
+async function loadTiledTexture(contentPath, viewState) {
+    // Returns false when no pyramid is ready yet, so the caller falls back to the full image
+    const mapFilename = contentPath.split('/').pop();
+    const selection = await requestTileSelection(mapFilename, viewState);
+    if (!selection || !selection.tiles) return false;
+    displayStatus(`Loading map...`);
+    await applyTileSelection(mapFilename, selection);
+    displayStatus("");
+    return true;
+}
+
+function getTileWindow(selection) {
+    // Bounding box of the selected tiles in level pixels; the texture only holds this part of the level
+    const size = selection.tile_size; const tiles = selection.tiles;
+    if (!tiles.length) return { x: 0, y: 0, width: Math.min(size, selection.width), height: Math.min(size, selection.height) };
+    const x = Math.min(...tiles.map(t => t.x)); const y = Math.min(...tiles.map(t => t.y));
+    const right = Math.max(...tiles.map(t => Math.min(t.x + size, selection.width))); const bottom = Math.max(...tiles.map(t => Math.min(t.y + size, selection.height)));
+    return { x, y, width: right - x, height: bottom - y };
+}
+
+function containsWindow(outer, inner) {
+    return inner.x >= outer.x && inner.y >= outer.y && inner.x + inner.width <= outer.x + outer.width && inner.y + inner.height <= outer.y + outer.height;
+}
+
+async function applyTileSelection(mapFilename, selection) {
+    const tileWindow = getTileWindow(selection);
+    const sameMap = tileState && tileState.mapFilename === mapFilename;
+    if (!sameMap || tileState.level !== selection.level || !containsWindow(tileState.window, tileWindow)) {
+        const canvas = document.createElement('canvas'); canvas.width = tileWindow.width; canvas.height = tileWindow.height;
+        const ctx = canvas.getContext('2d'); const drawn = new Set();
+        if (sameMap) {
+            // Reuse what the previous window showed as a placeholder while the missing tiles load
+            const previous = tileState; const ratio = selection.width / previous.width;
+            ctx.drawImage(previous.canvas, previous.window.x * ratio - tileWindow.x, previous.window.y * ratio - tileWindow.y, previous.window.width * ratio, previous.window.height * ratio);
+            if (previous.level === selection.level) {
+                // Tiles drawn at the same level are already sharp in the placeholder (windows are tile-aligned)
+                for (const key of previous.drawn) { const [col, row] = key.split('_').map(Number); if (containsWindow(tileWindow, { x: col * selection.tile_size, y: row * selection.tile_size, width: 1, height: 1 })) drawn.add(key); }
+            }
+        }
+        const texture = new THREE.CanvasTexture(canvas);
+        const previousTexture = material.uniforms.mapTexture.value;
+        material.uniforms.mapTexture.value = texture;
+        if (previousTexture) previousTexture.dispose();
+        // UV origin and size of the window within the map (UV y runs bottom-up)
+        material.uniforms.mapWindow.value.set(tileWindow.x / selection.width, 1.0 - (tileWindow.y + tileWindow.height) / selection.height, tileWindow.width / selection.width, tileWindow.height / selection.height);
+        tileState = { mapFilename, level: selection.level, width: selection.width, height: selection.height, window: tileWindow, canvas, ctx, texture, loaded: new Set(drawn), drawn, dirty: false };
+        planeMesh.scale.set(selection.width / selection.height, 1.0, 1.0); planeMesh.visible = true; // The plane keeps the full map's size; only the texture is windowed
+        console.log(`[applyTileSelection] Using level ${selection.level} (${selection.width}x${selection.height}), window ${tileWindow.width}x${tileWindow.height} at ${tileWindow.x},${tileWindow.y} for ${mapFilename}`);
+    }
+    const state = tileState;
+    const pending = selection.tiles.filter(t => !state.loaded.has(`${t.col}_${t.row}`)).map(async (t) => {
+        const key = `${t.col}_${t.row}`; state.loaded.add(key);
+        const url = selection.url_template.replace('{level}', selection.level).replace('{col}', t.col).replace('{row}', t.row);
+        try {
+            const img = new Image(); img.src = url; await img.decode();
+            if (tileState !== state) return; // Map, level or window changed while loading
+            state.ctx.drawImage(img, t.x - state.window.x, t.y - state.window.y); state.drawn.add(key);
+            state.dirty = true; // Uploaded once per frame in animate(), however many tiles arrived
+        } catch (error) { console.warn(`[applyTileSelection] Failed loading tile ${url}:`, error); state.loaded.delete(key); }
+    });
+    await Promise.all(pending);
+}
+
+function scheduleTileRefresh() {
+    // Debounced so slider drags only fetch tiles for where the view settles
+    if (tileRefreshTimer) clearTimeout(tileRefreshTimer);
+    tileRefreshTimer = setTimeout(async () => {
+        tileRefreshTimer = null; if (!tileState) return;
+        const mapFilename = tileState.mapFilename;
+        const selection = await requestTileSelection(mapFilename, currentViewState);
+        if (selection?.tiles && tileState && tileState.mapFilename === mapFilename) { await applyTileSelection(mapFilename, selection); updateCameraView(currentViewState); }
+    }, 150);
+}
+
+// --- Snapshot Mode ---
+function startSnapshotMode() {
+    console.log("Using server-rendered snapshots instead of WebGL.");
+    snapshotMode = true; if (canvas) canvas.style.display = 'none';
+    window.addEventListener('resize', scheduleSnapshotRefresh, false);
+    connectWebSocket();
+}
+function scheduleSnapshotRefresh() {
+    // Debounced: bursts of GM updates or resize events fetch a single frame
+    clearTimeout(snapshotTimer); snapshotTimer = setTimeout(updateSnapshot, SNAPSHOT_REFRESH_DELAY_MS);
+}
+function updateSnapshot() {
+    if (!snapshotImage) return;
+    const contentPath = sessionState?.map_content_path;
+    if (!contentPath) { snapshotImage.style.display = 'none'; snapshotImage.removeAttribute('src'); displayStatus("Waiting for map..."); return; }
+    const pixelRatio = window.devicePixelRatio || 1; const mapFilename = contentPath.split('/').pop();
+    const params = new URLSearchParams({ session: currentSessionId, width: Math.round(window.innerWidth * pixelRatio), height: Math.round(window.innerHeight * pixelRatio), format: 'jpeg', v: sessionStateVersion ?? '' });
+    const url = `/api/snapshot/${encodeURIComponent(mapFilename)}?${params}`;
+    if (snapshotImage.getAttribute('src') === url) return;
+    snapshotImage.onload = () => { snapshotImage.style.display = 'block'; displayStatus(""); };
+    snapshotImage.onerror = () => {
+        console.error("Snapshot failed to load:", url); displayStatus("ERROR: Could not load map frame. Retrying...");
+        // Forget the failed URL so the retry requests it again
+        snapshotImage.removeAttribute('src'); clearTimeout(snapshotTimer); snapshotTimer = setTimeout(updateSnapshot, SNAPSHOT_RETRY_DELAY_MS);
+    };
+    snapshotImage.src = url;
+}
+
 // --- Camera Handling ---
 function updateCameraView(viewState) {
     if (!viewState || typeof viewState.scale !== 'number' || typeof viewState.center_x !== 'number' || typeof viewState.center_y !== 'number') { viewState = { scale: 1.0, center_x: 0.5, center_y: 0.5 }; } if (!planeMesh || !camera) { return; } const planeWidth = planeMesh.scale.x; const planeHeight = planeMesh.scale.y; const effectiveScale = Math.max(0.01, viewState.scale); const viewHeight = planeHeight / effectiveScale; const viewWidth = viewHeight * (window.innerWidth / window.innerHeight); camera.left = -viewWidth / 2; camera.right = viewWidth / 2; camera.top = viewHeight / 2; camera.bottom = -viewHeight / 2; const offsetX = (viewState.center_x - 0.5) * planeWidth; const offsetY = -(viewState.center_y - 0.5) * planeHeight; camera.position.x = offsetX; camera.position.y = offsetY; camera.updateProjectionMatrix();
@@ -279,14 +534,20 @@ function updateCameraView(viewState) {
 
 // --- Event Listeners & Animation Loop ---
 function onWindowResize() {
-    if (!camera || !renderer || !material) return; const width = window.innerWidth; const height = window.innerHeight; const aspect = width / height; const viewHeight = camera.top - camera.bottom; const viewWidth = viewHeight * aspect; camera.left = -viewWidth / 2; camera.right = viewWidth / 2; camera.updateProjectionMatrix(); renderer.setSize(width, height); if (material?.uniforms?.resolution) material.uniforms.resolution.value.set(width, height);
+    if (!camera || !renderer || !material) return; const width = window.innerWidth; const height = window.innerHeight; const aspect = width / height; const viewHeight = camera.top - camera.bottom; const viewWidth = viewHeight * aspect; camera.left = -viewWidth / 2; camera.right = viewWidth / 2; camera.updateProjectionMatrix(); renderer.setSize(width, height); if (material?.uniforms?.resolution) material.uniforms.resolution.value.set(width, height); if (tileState) scheduleTileRefresh();
 }
 function animate() {
-    requestAnimationFrame(animate); if (isRenderingPaused || !renderer || !scene || !camera) return; const elapsedTime = clock.getElapsedTime(); if (material?.uniforms?.time) material.uniforms.time.value = elapsedTime; try { renderer.render(scene, camera); } catch (e) { console.error("Render loop error:", e); displayStatus(`ERROR rendering.`); isRenderingPaused = true; }
+    requestAnimationFrame(animate); if (isRenderingPaused || !renderer || !scene || !camera) return; const elapsedTime = clock.getElapsedTime(); if (material?.uniforms?.time) material.uniforms.time.value = elapsedTime; if (tileState?.dirty) { tileState.texture.needsUpdate = true; tileState.dirty = false; } try { renderer.render(scene, camera); } catch (e) { console.error("Render loop error:", e); displayStatus(`ERROR rendering.`); isRenderingPaused = true; }
 }
 
 // --- Utility & Fallbacks ---
 function displayStatus(message) { if (statusDiv) { statusDiv.textContent = message; statusDiv.style.display = message ? 'block' : 'none'; } }
+function withMapWindow(fragmentShader) {
+    // Filters sample mapTexture with map UVs; redirect those samples into the loaded tile window (mapWindow: UV origin xy, size zw)
+    if (!fragmentShader) return fragmentShader;
+    return fragmentShader.replace(/texture2D\(\s*mapTexture\s*,/g, 'sampleMapWindow(').replace(/uniform\s+sampler2D\s+mapTexture\s*;/,
+        'uniform sampler2D mapTexture;\nuniform vec4 mapWindow;\nvec4 sampleMapWindow(vec2 mapUv) { return texture2D(mapTexture, (mapUv - mapWindow.xy) / mapWindow.zw); }');
+}
 // Ensure shader functions are implemented
 function getBasicVertexShader() {
     return `
@@ -0,0 +1,19 @@
+# tests/conftest.py
+# Version: 1.0
+# Shared test setup: run from the repo root with  python -m pytest
+
+import os
+import sys
+
+import pytest
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_ROOT)
+
+@pytest.fixture(scope='session')
+def core(tmp_path_factory):
+    # app.py sets up the whole server on import; keep sessions in memory and the map catalog out of the repo
+    os.environ['SESSION_STORE'] = 'memory'; os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ['MAP_CATALOG_PATH'] = str(tmp_path_factory.mktemp('catalog') / 'catalog.db')
+    import app
+    return app
@@ -0,0 +1,82 @@
+# tests/test_config_writer.py
+# Version: 1.0
+# Atomic config writes and the write-behind queue (config_writer.py)
+
+import json
+import os
+import stat
+import threading
+
+import pytest
+
+from config_writer import NEW_FILE_MODE, WriteBehindWriter, write_json_atomic
+
+def file_mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_write_json_atomic_replaces_file_without_leaving_temp_files(tmp_path):
+    path = str(tmp_path / 'map.png_config.json')
+    write_json_atomic(path, {"version": 1}); write_json_atomic(path, {"version": 2})
+    with open(path, encoding='utf-8') as f: assert json.load(f) == {"version": 2}
+    assert os.listdir(tmp_path) == ['map.png_config.json']
+
+def test_write_json_atomic_keeps_the_existing_file_mode(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_json_atomic(path, {})
+    assert file_mode(path) == NEW_FILE_MODE # Not mkstemp's 0600
+    os.chmod(path, 0o640); write_json_atomic(path, {"version": 2})
+    assert file_mode(path) == 0o640
+
+def test_failed_write_leaves_previous_file_intact(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_json_atomic(path, {"version": 1})
+    with pytest.raises(TypeError): write_json_atomic(path, {"version": object()}) # Not JSON serializable
+    with open(path, encoding='utf-8') as f: assert json.load(f) == {"version": 1}
+    assert os.listdir(tmp_path) == ['config.json']
+
+class BlockingWrites:
+    # write_fn that records writes and holds each one until released, so tests can queue work behind it
+    def __init__(self):
+        self.written = []; self.release = threading.Event(); self.started = threading.Event()
+    def __call__(self, path, data):
+        self.started.set(); self.release.wait(5); self.written.append((path, data))
+
+def test_saves_queued_during_a_write_are_coalesced():
+    writes = BlockingWrites(); writer = WriteBehindWriter(writes)
+    assert writer.submit('a.json', {"v": 1}) is False
+    assert writes.started.wait(5) # v1 is now in flight
+    assert writer.submit('a.json', {"v": 2}) is False
+    assert writer.submit('a.json', {"v": 3}) is True
+    assert writer.get_pending('a.json') == {"v": 3} and writer.pending_count() == 2
+    writes.release.set()
+    assert writer.flush(5)
+    assert writes.written == [('a.json', {"v": 1}), ('a.json', {"v": 3})]
+    assert writer.get_pending('a.json') is None and writer.pending_count() == 0
+    writer.close()
+
+def test_write_failures_are_reported_and_do_not_stop_the_worker():
+    outcomes = []
+    def write(path, data):
+        if path == 'bad.json': raise OSError("disk full")
+    writer = WriteBehindWriter(write, on_written=lambda path, ok: outcomes.append((path, ok)))
+    writer.submit('bad.json', {}); assert writer.wait_written('bad.json', 5) is False
+    writer.submit('good.json', {}); assert writer.wait_written('good.json', 5) is True
+    assert outcomes == [('bad.json', False), ('good.json', True)]
+    pending, last_result = writer.get_status('bad.json')
+    assert pending is False and last_result[0] is False
+    writer.close()
+
+def test_wait_written_times_out_while_the_write_is_pending():
+    writes = BlockingWrites(); writer = WriteBehindWriter(writes)
+    writer.submit('a.json', {"v": 1})
+    assert writer.wait_written('a.json', 0.05) is None and writer.get_status('a.json')[0] is True
+    writes.release.set()
+    assert writer.wait_written('a.json', 5) is True
+    writer.close()
+
+def test_close_writes_queued_saves_and_rejects_new_ones(tmp_path):
+    path = str(tmp_path / 'config.json')
+    writer = WriteBehindWriter()
+    writer.submit(path, {"v": 1}); writer.close()
+    with open(path, encoding='utf-8') as f: assert json.load(f) == {"v": 1}
+    with pytest.raises(RuntimeError): writer.submit(path, {"v": 2})
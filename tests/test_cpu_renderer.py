@@ -0,0 +1,44 @@
+# tests/test_cpu_renderer.py
+# Version: 1.0
+# Snapshot renderer (cpu_renderer.py): textures are cut to the sampled region without changing the output
+
+import pytest
+
+np = pytest.importorskip('numpy')
+from PIL import Image
+
+import cpu_renderer
+
+RETRO_PARAMS = {"crtWarp": 0.1, "chromaticAberration": 0.02, "scanlineIntensity": 0.3, "vignetteAmount": 0.3, "roundedCorners": 0.05}
+
+@pytest.fixture
+def map_image():
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (256, 384, 3), dtype=np.uint8))
+
+def render(image, filter_id, params, view_state, full_texture=False, monkeypatch=None):
+    if full_texture:
+        monkeypatch.setattr(cpu_renderer, 'get_sample_bounds', lambda covered, *uv_pairs: (0.0, 0.0, 1.0, 1.0))
+        monkeypatch.setattr(cpu_renderer, 'MAX_TEXELS_PER_PIXEL', float('inf'))
+    return np.asarray(cpu_renderer.render_snapshot(image, filter_id, params, view_state, 160, 90)).astype(int)
+
+@pytest.mark.parametrize("filter_id, params", [("none", {}), ("retro_sci_fi_amber", RETRO_PARAMS)])
+@pytest.mark.parametrize("view_state", [{"scale": 1.0}, {"scale": 4.0, "center_x": 0.3, "center_y": 0.6}, {"scale": 0.5}])
+def test_cropped_texture_renders_like_the_full_map(map_image, monkeypatch, filter_id, params, view_state):
+    cropped = render(map_image, filter_id, params, view_state)
+    full = render(map_image, filter_id, params, view_state, full_texture=True, monkeypatch=monkeypatch)
+    assert np.array_equal(cropped, full)
+
+def test_texture_covers_only_the_sampled_region(map_image):
+    texture = cpu_renderer.prepare_texture(map_image, 160, 90, 4.0, (0.25, 0.5, 0.5, 0.75))
+    assert (texture.full_width, texture.full_height) == (384, 256)
+    assert texture.pixels.shape == (64 + 2 * cpu_renderer.TEXTURE_MARGIN, 96 + 2 * cpu_renderer.TEXTURE_MARGIN, 4)
+    assert (texture.offset_x, texture.offset_y) == (96 - cpu_renderer.TEXTURE_MARGIN, 64 - cpu_renderer.TEXTURE_MARGIN)
+
+def test_texture_size_is_bounded_by_the_output_size(map_image):
+    # Samples spread over the whole map (e.g. wrapped by the warp) at a high zoom get a coarser texture
+    texture = cpu_renderer.prepare_texture(map_image, 16, 9, 8.0)
+    assert texture.pixels.shape[0] * texture.pixels.shape[1] <= cpu_renderer.MAX_TEXELS_PER_PIXEL * 16 * 9
+
+def test_view_off_the_map_is_transparent(map_image):
+    assert not render(map_image, "none", {}, {"scale": 4.0, "center_x": 3.0})[..., 3].any()
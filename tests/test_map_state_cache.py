@@ -0,0 +1,37 @@
+# tests/test_map_state_cache.py
+# Version: 1.0
+# Map state cache (app.py): returned states are read-only, so callers cannot change the cached copy
+
+import copy
+import os
+
+import pytest
+
+@pytest.fixture
+def map_filename(core):
+    maps = sorted(f for f in os.listdir(core.app.config['MAPS_FOLDER']) if core.allowed_map_file(f))
+    if not maps: pytest.skip("No maps in the maps folder")
+    return maps[0]
+
+@pytest.mark.parametrize("change", [
+    lambda state: state.__setitem__('current_filter', 'changed'),
+    lambda state: state['view_state'].update(scale=9.0),
+    lambda state: state['filter_params'].pop(next(iter(state['filter_params']))),
+    lambda state: state.setdefault('extra', 1),
+])
+def test_changing_a_returned_state_does_not_affect_the_cache(core, map_filename, change):
+    state = core.get_state_for_map(map_filename); before = copy.deepcopy(state)
+    with pytest.raises(TypeError): change(state)
+    assert core.get_state_for_map(map_filename) == before
+
+def test_copies_of_a_returned_state_are_mutable(core, map_filename):
+    state = core.get_state_for_map(map_filename); before = copy.deepcopy(state)
+    copied = copy.deepcopy(state); copied['view_state']['scale'] = 9.0; copied['current_filter'] = 'changed'
+    merged = core.merge_dicts(state, {"view_state": {"scale": 9.0}}); merged['view_state']['center_x'] = 0.1
+    assert type(copied) is dict and type(copied['view_state']) is dict
+    assert core.get_state_for_map(map_filename) == before
+
+def test_returned_state_serializes_like_a_plain_dict(core, map_filename):
+    state = core.get_state_for_map(map_filename)
+    with core.app.test_request_context():
+        assert core.app.json.loads(core.jsonify(state).get_data()) == copy.deepcopy(state)
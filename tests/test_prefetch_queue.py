@@ -0,0 +1,36 @@
+# tests/test_prefetch_queue.py
+# Version: 1.0
+# Map prefetch queues (app.py): only for existing sessions, bounded, and dropped with the session
+
+import os
+
+import pytest
+
+@pytest.fixture
+def map_filename(core):
+    maps = sorted(f for f in os.listdir(core.app.config['MAPS_FOLDER']) if core.allowed_map_file(f))
+    if not maps: pytest.skip("No maps in the maps folder")
+    return maps[0]
+
+def create_session(core, session_id):
+    core.session_store.get_or_create(session_id, core.get_default_session_state)
+
+def test_queue_is_rejected_for_unknown_sessions(core, map_filename):
+    assert core.set_prefetch_queue({"session_id": 'test-prefetch-unknown', "maps": [map_filename]}) is None
+    assert not core.has_prefetch_queue('test-prefetch-unknown')
+
+def test_queue_is_limited_per_session_and_in_sessions(core, map_filename, monkeypatch):
+    monkeypatch.setitem(core.app.config, 'PREFETCH_QUEUE_MAX', 1)
+    monkeypatch.setitem(core.app.config, 'PREFETCH_MAX_SESSIONS', len(core.prefetch_queues) + 1)
+    for session_id in ('test-prefetch-a', 'test-prefetch-b'): create_session(core, session_id)
+    assert core.set_prefetch_queue({"session_id": 'test-prefetch-a', "maps": [map_filename] + [f'missing-{i}.png' for i in range(100)]}) == 'test-prefetch-a'
+    assert [hint['filename'] for hint in core.get_prefetch_hints('test-prefetch-a')['maps']] == [map_filename]
+    assert core.set_prefetch_queue({"session_id": 'test-prefetch-b', "maps": [map_filename]}) is None
+    assert core.set_prefetch_queue({"session_id": 'test-prefetch-a', "maps": [map_filename]}) == 'test-prefetch-a' # Replacing a queue is still allowed
+    core.set_prefetch_queue({"session_id": 'test-prefetch-a', "maps": []})
+
+def test_queue_is_dropped_when_the_session_is_evicted(core, map_filename):
+    create_session(core, 'test-prefetch-evicted')
+    assert core.set_prefetch_queue({"session_id": 'test-prefetch-evicted', "maps": [map_filename]}) == 'test-prefetch-evicted'
+    with core.session_store.lock: core.session_store._evict('test-prefetch-evicted')
+    assert not core.has_prefetch_queue('test-prefetch-evicted') and 'test-prefetch-evicted' not in core.prefetch_reports
@@ -0,0 +1,117 @@
+# tests/test_session_store.py
+# Version: 1.0
+# Session stores (session_store.py): LRU/TTL eviction that spares joined sessions, and SQLite snapshots surviving a restart
+
+import time
+
+import pytest
+
+from session_store import MemorySessionStore, SessionLimitError, SQLiteSessionStore, create_session_store
+
+def new_state(scale=1.0):
+    return {"map_content_path": "maps/a.png", "view_state": {"scale": scale}}
+
+def test_get_or_create_uses_factory_once():
+    store = MemorySessionStore()
+    first = store.get_or_create('s1', new_state); second = store.get_or_create('s1', lambda: pytest.fail("factory called twice"))
+    assert first is second and first.version == 0 and store.session_count() == 1
+
+def test_least_recently_used_session_is_evicted():
+    store = MemorySessionStore(max_sessions=2)
+    store.get_or_create('a', new_state); store.get_or_create('b', new_state)
+    store.get('a') # b is now least recently used
+    store.get_or_create('c', new_state)
+    assert store.get('b') is None and store.get('a') is not None and store.get('c') is not None
+
+def test_sessions_with_members_are_not_evicted_to_make_room():
+    store = MemorySessionStore(max_sessions=2)
+    store.get_or_create('a', new_state); store.get_or_create('b', new_state)
+    store.add_member('a', 'sid-1') # a is least recently used but has a player
+    store.get_or_create('c', new_state)
+    assert store.get('a') is not None and store.get('b') is None
+    store.add_member('c', 'sid-2')
+    with pytest.raises(SessionLimitError): store.get_or_create('d', new_state)
+
+def test_on_evict_is_called_for_capacity_and_idle_evictions():
+    evicted = []
+    store = MemorySessionStore(max_sessions=2, idle_ttl=60, on_evict=evicted.append)
+    for session_id in ('a', 'b', 'c'): store.get_or_create(session_id, new_state)
+    assert evicted == ['a']
+    store.entries['b'].last_active = time.time() - 120
+    store.evict_idle()
+    assert evicted == ['a', 'b']
+
+def test_app_forgets_sessions_evicted_to_make_room(core, monkeypatch):
+    monkeypatch.setattr(core.session_store, 'max_sessions', core.session_store.session_count() + 5)
+    session_ids = [f'test-capacity-{i}' for i in range(50)]
+    for session_id in session_ids: core.update_scheduler.submit(session_id, {"view_state": {"scale": 2.0}})
+    kept = [session_id for session_id in session_ids if session_id in core.session_store.entries]
+    assert 5 <= len(kept) < len(session_ids) # Older sessions of other tests may be evicted first
+    assert [session_id for session_id in session_ids if core.GM_UPDATES.get(session=session_id)] == kept
+    assert [session_id for session_id in session_ids if session_id in core.update_scheduler.last_flush] == kept
+
+def test_rejected_updates_create_no_session_metrics(core, monkeypatch):
+    def full(session_id, factory): raise SessionLimitError("full")
+    monkeypatch.setattr(core.session_store, 'get_or_create', full)
+    assert core.apply_gm_update('test-rejected', {"view_state": {"scale": 2.0}}) is None
+    assert 'test-rejected' not in core.metrics.render()
+
+def test_idle_sessions_expire_unless_joined():
+    store = MemorySessionStore(idle_ttl=60)
+    for session_id in ('idle', 'joined', 'recent'): store.get_or_create(session_id, new_state)
+    store.add_member('joined', 'sid-1')
+    for session_id in ('idle', 'joined'): store.entries[session_id].last_active = time.time() - 120
+    assert store.evict_idle() == ['idle']
+    assert store.session_count() == 2
+
+def test_remove_member_restarts_the_idle_clock():
+    store = MemorySessionStore(idle_ttl=60)
+    store.get_or_create('a', new_state); store.get_or_create('b', new_state)
+    store.add_member('a', 'sid-1'); store.add_member('b', 'sid-1')
+    store.entries['a'].last_active = time.time() - 120
+    assert store.remove_member('sid-1') == {'a', 'b'}
+    assert store.member_counts() == {} and store.evict_idle() == []
+
+def test_put_replaces_state_and_version():
+    store = MemorySessionStore()
+    store.put('s1', new_state(2.0), 5)
+    entry = store.get('s1')
+    assert entry.state["view_state"]["scale"] == 2.0 and entry.version == 5
+
+def test_sqlite_store_restores_sessions_after_restart(tmp_path):
+    db_path = str(tmp_path / 'sessions.db')
+    store = SQLiteSessionStore(db_path)
+    store.put('s1', new_state(3.0), 7); store.close()
+    restarted = SQLiteSessionStore(db_path)
+    entry = restarted.get('s1')
+    assert entry.state == new_state(3.0) and entry.version == 7 and not entry.dirty
+    restarted.close()
+
+def test_sqlite_store_writes_evicted_sessions_and_loads_them_back(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), max_sessions=1)
+    store.put('a', new_state(1.5), 2)
+    store.put('b', new_state(), 1) # Evicts a, which is written first
+    assert 'a' not in store.entries and store.stored_count() == 1
+    entry = store.get('a')
+    assert entry.state == new_state(1.5) and entry.version == 2
+    store.close()
+
+def test_sqlite_store_prunes_expired_and_excess_rows(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), stored_ttl=3600, max_stored=2)
+    now = time.time()
+    for i, session_id in enumerate(('old', 'a', 'b', 'c')): store.put(session_id, new_state(), 1); store.entries[session_id].last_active = now - i
+    store.entries['old'].last_active = now - 7200
+    store.flush(); store.entries.clear() # As if every session had been evicted from memory
+    assert store.prune_stored() == 2 # 'old' expired, 'c' is beyond max_stored
+    assert store.get('old') is None and store.get('c') is None and store.get('a') is not None
+    store.close()
+
+def test_sqlite_store_keeps_rows_of_sessions_in_memory(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), stored_ttl=3600)
+    store.put('live', new_state(), 1); store.entries['live'].last_active = time.time() - 7200; store.flush()
+    assert store.prune_stored() == 0 and store.stored_count() == 1
+    store.close()
+
+def test_create_session_store_rejects_unknown_backends():
+    assert isinstance(create_session_store('memory'), MemorySessionStore)
+    with pytest.raises(ValueError): create_session_store('redis')
@@ -0,0 +1,58 @@
+# tests/test_state_patches.py
+# Version: 1.0
+# Versioned state patches: diff_state/merge_dicts round-trips and the version chain players use to detect gaps
+
+import copy
+
+import pytest
+
+STATE = {"map_content_path": "maps/a.png", "current_filter": "none", "display_type": "image",
+         "view_state": {"center_x": 0.5, "center_y": 0.5, "scale": 1.0},
+         "filter_params": {"none": {}, "retro": {"tint": [1.0, 0.5, 0.0], "scanlines": 0.3}}}
+
+def test_merge_dicts_merges_nested_values_without_modifying_inputs(core):
+    base = copy.deepcopy(STATE); update = {"view_state": {"scale": 2.0}, "filter_params": {"retro": {"scanlines": 0.6}}}
+    merged = core.merge_dicts(base, update)
+    assert merged["view_state"] == {"center_x": 0.5, "center_y": 0.5, "scale": 2.0}
+    assert merged["filter_params"]["retro"] == {"tint": [1.0, 0.5, 0.0], "scanlines": 0.6}
+    assert base == STATE and update == {"view_state": {"scale": 2.0}, "filter_params": {"retro": {"scanlines": 0.6}}}
+
+@pytest.mark.parametrize("changes", [
+    {"view_state": {"center_x": 0.25}},
+    {"current_filter": "retro", "filter_params": {"retro": {"tint": [0.0, 1.0, 0.0]}}},
+    {"filter_params": {"amber": {"glow": 0.4}}},                    # Added nested key
+    {"view_state": {"scale": 3.0}, "map_content_path": "maps/b.png"},
+])
+def test_diff_state_patch_round_trips(core, changes):
+    new = core.merge_dicts(STATE, changes)
+    patch = core.diff_state(STATE, new)
+    assert core.merge_dicts(STATE, patch) == new
+    assert patch == changes # Only the changed leaves are sent
+
+def test_diff_state_of_equal_states_is_empty(core):
+    assert core.diff_state(STATE, copy.deepcopy(STATE)) == {}
+
+@pytest.mark.parametrize("path", [("current_filter",), ("filter_params", "retro"), ("filter_params", "retro", "scanlines")])
+def test_diff_state_cannot_express_removed_keys(core, path):
+    new = copy.deepcopy(STATE); parent = new
+    for key in path[:-1]: parent = parent[key]
+    del parent[path[-1]]
+    assert core.diff_state(STATE, new) is None
+
+def test_patches_chain_versions_and_resync_fills_gaps(core):
+    session_id = 'test-patch-chain'
+    messages = [core.apply_gm_update(session_id, {"view_state": {"scale": scale}}) for scale in (1.5, 2.0, 2.5)]
+    assert [event for event, _ in messages] == ['state_patch'] * 3
+    versions = [(payload["base_version"], payload["version"]) for _, payload in messages]
+    assert all(version == base + 1 for base, version in versions)
+    assert all(previous[1] == current[0] for previous, current in zip(versions, versions[1:]))
+    # A player that missed the middle patch sees base_version != its version and asks for the full state
+    assert messages[2][1]["base_version"] != versions[0][1]
+    full = core.get_requested_state({"session_id": session_id})
+    assert full["version"] == versions[-1][1] and full["view_state"]["scale"] == 2.5
+
+def test_unchanged_update_is_not_broadcast(core):
+    session_id = 'test-patch-noop'
+    event, payload = core.apply_gm_update(session_id, {"view_state": {"scale": 1.25}})
+    assert core.apply_gm_update(session_id, {"view_state": {"scale": 1.25}}) is None
+    assert core.get_requested_state({"session_id": session_id})["version"] == payload["version"]
@@ -0,0 +1,55 @@
+# tests/test_tiles.py
+# Version: 1.0
+# Tile pyramid level and viewport tile selection (tiles.py)
+
+import tiles
+
+# 4000x2000 map in 256px tiles, finest level first as build_pyramid writes it
+META = {
+    "width": 4000, "height": 2000, "tile_size": 256, "format": 'webp',
+    "levels": [
+        {"level": 0, "width": 4000, "height": 2000, "cols": 16, "rows": 8},
+        {"level": 1, "width": 2000, "height": 1000, "cols": 8, "rows": 4},
+        {"level": 2, "width": 1000, "height": 500, "cols": 4, "rows": 2},
+        {"level": 3, "width": 500, "height": 250, "cols": 2, "rows": 1},
+    ]
+}
+
+def test_select_level_picks_coarsest_sufficient_level():
+    assert tiles.select_level(META, 200)['level'] == 3
+    assert tiles.select_level(META, 250)['level'] == 3
+    assert tiles.select_level(META, 251)['level'] == 2
+    assert tiles.select_level(META, 1000)['level'] == 1
+
+def test_select_level_falls_back_to_finest_level_when_none_is_large_enough():
+    assert tiles.select_level(META, 5000)['level'] == 0
+
+def test_select_level_respects_max_size():
+    assert tiles.select_level(META, 1500, max_size=2048)['level'] == 1 # Level 0 is 4000 wide
+    assert tiles.select_level(META, 100, max_size=2048)['level'] == 3
+    assert tiles.select_level(META, 100, max_size=10)['level'] == 3 # Nothing fits: coarsest level
+
+def test_select_tiles_whole_map():
+    selection = tiles.select_tiles(META, 0.5, 0.5, 1.0, 1000, 500)
+    assert (selection['level'], selection['width'], selection['height']) == (2, 1000, 500)
+    assert (selection['tile_size'], selection['format']) == (256, 'webp')
+    assert sorted((t['col'], t['row']) for t in selection['tiles']) == [(c, r) for c in range(4) for r in range(2)]
+    assert all((t['x'], t['y']) == (t['col'] * 256, t['row'] * 256) for t in selection['tiles'])
+
+def test_select_tiles_zoomed_view_only_covers_visible_tiles():
+    # Scale 4 on a 1000x500 viewport shows the middle quarter of each axis at level 0 resolution
+    selection = tiles.select_tiles(META, 0.5, 0.5, 4.0, 1000, 500)
+    assert selection['level'] == 0
+    cols = {t['col'] for t in selection['tiles']}; rows = {t['row'] for t in selection['tiles']}
+    assert cols == set(range(5, 10)) # x 1500..2500 px
+    assert rows == {2, 3, 4} # y 750..1250 px
+
+def test_select_tiles_clamps_to_map_edges():
+    selection = tiles.select_tiles(META, 0.0, 0.0, 4.0, 1000, 500)
+    assert min(t['col'] for t in selection['tiles']) == 0 and min(t['row'] for t in selection['tiles']) == 0
+    assert max(t['col'] for t in selection['tiles']) == 1 and max(t['row'] for t in selection['tiles']) == 0 # x 0..500, y 0..250 px
+
+def test_select_tiles_off_map_view_has_no_tiles():
+    selection = tiles.select_tiles(META, 5.0, 5.0, 4.0, 1000, 500)
+    assert selection['tiles'] == []
+    assert selection['level'] == 0
@@ -0,0 +1,79 @@
+# tests/test_update_scheduler.py
+# Version: 1.0
+# Coalescing of bursty GM updates (update_scheduler.py)
+
+import asyncio
+
+from update_scheduler import AsyncUpdateScheduler, UpdateScheduler, merge_delta
+
+class ManualTasks:
+    # Stands in for start_background_task: delayed flushes only run when the test says so
+    def __init__(self): self.tasks = []
+    def __call__(self, fn, *args): self.tasks.append((fn, args))
+    def run_all(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks: fn(*args)
+
+def make_scheduler(max_rate_hz=10.0):
+    applied = []; tasks = ManualTasks()
+    scheduler = UpdateScheduler(lambda session_id, delta: applied.append((session_id, delta)), max_rate_hz, start_background_task=tasks, sleep=lambda seconds: None)
+    return scheduler, applied, tasks
+
+def test_merge_delta_is_last_writer_wins_and_copies_nested_dicts():
+    nested = {"scale": 2.0}
+    base = merge_delta({}, {"view_state": nested, "current_filter": "none"})
+    merge_delta(base, {"view_state": {"center_x": 0.1}, "current_filter": "retro"})
+    assert base == {"view_state": {"scale": 2.0, "center_x": 0.1}, "current_filter": "retro"}
+    assert nested == {"scale": 2.0}
+
+def test_first_update_is_applied_immediately():
+    scheduler, applied, tasks = make_scheduler()
+    scheduler.submit('s1', {"view_state": {"scale": 1.5}})
+    assert applied == [('s1', {"view_state": {"scale": 1.5}})] and tasks.tasks == []
+
+def test_burst_within_interval_is_coalesced_into_one_apply():
+    scheduler, applied, tasks = make_scheduler()
+    scheduler.submit('s1', {"view_state": {"scale": 1.0}})
+    for x in (0.1, 0.2, 0.3): scheduler.submit('s1', {"view_state": {"center_x": x}})
+    scheduler.submit('s1', {"current_filter": "retro"})
+    assert len(applied) == 1 and len(tasks.tasks) == 1 # One delayed flush however many updates arrive
+    tasks.run_all()
+    assert applied[1] == ('s1', {"view_state": {"center_x": 0.3}, "current_filter": "retro"})
+
+def test_sessions_are_coalesced_independently():
+    scheduler, applied, tasks = make_scheduler()
+    scheduler.submit('s1', {"a": 1}); scheduler.submit('s2', {"a": 1})
+    scheduler.submit('s1', {"a": 2}); scheduler.submit('s2', {"a": 3})
+    tasks.run_all()
+    assert [delta for session_id, delta in applied if session_id == 's1'] == [{"a": 1}, {"a": 2}]
+    assert [delta for session_id, delta in applied if session_id == 's2'] == [{"a": 1}, {"a": 3}]
+
+def test_immediate_update_flushes_pending_first():
+    scheduler, applied, tasks = make_scheduler()
+    scheduler.submit('s1', {"a": 1}); scheduler.submit('s1', {"view_state": {"scale": 2.0}})
+    scheduler.submit('s1', {"map_content_path": "maps/b.png"}, immediate=True)
+    assert applied[1:] == [('s1', {"view_state": {"scale": 2.0}}), ('s1', {"map_content_path": "maps/b.png"})]
+    tasks.run_all() # The delayed flush finds nothing left to apply
+    assert len(applied) == 3
+
+def test_zero_rate_disables_coalescing():
+    scheduler, applied, tasks = make_scheduler(max_rate_hz=0)
+    for x in (0.1, 0.2, 0.3): scheduler.submit('s1', {"view_state": {"center_x": x}})
+    assert [delta["view_state"]["center_x"] for _, delta in applied] == [0.1, 0.2, 0.3] and tasks.tasks == []
+
+def test_forget_drops_pending_updates():
+    scheduler, applied, tasks = make_scheduler()
+    scheduler.submit('s1', {"a": 1}); scheduler.submit('s1', {"a": 2})
+    scheduler.forget('s1'); tasks.run_all()
+    assert applied == [('s1', {"a": 1})]
+
+def test_async_scheduler_coalesces_bursts():
+    applied = []
+    async def apply(session_id, delta): applied.append((session_id, delta))
+    async def run():
+        scheduler = AsyncUpdateScheduler(apply, max_rate_hz=50.0)
+        await scheduler.submit('s1', {"a": 1})
+        for value in (2, 3, 4): await scheduler.submit('s1', {"a": value, "b": {"c": value}})
+        await asyncio.sleep(0.2) # Several flush intervals
+    asyncio.run(run())
+    assert applied == [('s1', {"a": 1}), ('s1', {"a": 4, "b": {"c": 4}})]
@@ -0,0 +1,120 @@
+# tiles.py
+# Version: 1.1 (Source Content Hash in Metadata)
+# Multi-resolution tile pyramid generation and viewport tile selection for map images
+
+import os
+import json
+import math
+import shutil
+from PIL import Image
+
+TILE_SIZE = 512
+META_FILENAME = 'meta.json'
+JPEG_QUALITY = 85
+
+# --- Pyramid Metadata ---
+def get_pyramid_dir(tiles_root, map_filename):
+    return os.path.join(tiles_root, map_filename)
+
+def load_pyramid_meta(tiles_root, map_filename, source_path=None):
+    # Returns the stored metadata, or None if missing or stale relative to the source image
+    meta_path = os.path.join(get_pyramid_dir(tiles_root, map_filename), META_FILENAME)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f: meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if source_path is not None:
+        try: st = os.stat(source_path)
+        except OSError: return None
+        if meta.get('source_mtime_ns') != st.st_mtime_ns or meta.get('source_size') != st.st_size: return None
+    return meta
+
+# --- Pyramid Generation ---
+def build_tile_pyramid(source_path, tiles_root, map_filename, tile_size=TILE_SIZE, source_hash=None):
+    # Level 0 is full resolution; each following level halves both dimensions until the
+    # whole image fits in a single tile. Built into a temp dir and swapped in at the end
+    # so readers never see a half-written pyramid.
+    st = os.stat(source_path)
+    final_dir = get_pyramid_dir(tiles_root, map_filename)
+    work_dir = f"{final_dir}.tmp-{os.getpid()}"
+    if os.path.exists(work_dir): shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    try:
+        with Image.open(source_path) as src:
+            has_alpha = src.mode in ('RGBA', 'LA', 'PA') or (src.mode == 'P' and 'transparency' in src.info)
+            image = src.convert('RGBA' if has_alpha else 'RGB')
+        tile_format = 'png' if has_alpha else 'jpg'
+        levels = []
+        level = 0
+        while True:
+            width, height = image.size
+            cols = math.ceil(width / tile_size); rows = math.ceil(height / tile_size)
+            level_dir = os.path.join(work_dir, str(level))
+            os.makedirs(level_dir)
+            for row in range(rows):
+                for col in range(cols):
+                    box = (col * tile_size, row * tile_size, min((col + 1) * tile_size, width), min((row + 1) * tile_size, height))
+                    tile = image.crop(box)
+                    tile_path = os.path.join(level_dir, f"{col}_{row}.{tile_format}")
+                    if tile_format == 'jpg': tile.save(tile_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+                    else: tile.save(tile_path, 'PNG', optimize=True)
+            levels.append({"level": level, "width": width, "height": height, "cols": cols, "rows": rows})
+            if width <= tile_size and height <= tile_size: break
+            image = image.reduce(2)
+            level += 1
+        meta = {
+            "map_filename": map_filename,
+            "source_mtime_ns": st.st_mtime_ns,
+            "source_size": st.st_size,
+            "source_hash": source_hash, # Used to version tile URLs for immutable HTTP caching
+            "width": levels[0]["width"],
+            "height": levels[0]["height"],
+            "tile_size": tile_size,
+            "format": tile_format,
+            "levels": levels
+        }
+        with open(os.path.join(work_dir, META_FILENAME), 'w', encoding='utf-8') as f: json.dump(meta, f, indent=2)
+        if os.path.exists(final_dir): shutil.rmtree(final_dir)
+        os.replace(work_dir, final_dir)
+        return meta
+    except Exception:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+# --- Viewport Selection ---
+def select_level(meta, required_height, max_size=None):
+    # Coarsest level that still has at least `required_height` pixels, limited to levels
+    # whose dimensions fit within `max_size` (e.g. the client's max texture size)
+    levels = meta['levels']
+    allowed = [lvl for lvl in levels if not max_size or (lvl['width'] <= max_size and lvl['height'] <= max_size)]
+    if not allowed: allowed = [levels[-1]]
+    for lvl in reversed(allowed):
+        if lvl['height'] >= required_height: return lvl
+    return allowed[0]
+
+def select_tiles(meta, center_x, center_y, scale, viewport_width, viewport_height, max_size=None):
+    # Mirrors the player camera: the map plane is 1 unit tall and scale=1 fits its height to the screen
+    scale = max(0.01, scale)
+    viewport_width = max(1, viewport_width); viewport_height = max(1, viewport_height)
+    image_aspect = meta['width'] / meta['height']
+    visible_h = 1.0 / scale
+    visible_w = (viewport_width / viewport_height) / (scale * image_aspect)
+    x0 = max(0.0, center_x - visible_w / 2); x1 = min(1.0, center_x + visible_w / 2)
+    y0 = max(0.0, center_y - visible_h / 2); y1 = min(1.0, center_y + visible_h / 2)
+    lvl = select_level(meta, viewport_height * scale, max_size)
+    tile_size = meta['tile_size']
+    tiles = []
+    if x1 > x0 and y1 > y0:
+        col0 = int(x0 * lvl['width'] // tile_size); col1 = min(lvl['cols'] - 1, int(math.ceil(x1 * lvl['width'] / tile_size)) - 1)
+        row0 = int(y0 * lvl['height'] // tile_size); row1 = min(lvl['rows'] - 1, int(math.ceil(y1 * lvl['height'] / tile_size)) - 1)
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                tiles.append({"col": col, "row": row, "x": col * tile_size, "y": row * tile_size})
+    return {
+        "level": lvl['level'],
+        "width": lvl['width'],
+        "height": lvl['height'],
+        "tile_size": tile_size,
+        "format": meta['format'],
+        "tiles": tiles
+    }
@@ -0,0 +1,109 @@
+# update_scheduler.py
+# Version: 1.1 (Async Variant)
+# Per-session coalescing of GM update deltas, flushed at a bounded rate
+
+import time
+import asyncio
+import threading
+
+def merge_delta(base, delta):
+    # Last-writer-wins deep merge into `base` (modified in place)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict): merge_delta(base[key], value)
+        elif isinstance(value, dict): base[key] = merge_delta({}, value)
+        else: base[key] = value
+    return base
+
+class UpdateScheduler:
+    # Incoming deltas for a session are merged into a pending buffer; the buffer is applied
+    # at most `max_rate_hz` times per second. Immediate submissions (e.g. map changes) first
+    # flush whatever is pending, then apply straight away, preserving order.
+    def __init__(self, apply_fn, max_rate_hz=30.0, start_background_task=None, sleep=time.sleep):
+        self.apply_fn = apply_fn
+        self.interval = 1.0 / max_rate_hz if max_rate_hz and max_rate_hz > 0 else 0.0
+        self.start_background_task = start_background_task or (lambda fn, *args: threading.Thread(target=fn, args=args, daemon=True).start())
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.pending = {}          # session_id -> merged delta awaiting flush
+        self.last_flush = {}       # session_id -> monotonic time of last flush
+        self.flush_scheduled = set()
+        self.session_locks = {}    # session_id -> lock serializing applies for that session
+
+    def _session_lock(self, session_id):
+        with self.lock: return self.session_locks.setdefault(session_id, threading.Lock())
+
+    def submit(self, session_id, delta, immediate=False):
+        if immediate:
+            with self._session_lock(session_id):
+                with self.lock:
+                    pending = self.pending.pop(session_id, None); self.last_flush[session_id] = time.monotonic()
+                if pending: self.apply_fn(session_id, pending)
+                self.apply_fn(session_id, delta)
+            return
+        with self.lock:
+            merge_delta(self.pending.setdefault(session_id, {}), delta)
+            wait = self.interval - (time.monotonic() - self.last_flush.get(session_id, 0.0))
+            if wait > 0:
+                if session_id not in self.flush_scheduled:
+                    self.flush_scheduled.add(session_id)
+                    self.start_background_task(self._flush_later, session_id, wait)
+                return
+        self.flush(session_id)
+
+    def _flush_later(self, session_id, wait):
+        self.sleep(wait)
+        with self.lock: self.flush_scheduled.discard(session_id)
+        self.flush(session_id)
+
+    def flush(self, session_id):
+        with self._session_lock(session_id):
+            with self.lock:
+                pending = self.pending.pop(session_id, None); self.last_flush[session_id] = time.monotonic()
+            if pending: self.apply_fn(session_id, pending)
+
+    def forget(self, session_id):
+        # Drop bookkeeping for a session that no longer exists
+        with self.lock:
+            self.pending.pop(session_id, None); self.last_flush.pop(session_id, None); self.session_locks.pop(session_id, None)
+
+class AsyncUpdateScheduler:
+    # asyncio counterpart of UpdateScheduler for the ASGI server; `apply_fn` is a coroutine function
+    def __init__(self, apply_fn, max_rate_hz=30.0):
+        self.apply_fn = apply_fn
+        self.interval = 1.0 / max_rate_hz if max_rate_hz and max_rate_hz > 0 else 0.0
+        self.pending = {}
+        self.last_flush = {}
+        self.flush_tasks = {}      # session_id -> scheduled delayed flush task
+        self.session_locks = {}
+
+    def _session_lock(self, session_id):
+        return self.session_locks.setdefault(session_id, asyncio.Lock())
+
+    async def submit(self, session_id, delta, immediate=False):
+        if immediate:
+            async with self._session_lock(session_id):
+                pending = self.pending.pop(session_id, None); self.last_flush[session_id] = time.monotonic()
+                if pending: await self.apply_fn(session_id, pending)
+                await self.apply_fn(session_id, delta)
+            return
+        merge_delta(self.pending.setdefault(session_id, {}), delta)
+        wait = self.interval - (time.monotonic() - self.last_flush.get(session_id, 0.0))
+        if wait > 0:
+            if session_id not in self.flush_tasks: self.flush_tasks[session_id] = asyncio.ensure_future(self._flush_later(session_id, wait))
+            return
+        await self.flush(session_id)
+
+    async def _flush_later(self, session_id, wait):
+        await asyncio.sleep(wait)
+        self.flush_tasks.pop(session_id, None)
+        await self.flush(session_id)
+
+    async def flush(self, session_id):
+        async with self._session_lock(session_id):
+            pending = self.pending.pop(session_id, None); self.last_flush[session_id] = time.monotonic()
+            if pending: await self.apply_fn(session_id, pending)
+
+    def forget(self, session_id):
+        self.pending.pop(session_id, None); self.last_flush.pop(session_id, None); self.session_locks.pop(session_id, None)
+        task = self.flush_tasks.pop(session_id, None)
+        if task: task.cancel()